@@ -15,6 +15,7 @@ from posix.types cimport *
 from libc_extra cimport statvfs
 from libc.stdlib cimport const_char
 from libc.stdint cimport uint32_t
+from posix.uio cimport iovec
 
 # Based on fuse sources, revision tag fuse-3.2.6
 cdef extern from "<fuse_lowlevel.h>" nogil:
@@ -135,6 +136,7 @@ cdef extern from "<fuse_lowlevel.h>" nogil:
     int fuse_reply_buf(fuse_req_t req, const_char *buf, size_t size)
     int fuse_reply_data(fuse_req_t req, fuse_bufvec *bufv,
                         fuse_buf_copy_flags flags)
+    int fuse_reply_iov(fuse_req_t req, const iovec *iov, int count)
     int fuse_reply_statfs(fuse_req_t req, statvfs *stbuf)
     int fuse_reply_xattr(fuse_req_t req, size_t count)
 
@@ -162,6 +164,7 @@ cdef extern from "<fuse_lowlevel.h>" nogil:
     void *fuse_req_userdata(fuse_req_t req)
     fuse_ctx *fuse_req_ctx(fuse_req_t req)
     int fuse_req_getgroups(fuse_req_t req, size_t size, gid_t list[])
+    int fuse_req_interrupted(fuse_req_t req)
 
 
     # Inquiry functions
@@ -184,3 +187,10 @@ cdef extern from "<fuse_lowlevel.h>" nogil:
     int fuse_session_fd(fuse_session *se)
     int fuse_session_receive_buf(fuse_session *se, fuse_buf *buf)
     void fuse_session_process_buf(fuse_session *se, fuse_buf *buf) except *
+
+# The interrupt function is called with the GIL held (since it is called
+# from within fuse_session_process_buf()).
+cdef extern from "<fuse_lowlevel.h>":
+    ctypedef void (*fuse_interrupt_func_t)(fuse_req_t req, void *data) except *
+    void fuse_req_interrupt_func(fuse_req_t req, fuse_interrupt_func_t func,
+                                 void *data) except *
@@ -59,6 +59,10 @@ cdef extern from "xattr.h" nogil:
 
 cdef extern from "gettime.h" nogil:
     int gettime_realtime(timespec *tp)
+    int gettime_monotonic(timespec *tp)
 
 cdef extern from "<unistd.h>" nogil:
     int syncfs(int fd)
+
+cdef extern from "<stdlib.h>" nogil:
+    int posix_memalign(void **memptr, size_t alignment, size_t size)
@@ -131,6 +131,8 @@ def parse_args():
                         help='Enable debugging output')
     parser.add_argument('--debug-fuse', action='store_true', default=False,
                         help='Enable FUSE debugging output')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='Number of threads (and event loops) to use')
     return parser.parse_args()
 
 
@@ -145,7 +147,10 @@ def main():
         fuse_options.add('debug')
     pyfuse3.init(testfs, options.mountpoint, fuse_options)
     try:
-        trio.run(pyfuse3.main)
+        if options.threads > 1:
+            trio.run(pyfuse3.main_mt, options.threads)
+        else:
+            trio.run(pyfuse3.main)
     except:
         pyfuse3.close(unmount=False)
         raise
@@ -378,7 +378,7 @@ class Operations(pyfuse3.Operations):
         if inode in self._inode_fd_map:
             fd = self._inode_fd_map[inode]
             self._fd_open_count[fd] += 1
-            return pyfuse3.FileInfo(fh=fd)
+            return pyfuse3.FileInfo(fh=fd, backing_fd=fd)
         assert flags & os.O_CREAT == 0
         try:
             fd = os.open(self._inode_to_path(inode), flags)
@@ -387,7 +387,7 @@ class Operations(pyfuse3.Operations):
         self._inode_fd_map[inode] = fd
         self._fd_inode_map[fd] = inode
         self._fd_open_count[fd] = 1
-        return pyfuse3.FileInfo(fh=fd)
+        return pyfuse3.FileInfo(fh=fd, backing_fd=fd)
 
     async def create(self, inode_p, name, mode, flags, ctx):
         path = os.path.join(self._inode_to_path(inode_p), fsdecode(name))
@@ -400,7 +400,7 @@ class Operations(pyfuse3.Operations):
         self._inode_fd_map[attr.st_ino] = fd
         self._fd_inode_map[fd] = attr.st_ino
         self._fd_open_count[fd] = 1
-        return (pyfuse3.FileInfo(fh=fd), attr)
+        return (pyfuse3.FileInfo(fh=fd, backing_fd=fd), attr)
 
     async def read(self, fd, offset, length):
         os.lseek(fd, offset, os.SEEK_SET)
@@ -452,6 +452,9 @@ def parse_args(args):
                         help='Enable debugging output')
     parser.add_argument('--debug-fuse', action='store_true', default=False,
                         help='Enable FUSE debugging output')
+    parser.add_argument('--passthrough', action='store_true', default=False,
+                        help='Let the kernel read and write files directly '
+                        '(if supported)')
 
     return parser.parse_args(args)
 
@@ -459,6 +462,7 @@ def main():
     options = parse_args(sys.argv[1:])
     init_logging(options.debug)
     operations = Operations(options.source)
+    operations.enable_passthrough = options.passthrough
 
     log.debug('Mounting...')
     fuse_options = set(pyfuse3.default_options)
@@ -12,6 +12,13 @@ the terms of the GNU LGPL.
 # re-exports
 from ._pyfuse3 import (
     Operations as Operations,
+    sync_handler as sync_handler,
+    ignores_ctx as ignores_ctx,
+    WorkerScheduler as WorkerScheduler,
+    AdaptiveScheduler as AdaptiveScheduler,
+    RequestTracer as RequestTracer,
+    BlockCacheMixin as BlockCacheMixin,
+    WriteCoalescingMixin as WriteCoalescingMixin,
     FileHandleT as FileHandleT,
     FileNameT as FileNameT,
     FlagT as FlagT,
@@ -20,9 +27,30 @@ from ._pyfuse3 import (
     XAttrNameT as XAttrNameT
 )
 from trio.lowlevel import TrioToken
-from typing import List, Literal, Mapping, Optional, Union
+from typing import (Any, AsyncIterable, Callable, Dict, Iterable, List, Literal,
+                    Mapping, Optional, Union)
 
 ENOATTR: int
+FUSE_CAP_ASYNC_READ: int
+FUSE_CAP_POSIX_LOCKS: int
+FUSE_CAP_ATOMIC_O_TRUNC: int
+FUSE_CAP_EXPORT_SUPPORT: int
+FUSE_CAP_DONT_MASK: int
+FUSE_CAP_SPLICE_WRITE: int
+FUSE_CAP_SPLICE_MOVE: int
+FUSE_CAP_SPLICE_READ: int
+FUSE_CAP_FLOCK_LOCKS: int
+FUSE_CAP_IOCTL_DIR: int
+FUSE_CAP_AUTO_INVAL_DATA: int
+FUSE_CAP_READDIRPLUS: int
+FUSE_CAP_READDIRPLUS_AUTO: int
+FUSE_CAP_ASYNC_DIO: int
+FUSE_CAP_WRITEBACK_CACHE: int
+FUSE_CAP_NO_OPEN_SUPPORT: int
+FUSE_CAP_PARALLEL_DIROPS: int
+FUSE_CAP_POSIX_ACL: int
+FUSE_CAP_HANDLE_KILLPRIV: int
+FUSE_CAP_PASSTHROUGH: int
 RENAME_EXCHANGE: FlagT
 RENAME_NOREPLACE: FlagT
 ROOT_INODE: InodeT
@@ -30,6 +58,7 @@ trio_token: Optional[TrioToken]
 __version__: str
 
 NamespaceT = Literal["system", "user"]
+LaneT = Literal["metadata", "data", "xattr"]
 StatDict = Mapping[str, int]
 
 default_options: frozenset[str]
@@ -49,6 +78,30 @@ class RequestContext:
 
     def __getstate__(self) -> None: ...
 
+class TraceEvent:
+    @property
+    def op(self) -> str: ...
+    @property
+    def inode(self) -> InodeT: ...
+    @property
+    def fh(self) -> FileHandleT: ...
+    @property
+    def offset(self) -> int: ...
+    @property
+    def size(self) -> int: ...
+    @property
+    def pid(self) -> int: ...
+    @property
+    def uid(self) -> int: ...
+    @property
+    def start_ns(self) -> int: ...
+    @property
+    def end_ns(self) -> int: ...
+    @property
+    def errno(self) -> int: ...
+
+    def __getstate__(self) -> None: ...
+
 class SetattrFields:
     @property
     def update_atime(self) -> bool: ...
@@ -96,8 +149,32 @@ class FileInfo:
     direct_io: bool
     keep_cache: bool
     nonseekable: bool
+    backing_fd: int
+
+    def __init__(self, fh: FileHandleT = ..., direct_io: bool = ..., keep_cache: bool = ..., nonseekable: bool = ..., backing_fd: int = ...) -> None: ...
+
+class ConnectionInfo:
+    @property
+    def proto_major(self) -> int: ...
+    @property
+    def proto_minor(self) -> int: ...
+    @property
+    def capable(self) -> int: ...
+    @property
+    def max_read(self) -> int: ...
+    want: int
+    max_write: int
+    max_readahead: int
+    max_background: int
+    congestion_threshold: int
+    time_gran: int
+
+class FileRange:
+    fd: int
+    offset: int
+    length: int
 
-    def __init__(self, fh: FileHandleT = ..., direct_io: bool = ..., keep_cache: bool = ..., nonseekable: bool = ...) -> None: ...
+    def __init__(self, fd: int, offset: int, length: int) -> None: ...
 
 class StatvfsData:
     f_bsize: int
@@ -128,12 +205,20 @@ def syncfs(path: str) -> str: ...
 def setxattr(path: str, name: str, value: bytes, namespace: NamespaceT = ...) -> None: ...
 def getxattr(path: str, name: str, size_guess: int = ..., namespace: NamespaceT = ...) -> bytes: ...
 def init(ops: Operations, mountpoint: str, options: set[str] = ...) -> None: ...
-async def main(min_tasks: int = ..., max_tasks: int = ...) -> None: ...
+async def main(min_tasks: int = ..., max_tasks: int = ..., batch_size: int = ..., scheduler: Optional[WorkerScheduler] = ..., lanes: Optional[Mapping[LaneT, int]] = ...) -> None: ...
+async def main_mt(threads: int = ..., min_tasks: int = ..., max_tasks: int = ..., batch_size: int = ..., lanes: Optional[Mapping[LaneT, int]] = ...) -> None: ...
 def terminate() -> None: ...
 def close(unmount: bool = ...) -> None: ...
 def invalidate_inode(inode: InodeT, attr_only: bool = ...) -> None: ...
 def invalidate_entry(inode_p: InodeT, name: FileNameT, deleted: InodeT = ...) -> None: ...
 def invalidate_entry_async(inode_p: InodeT, name: FileNameT, deleted: InodeT = ..., ignore_enoent: bool = ...) -> None: ...
 def notify_store(inode: InodeT, offset: int, data: bytes) -> None: ...
+async def notify_store_stream(inode: InodeT, offset: int, data: Union[Iterable[bytes], AsyncIterable[bytes]], chunk_size: int = ..., progress: Optional[Callable[[int], None]] = ...) -> int: ...
+async def retrieve(inode: InodeT, offset: int, size: int) -> bytes: ...
+def get_connection_info() -> Optional[Dict[str, int]]: ...
+def get_stats() -> Dict[str, Any]: ...
+def reset_stats() -> None: ...
+def get_buffer_stats() -> Dict[str, int]: ...
+def set_tracer(new_tracer: Optional[RequestTracer]) -> None: ...
 def get_sup_groups(pid: int) -> set[int]: ...
 def readdir_reply(token: ReaddirToken, name: FileNameT, attr: EntryAttributes, next_id: int) -> bool: ...
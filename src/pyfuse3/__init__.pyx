@@ -13,6 +13,7 @@ cdef extern from "pyfuse3.h":
         PLATFORM_LINUX
         PLATFORM_BSD
         PLATFORM_DARWIN
+    void *pyfuse3_worker_data
 
 ###########
 # C IMPORTS
@@ -22,17 +23,20 @@ from fuse_lowlevel cimport *
 from .macros cimport *
 from posix.stat cimport struct_stat, S_IFMT, S_IFDIR, S_IFREG
 from posix.types cimport mode_t, dev_t, off_t
-from libc.stdint cimport uint32_t
+from libc.stdint cimport uint32_t, uint64_t, uintptr_t
+from libc.limits cimport INT_MAX
 from libc.stdlib cimport const_char
 from libc cimport stdlib, string, errno
 from posix cimport unistd
 from libc.errno cimport EACCES, ETIMEDOUT, EPROTO, EINVAL, ENOMSG, ENOATTR
 from posix.unistd cimport getpid
 from posix.time cimport timespec
+from posix.uio cimport iovec
 from cpython.bytes cimport (PyBytes_AsStringAndSize, PyBytes_FromStringAndSize,
                             PyBytes_AsString, PyBytes_FromString, PyBytes_AS_STRING)
 from cpython.buffer cimport (PyObject_GetBuffer, PyBuffer_Release,
-                             PyBUF_CONTIG_RO, PyBUF_CONTIG)
+                             PyBuffer_FillInfo, PyBUF_CONTIG_RO, PyBUF_CONTIG)
+from cpython.memoryview cimport PyMemoryView_Check
 cimport cpython.exc
 cimport cython
 cimport libc_extra
@@ -61,19 +65,24 @@ cdef extern from *:
 
 from pickle import PicklingError
 from queue import Queue
+import collections
+import inspect
 import logging
 import os
 import os.path
 import sys
 import trio
 import threading
+import time
 import typing
 
 from . import _pyfuse3
 _pyfuse3.FUSEError = FUSEError
 
-from ._pyfuse3 import (Operations, async_wrapper, FileHandleT, FileNameT,
-                       FlagT, InodeT, ModeT, XAttrNameT)
+from ._pyfuse3 import (Operations, async_wrapper, sync_handler, ignores_ctx,
+                       FileHandleT, FileNameT, FlagT, InodeT, ModeT, XAttrNameT,
+                       WorkerScheduler, AdaptiveScheduler, RequestTracer,
+                       BlockCacheMixin, WriteCoalescingMixin)
 
 
 ##################
@@ -88,7 +97,6 @@ cdef object mountpoint_b
 cdef fuse_session* session = NULL
 cdef fuse_lowlevel_ops fuse_ops
 cdef int session_fd
-cdef object py_retval
 
 cdef object _notify_queue = None
 
@@ -104,6 +112,28 @@ g['ENOATTR'] = ENOATTR
 g['RENAME_EXCHANGE'] = RENAME_EXCHANGE
 g['RENAME_NOREPLACE'] = RENAME_NOREPLACE
 
+# Capability flags for ConnectionInfo.capable and ConnectionInfo.want
+g['FUSE_CAP_ASYNC_READ'] = FUSE_CAP_ASYNC_READ
+g['FUSE_CAP_POSIX_LOCKS'] = FUSE_CAP_POSIX_LOCKS
+g['FUSE_CAP_ATOMIC_O_TRUNC'] = FUSE_CAP_ATOMIC_O_TRUNC
+g['FUSE_CAP_EXPORT_SUPPORT'] = FUSE_CAP_EXPORT_SUPPORT
+g['FUSE_CAP_DONT_MASK'] = FUSE_CAP_DONT_MASK
+g['FUSE_CAP_SPLICE_WRITE'] = FUSE_CAP_SPLICE_WRITE
+g['FUSE_CAP_SPLICE_MOVE'] = FUSE_CAP_SPLICE_MOVE
+g['FUSE_CAP_SPLICE_READ'] = FUSE_CAP_SPLICE_READ
+g['FUSE_CAP_FLOCK_LOCKS'] = FUSE_CAP_FLOCK_LOCKS
+g['FUSE_CAP_IOCTL_DIR'] = FUSE_CAP_IOCTL_DIR
+g['FUSE_CAP_AUTO_INVAL_DATA'] = FUSE_CAP_AUTO_INVAL_DATA
+g['FUSE_CAP_READDIRPLUS'] = FUSE_CAP_READDIRPLUS
+g['FUSE_CAP_READDIRPLUS_AUTO'] = FUSE_CAP_READDIRPLUS_AUTO
+g['FUSE_CAP_ASYNC_DIO'] = FUSE_CAP_ASYNC_DIO
+g['FUSE_CAP_WRITEBACK_CACHE'] = FUSE_CAP_WRITEBACK_CACHE
+g['FUSE_CAP_NO_OPEN_SUPPORT'] = FUSE_CAP_NO_OPEN_SUPPORT
+g['FUSE_CAP_PARALLEL_DIROPS'] = FUSE_CAP_PARALLEL_DIROPS
+g['FUSE_CAP_POSIX_ACL'] = FUSE_CAP_POSIX_ACL
+g['FUSE_CAP_HANDLE_KILLPRIV'] = FUSE_CAP_HANDLE_KILLPRIV
+g['FUSE_CAP_PASSTHROUGH'] = CAP_PASSTHROUGH
+
 trio_token = None
 
 
@@ -125,7 +155,9 @@ include "internal.pxi"
 # EXTERNAL API       #
 ######################
 
-@cython.freelist(10)
+# Every in-flight request may hold one instance, so make the freelist
+# large enough for the default number of workers.
+@cython.freelist(100)
 cdef class RequestContext:
     '''
     Instances of this class are passed to some `Operations` methods to
@@ -142,6 +174,49 @@ cdef class RequestContext:
         raise PicklingError("RequestContext instances can't be pickled")
 
 
+@cython.freelist(10)
+cdef class TraceEvent:
+    '''
+    Instances of this class are passed to the methods of a `RequestTracer`
+    to describe a request.
+
+    *op* is the name of the `Operations` method that handles the request.
+    *inode* is the inode that the request refers to (for requests that refer
+    to a directory entry, this is the inode of the directory). *fh*, *offset*
+    and *size* are only meaningful for requests that have such parameters
+    and zero otherwise. *pid* and *uid* identify the process that issued the
+    request.
+
+    *start_ns* and *end_ns* are timestamps from a monotonic clock (in
+    nanoseconds). *errno* is the error code that the request has been
+    answered with (zero for success). *end_ns* and *errno* are only set when
+    the event is passed to `RequestTracer.on_request_end`.
+    '''
+
+    cdef readonly object op
+    cdef readonly fuse_ino_t inode
+    cdef readonly uint64_t fh
+    cdef readonly off_t offset
+    cdef readonly size_t size
+    cdef readonly pid_t pid
+    cdef readonly uid_t uid
+    cdef readonly uint64_t start_ns
+    cdef readonly uint64_t end_ns
+
+    # Cf. FUSEError
+    cdef int errno_
+
+    # The tracer that on_request_start() was called for
+    cdef object tracer
+
+    @property
+    def errno(self):
+        return self.errno_
+
+    def __getstate__(self):
+        raise PicklingError("TraceEvent instances can't be pickled")
+
+
 @cython.freelist(10)
 cdef class SetattrFields:
     '''
@@ -362,12 +437,15 @@ cdef class FileInfo:
     cdef public bint direct_io
     cdef public bint keep_cache
     cdef public bint nonseekable
+    cdef public int backing_fd
 
-    def __cinit__(self, fh=0, direct_io=0, keep_cache=1, nonseekable=0):
+    def __cinit__(self, fh=0, direct_io=0, keep_cache=1, nonseekable=0,
+                  backing_fd=-1):
         self.fh = fh
         self.direct_io = direct_io
         self.keep_cache = keep_cache
         self.nonseekable = nonseekable
+        self.backing_fd = backing_fd
 
     cdef _copy_to_fuse(self, fuse_file_info *out):
         out.fh = self.fh
@@ -391,6 +469,153 @@ cdef class FileInfo:
             out.nonseekable = 0
 
 
+cdef class ConnectionInfo:
+    '''
+    Instances of this class are passed to `Operations.init` and describe
+    the connection to the FUSE kernel module.
+
+    *capable* is the set of capabilities that are supported by the kernel
+    and libfuse, and *want* the set of capabilities that will be used (both
+    as bitmasks of the ``FUSE_CAP_*`` constants). When `Operations.init` is
+    called, *want* already reflects the attributes of the `Operations`
+    instance (e.g. `Operations.enable_writeback_cache`) and may be modified
+    further. The same holds for *max_write*, *max_readahead*,
+    *max_background*, *congestion_threshold* and *time_gran*. Values that
+    are out of range (cf. `Operations.max_background` etc.) raise
+    `ValueError`; *congestion_threshold* must not exceed *max_background*.
+
+    ``FUSE_CAP_READDIRPLUS`` is always used (and ``FUSE_CAP_READDIRPLUS_AUTO``
+    never), since pyfuse3 implements `Operations.readdir` on top of
+    ``READDIRPLUS`` requests.
+
+    After `Operations.init` has returned, the attributes are read-only and
+    reflect the parameters that have finally been negotiated with the
+    kernel (cf. `get_connection_info`).
+    '''
+
+    # True while Operations.init() is running
+    cdef bint writable
+
+    cdef fuse_conn_info* _get(self) except NULL:
+        if conn_info is NULL:
+            raise RuntimeError('Connection has been closed')
+        return conn_info
+
+    cdef fuse_conn_info* _get_writable(self) except NULL:
+        if not self.writable:
+            raise AttributeError('Connection parameters can only be changed '
+                                 'in Operations.init()')
+        return self._get()
+
+    @property
+    def proto_major(self):
+        return self._get().proto_major
+
+    @property
+    def proto_minor(self):
+        return self._get().proto_minor
+
+    @property
+    def capable(self):
+        return self._get().capable
+
+    @property
+    def want(self):
+        return self._get().want
+    @want.setter
+    def want(self, unsigned val):
+        cdef fuse_conn_info* conn = self._get_writable()
+        if val & ~conn.capable:
+            raise ValueError('Capabilities not supported: 0x%x'
+                             % (val & ~conn.capable))
+        conn.want = val
+
+    @property
+    def max_read(self):
+        return self._get().max_read
+
+    @property
+    def max_write(self):
+        return self._get().max_write
+    @max_write.setter
+    def max_write(self, val):
+        cdef fuse_conn_info* conn = self._get_writable()
+        _pyfuse3._check_conn_limits({'max_write': val})
+        conn.max_write = val
+
+    @property
+    def max_readahead(self):
+        return self._get().max_readahead
+    @max_readahead.setter
+    def max_readahead(self, val):
+        cdef fuse_conn_info* conn = self._get_writable()
+        _pyfuse3._check_conn_limits({'max_readahead': val})
+        conn.max_readahead = val
+
+    @property
+    def max_background(self):
+        return self._get().max_background
+    @max_background.setter
+    def max_background(self, val):
+        cdef fuse_conn_info* conn = self._get_writable()
+        limits = { 'max_background': val }
+        if conn.congestion_threshold:
+            limits['congestion_threshold'] = conn.congestion_threshold
+        _pyfuse3._check_conn_limits(limits)
+        conn.max_background = val
+
+    @property
+    def congestion_threshold(self):
+        return self._get().congestion_threshold
+    @congestion_threshold.setter
+    def congestion_threshold(self, val):
+        cdef fuse_conn_info* conn = self._get_writable()
+        limits = { 'congestion_threshold': val }
+        if conn.max_background:
+            limits['max_background'] = conn.max_background
+        _pyfuse3._check_conn_limits(limits)
+        conn.congestion_threshold = val
+
+    @property
+    def time_gran(self):
+        return self._get().time_gran
+    @time_gran.setter
+    def time_gran(self, unsigned val):
+        self._get_writable().time_gran = val
+
+    def __getstate__(self):
+        raise PicklingError("ConnectionInfo instances can't be pickled")
+
+
+@cython.freelist(10)
+cdef class FileRange:
+    '''
+    Instances of this class may be returned by `Operations.read` instead
+    of the data itself. They refer to *length* bytes that are to be read
+    from file descriptor *fd*, starting at *offset*. pyfuse3 then passes
+    the data from *fd* to the kernel without copying it into a Python
+    object (using :manpage:`splice(2)` if the kernel supports it).
+
+    If *fd* contains less than *length* bytes after *offset*, the reply
+    is truncated accordingly. The data is only read from *fd* when the
+    reply is sent, which happens after `Operations.read` has returned. *fd*
+    must therefore stay open until then (so it must not be closed by the
+    read handler itself), but is not closed by pyfuse3.
+    '''
+
+    cdef readonly int fd
+    cdef readonly off_t offset
+    cdef readonly size_t length
+
+    def __cinit__(self, fd, offset, length):
+        self.fd = fd
+        self.offset = offset
+        self.length = length
+
+    def __repr__(self):
+        return 'FileRange(%d, %d, %d)' % (self.fd, self.offset, self.length)
+
+
 @cython.freelist(1)
 cdef class StatvfsData:
     '''
@@ -744,10 +969,41 @@ def init(ops, mountpoint, options=default_options):
     global session
     global session_fd
     global worker_data
+    global sync_ops
+    global noctx_ops
+    global interrupts_enabled
+    global stats_enabled
+    global zero_copy_write
+    global write_to_fd_enabled
 
     worker_data = _WorkerData()
     mountpoint_b = str2bytes(os.path.abspath(mountpoint))
     operations = ops
+    interrupts_enabled = getattr(ops, 'enable_interrupts', False)
+    stats_enabled = getattr(ops, 'enable_stats', False)
+    zero_copy_write = getattr(ops, 'enable_zero_copy_write', False)
+    write_to_fd_enabled = _pyfuse3._is_implemented(ops, 'write_to_fd')
+    if write_to_fd_enabled and inspect.iscoroutinefunction(ops.write_to_fd):
+        raise ValueError('write_to_fd() handler must not be a coroutine function')
+
+    max_buffers = getattr(ops, 'max_receive_buffers', 16)
+    if not isinstance(max_buffers, int) or max_buffers < 1:
+        raise ValueError('max_receive_buffers must be a positive integer, got %r'
+                         % (max_buffers,))
+    configure_recv_pool(max_buffers)
+
+    sync_ops = 0
+    for name in _pyfuse3._sync_handlers(ops, _sync_op_flags):
+        log.debug('Calling %s() handler synchronously', name)
+        sync_ops |= _sync_op_flags[name]
+
+    _conn_limits.clear()
+    _conn_limits.update(_pyfuse3._requested_conn_limits(ops))
+
+    noctx_ops = 0
+    for name in _pyfuse3._ctx_ignoring_handlers(ops, _ctx_op_flags):
+        log.debug('Not passing request context to %s() handler', name)
+        noctx_ops |= _ctx_op_flags[name]
 
     make_fuse_args(options, &f_args)
 
@@ -764,29 +1020,120 @@ def init(ops, mountpoint, options=default_options):
 
     session_fd = fuse_session_fd(session)
 
+    # Event loops in different threads may be waiting for the same request,
+    # so reading must not block.
+    os.set_blocking(session_fd, False)
+
 
 @async_wrapper
-async def main(int min_tasks=1, int max_tasks=99):
-    '''Run FUSE main loop'''
+async def main(int min_tasks=1, int max_tasks=99, int batch_size=1,
+               scheduler=None, lanes=None):
+    '''Run FUSE main loop
+
+    Requests are processed by between *min_tasks* and *max_tasks* worker
+    tasks. Alternatively, a `WorkerScheduler` instance may be passed as
+    *scheduler* to control the number of workers (in this case, *min_tasks*
+    and *max_tasks* are ignored).
+
+    When a worker has finished a request and the next request is already
+    waiting, it reads it right away (without first waiting for the FUSE fd
+    to become readable) up to *batch_size* times in a row. Values larger
+    than 1 thus improve throughput under high load, at the expense of
+    fairness towards other tasks in the event loop. They also allow the
+    *scheduler* to tell when requests are queuing up.
+
+    *lanes* may be a dict that limits how many requests of a given class
+    are processed concurrently, so that e.g. slow reads and writes cannot
+    occupy all workers while :file:`ls` is waiting for `~Operations.lookup`
+    and `~Operations.getattr`. The keys are the request classes:
+
+    * ``'data'``: `~Operations.read`, `~Operations.write`,
+      `~Operations.flush`, `~Operations.fsync` and `~Operations.release`
+    * ``'xattr'``: `~Operations.getxattr`, `~Operations.setxattr`,
+      `~Operations.listxattr` and `~Operations.removexattr`
+    * ``'metadata'``: all other requests
+
+    Requests that exceed the limit are queued and processed by the workers
+    that are already busy with this class. Consequently, a request handler
+    must not wait for the completion of another request in the same class
+    if that class is limited. Limits should be smaller than *max_tasks*
+    (or the maximum of the *scheduler*), since otherwise all workers may
+    still end up busy with requests of the same class. Request classes
+    that are not included in *lanes* are not limited.
+    '''
 
     if session == NULL:
         raise RuntimeError('Need to call init() before main()')
 
+    worker_data.configure(min_tasks, max_tasks, batch_size, scheduler, lanes)
+
     global trio_token
     trio_token = trio.lowlevel.current_trio_token()
 
     try:
-        async with trio.open_nursery() as nursery:
-            worker_data.task_count = 1
-            worker_data.task_serial = 1
-            nursery.start_soon(_session_loop, nursery, min_tasks, max_tasks,
-                               name=worker_data.get_name())
+        await _run_workers(worker_data)
     finally:
         trio_token = None
         if _notify_queue is not None:
             _notify_queue.put(None)
 
 
+@async_wrapper
+async def main_mt(int threads=4, int min_tasks=1, int max_tasks=99,
+                  int batch_size=1, lanes=None):
+    '''Run FUSE main loop in multiple threads
+
+    This function works like `main`, but in addition to the calling event
+    loop it starts *threads* - 1 threads that each run their own event loop
+    (with the same *min_tasks*, *max_tasks*, *batch_size* and *lanes*
+    settings, so the limits in *lanes* apply to every thread separately).
+    Requests are distributed between all event loops by the kernel.
+
+    Request handlers may thus be called concurrently from different threads
+    and therefore must be thread-safe. In particular, they must not share
+    Trio objects (like locks or events) between requests, since these are
+    bound to a specific event loop. The `trio_token` attribute refers to the
+    event loop that called `main_mt`.
+
+    Note that Python code only runs in parallel to the extent that request
+    handlers release the GIL (e.g. while doing I/O or calling into C
+    extensions).
+    '''
+
+    if session == NULL:
+        raise RuntimeError('Need to call init() before main_mt()')
+    if threads < 1:
+        raise ValueError('*threads* must be at least 1')
+    if batch_size < 1:
+        raise ValueError('*batch_size* must be at least 1')
+
+    errors = []
+    thread_list = []
+    _mt_tokens[threading.get_ident()] = trio.lowlevel.current_trio_token()
+    try:
+        for i in range(1, threads):
+            t = threading.Thread(target=_mt_thread_main, name='pyfuse3-%d' % i,
+                                 args=(i, min_tasks, max_tasks, batch_size,
+                                       lanes, errors))
+            t.daemon = True
+            t.start()
+            thread_list.append(t)
+
+        await main(min_tasks, max_tasks, batch_size, lanes=lanes)
+    finally:
+        del _mt_tokens[threading.get_ident()]
+
+        # If we are terminating because of an exception, the other event
+        # loops need to be stopped explicitly.
+        fuse_session_exit(session)
+        _wake_mt_loops()
+        for t in thread_list:
+            await trio.to_thread.run_sync(t.join)
+
+    if errors:
+        raise errors[0]
+
+
 def terminate():
     '''Terminate FUSE main loop.
 
@@ -800,6 +1147,7 @@ def terminate():
 
     fuse_session_exit(session)
     trio.lowlevel.notify_closing(session_fd)
+    _wake_mt_loops()
 
 
 def close(unmount=True):
@@ -823,6 +1171,7 @@ def close(unmount=True):
 
     global mountpoint_b
     global session
+    global conn_info
 
     if unmount:
         log.debug('Calling fuse_session_unmount')
@@ -833,6 +1182,8 @@ def close(unmount=True):
 
     mountpoint_b = None
     session = NULL
+    conn_info = NULL
+    free_recv_pool()
 
 
 def invalidate_inode(fuse_ino_t inode, attr_only=False):
@@ -848,6 +1199,9 @@ def invalidate_inode(fuse_ino_t inode, attr_only=False):
     by the filesystem). Unless writeback caching is disabled, this function
     should therefore be called from a separate thread.
 
+    If the file system is a `BlockCacheMixin`, cached data is dropped from
+    its block cache as well (unless *attr_only* is True).
+
     If the operation is not supported by the kernel, raises `OSError`
     with errno ENOSYS.
     '''
@@ -857,6 +1211,8 @@ def invalidate_inode(fuse_ino_t inode, attr_only=False):
         with nogil:
             ret = fuse_lowlevel_notify_inval_inode(session, inode, -1, 0)
     else:
+        if isinstance(operations, BlockCacheMixin):
+            operations.invalidate_block_cache(inode)
         with nogil:
             ret = fuse_lowlevel_notify_inval_inode(session, inode, 0, 0)
 
@@ -1000,6 +1356,246 @@ def notify_store(inode, offset, data):
         raise OSError(-ret, 'fuse_lowlevel_notify_store returned: ' + strerror(-ret))
 
 
+async def notify_store_stream(inode, offset, data, chunk_size=1024*1024,
+                              progress=None):
+    '''Store data from an iterable in kernel page cache
+
+    This function works like `notify_store`, but *data* may be an iterable
+    or an asynchronous iterable of bytes-like objects. Their contents are
+    stored one after another, starting at *offset*.
+
+    The data is passed to the kernel in chunks of at most *chunk_size*
+    bytes, each from a worker thread, so that the event loop is not blocked
+    while the kernel copies the data. The next element of *data* is only
+    requested once the previous one has been stored, so memory usage is
+    bounded by the size of the elements.
+
+    If *progress* is not None, it is called with the total number of bytes
+    stored so far after every chunk. Returns the total number of bytes
+    stored. If an exception is raised, all data before the chunk that
+    caused it has been stored.
+    '''
+
+    if chunk_size < 1:
+        raise ValueError('*chunk_size* must be at least 1')
+
+    stored = 0
+    if hasattr(data, '__aiter__'):
+        async for buf in data:
+            stored = await _notify_store_chunks(inode, offset, buf, stored,
+                                                chunk_size, progress)
+    else:
+        for buf in data:
+            stored = await _notify_store_chunks(inode, offset, buf, stored,
+                                                chunk_size, progress)
+    return stored
+
+async def _notify_store_chunks(inode, offset, buf, stored, chunk_size, progress):
+    '''Store *buf* at *offset* + *stored*, return new value of *stored*'''
+
+    view = memoryview(buf).cast('B')
+    for pos in range(0, len(view), chunk_size):
+        chunk = view[pos:pos+chunk_size]
+        await trio.to_thread.run_sync(notify_store, inode, offset + stored, chunk)
+        stored += len(chunk)
+        if progress is not None:
+            progress(stored)
+    return stored
+
+
+async def retrieve(inode, offset, size):
+    '''Retrieve data from kernel page cache
+
+    Asks the kernel to send back the data that it has cached for *inode*,
+    starting at *offset*, and returns it as a `bytes` object. This does not
+    modify the page cache (dirty pages remain dirty) and does not cause any
+    `~Operations.write` requests.
+
+    The kernel only returns data up to the first page that is not cached
+    and up to the current file size, so the result may be shorter than
+    *size* (or empty). The kernel also limits *size* to the *max_write*
+    value of the connection.
+
+    The data arrives as a separate request, so this function must be
+    awaited in an event loop that is processing requests (i.e., one that
+    is running `main` or `main_mt`), and there must be a worker available
+    to receive the reply (in particular, *max_tasks* must be larger than
+    one if it is called from a request handler).
+
+    If the inode is not known to the kernel, raises `OSError` with errno
+    ENOENT. If the operation is not supported by the kernel, raises
+    `OSError` with errno ENOSYS.
+    '''
+
+    global _retrieve_serial
+    cdef int ret
+    cdef fuse_ino_t ino = inode
+    cdef off_t off = offset
+    cdef size_t len_ = size
+    cdef uintptr_t cookie
+    cdef _RetrieveRequest rr
+
+    rr = _RetrieveRequest()
+    rr.event = trio.Event()
+    rr.token = trio.lowlevel.current_trio_token()
+    rr.thread_id = threading.get_ident()
+    _retrieve_serial += 1
+    cookie = _retrieve_serial
+    _retrieve_reqs[cookie] = rr
+    try:
+        with nogil:
+            ret = fuse_lowlevel_notify_retrieve(session, ino, len_, off,
+                                                <void*> cookie)
+        if ret != 0:
+            raise OSError(-ret, 'fuse_lowlevel_notify_retrieve returned: '
+                          + strerror(-ret))
+        await rr.event.wait()
+    finally:
+        _retrieve_reqs.pop(cookie, None)
+
+    if rr.error is not None:
+        raise rr.error
+    return rr.data
+
+
+def get_connection_info():
+    '''Return parameters of the connection to the FUSE kernel module
+
+    Returns a dict with the protocol version (*proto_major*, *proto_minor*),
+    the capabilities that the kernel supports (*capable*) and that are in
+    use (*want*), as bitmasks of the ``FUSE_CAP_*`` flags from
+    ``fuse_common.h``, and the negotiated values of *max_write*,
+    *max_read*, *max_readahead*, *max_background*, *congestion_threshold*
+    and *time_gran*.
+
+    Returns `None` if the file system has not yet received the ``INIT``
+    request from the kernel (this happens when the main loop processes the
+    first request), or has been closed.
+    '''
+
+    if conn_info is NULL:
+        return None
+    return {
+        'proto_major': conn_info.proto_major,
+        'proto_minor': conn_info.proto_minor,
+        'capable': conn_info.capable,
+        'want': conn_info.want,
+        'max_write': conn_info.max_write,
+        'max_read': conn_info.max_read,
+        'max_readahead': conn_info.max_readahead,
+        'max_background': conn_info.max_background,
+        'congestion_threshold': conn_info.congestion_threshold,
+        'time_gran': conn_info.time_gran,
+    }
+
+
+def get_stats():
+    '''Return request statistics
+
+    Statistics are only collected if the `~Operations.enable_stats` attribute
+    of the file system is set. The result is a dict with the following keys:
+
+    * ``'in_flight'``: the number of requests that are currently being
+      processed.
+    * ``'ops'``: a dict with an entry for every request type that has been
+      received since the last call to `reset_stats`.
+
+    The entries of the ``'ops'`` dict are dicts themselves, with keys
+    ``'count'`` (number of requests), ``'errors'`` (dict mapping errno values
+    to the number of requests that failed with this error), ``'bytes_in'``
+    (data received with write and setxattr requests), ``'bytes_out'`` (data
+    returned by read, readdir, getxattr and listxattr requests), ``'time_ns'``
+    (total processing time) and ``'latency'``.
+
+    ``'latency'`` is a histogram of the processing times. It is a dict that
+    maps the lower bound of each (non-empty) bucket to the number of requests
+    in it. Bucket bounds are given in nanoseconds, and there are four buckets
+    for every power of two.
+
+    `~Operations.forget` requests are only counted, since they are not
+    answered.
+    '''
+
+    cdef int op
+    cdef int i
+    cdef op_stats_t *st
+
+    ops = dict()
+    for op in range(N_OPS):
+        st = &op_stats[op]
+        if st.count == 0:
+            continue
+        latency = dict()
+        for i in range(N_LAT_BUCKETS):
+            if st.latency[i]:
+                latency[latency_bucket_start(i)] = st.latency[i]
+        ops[_op_names[op]] = {
+            'count': st.count,
+            'errors': { errno_: cnt for ((op_, errno_), cnt) in op_errors.items()
+                        if op_ == op },
+            'bytes_in': st.bytes_in,
+            'bytes_out': st.bytes_out,
+            'time_ns': st.time_ns,
+            'latency': latency }
+
+    return { 'in_flight': requests_in_flight, 'ops': ops }
+
+
+def reset_stats():
+    '''Reset request statistics (cf. `get_stats`) to zero'''
+
+    string.memset(op_stats, 0, sizeof(op_stats))
+    op_errors.clear()
+
+
+def get_buffer_stats():
+    '''Return statistics of the receive buffer pool
+
+    The result is a dict with the following keys:
+
+    * ``'buffer_size'``: the size of every buffer (in bytes). Once the
+      connection has been initialized, this is the size of a request with
+      *max_write* bytes of data.
+    * ``'limit'``: the maximum number of buffers that are kept (cf.
+      `~Operations.max_receive_buffers`).
+    * ``'idle'``: the number of buffers that are currently unused.
+    * ``'in_use'``: the number of buffers that currently hold a request.
+    * ``'pinned'``: the number of buffers that are in use because a
+      `~Operations.write` handler is accessing the data in place (cf.
+      `~Operations.enable_zero_copy_write`).
+    * ``'peak_in_use'``: the largest value of ``'in_use'`` so far.
+    * ``'requests'``: the number of times a buffer has been taken from the
+      pool.
+    * ``'allocations'``: the number of times a new buffer had to be
+      allocated for this.
+    '''
+
+    return {
+        'buffer_size': recv_pool.buf_size,
+        'limit': recv_pool.limit,
+        'idle': recv_pool.n_idle,
+        'in_use': recv_pool.n_in_use,
+        'pinned': recv_pool.n_pinned,
+        'peak_in_use': recv_pool.peak_in_use,
+        'requests': recv_pool.n_gets,
+        'allocations': recv_pool.n_allocs }
+
+
+def set_tracer(new_tracer):
+    '''Install request tracer
+
+    *new_tracer* must be a `RequestTracer` instance (or provide the same
+    methods), or `None` to disable tracing. Tracing can be enabled and
+    disabled while the file system is running. Requests that have started
+    before a tracer was installed are not reported to it, and requests that
+    are still running when the tracer is replaced are reported to the
+    tracer that saw their start.
+    '''
+
+    global tracer
+    tracer = new_tracer
+
+
 def get_sup_groups(pid):
     '''Return supplementary group ids of *pid*
 
@@ -9,11 +9,20 @@ This file is part of pyfuse3. This work may be distributed under
 the terms of the GNU LGPL.
 '''
 
+import collections
 import errno
 import functools
+import inspect
 import logging
-from typing import (TYPE_CHECKING, Any, Callable, NewType, Optional, Sequence,
-                    Tuple)
+import math
+import os
+import sys
+import threading
+import time
+import types
+from typing import (TYPE_CHECKING, Any, Callable, Collection, Dict, List,
+                    NewType, Optional, Sequence, Set, Tuple, TypeVar, Union,
+                    cast)
 
 # These types are specific instances of builtin types:
 FileHandleT = NewType("FileHandleT", int)
@@ -25,13 +34,16 @@ XAttrNameT = NewType("XAttrNameT", bytes)
 
 if TYPE_CHECKING:
     # These types are defined elsewhere in the C code
-    from pyfuse3 import (EntryAttributes, FileInfo, FUSEError, ReaddirToken,
-                         RequestContext, SetattrFields, StatvfsData)
+    from pyfuse3 import (ConnectionInfo, EntryAttributes, FileInfo,
+                         FileRange, FUSEError, ReaddirToken, RequestContext,
+                         SetattrFields, StatvfsData, TraceEvent)
 else:
     # Will be injected by pyfuse3 extension module
     FUSEError = None
 
-__all__ = ['Operations', 'async_wrapper']
+__all__ = ['Operations', 'async_wrapper', 'sync_handler', 'ignores_ctx',
+           'WorkerScheduler', 'AdaptiveScheduler', 'RequestTracer',
+           'BlockCacheMixin', 'WriteCoalescingMixin']
 
 log = logging.getLogger(__name__)
 
@@ -46,6 +58,387 @@ def async_wrapper(fn: Callable[..., Any]) -> Callable[..., Any]:
     return wrapper
 
 
+FnT = TypeVar('FnT', bound=Callable[..., Any])
+
+def sync_handler(fn: FnT) -> FnT:
+    '''Mark *fn* as a synchronous request handler.
+
+    Request handlers are normally coroutine functions. Handlers that never
+    need to wait for anything (e.g. because they are answered from data in
+    memory) can instead be regular functions, which pyfuse3 will call
+    directly from the FUSE request callback and reply to immediately. This
+    avoids the overhead of creating and scheduling a coroutine.
+
+    Plain Python functions are detected automatically, so this decorator is
+    only needed for other callables (e.g. functions defined in extension
+    modules). Synchronous handlers are supported for `~Operations.lookup`,
+    `~Operations.forget`, `~Operations.getattr`, `~Operations.readlink`,
+    `~Operations.open`, `~Operations.read`, `~Operations.opendir`,
+    `~Operations.statfs`, `~Operations.getxattr`, `~Operations.listxattr` and
+    `~Operations.access`.
+
+    Since a synchronous handler blocks the event loop, it must not do
+    anything that takes a long time. A regular function that returns an
+    awaitable (e.g. because it forwards to a coroutine function) still
+    works, but the awaitable is then processed like that of a coroutine
+    function.
+    '''
+
+    fn._pyfuse3_sync = True  # type: ignore[attr-defined]
+    return fn
+
+
+def _is_sync_handler(fn: Any) -> bool:
+    if getattr(fn, '_pyfuse3_sync', False):
+        return True
+    fn = inspect.unwrap(getattr(fn, '__func__', fn))
+    return inspect.isfunction(fn) and not inspect.iscoroutinefunction(fn)
+
+
+def _sync_handlers(ops: Any, supported: Collection[str]) -> List[str]:
+    '''Return names of the synchronous request handlers of *ops*
+
+    Raises `ValueError` if a handler that is not in *supported* has
+    explicitly been marked with `sync_handler`.
+    '''
+
+    names = []
+    for name in dir(Operations):
+        if not inspect.iscoroutinefunction(getattr(Operations, name)):
+            continue
+        fn = getattr(ops, name, None)
+        if name in supported:
+            if _is_sync_handler(fn):
+                names.append(name)
+        elif getattr(fn, '_pyfuse3_sync', False):
+            raise ValueError('%s() handler cannot be synchronous' % name)
+    return names
+
+
+def ignores_ctx(fn: FnT) -> FnT:
+    '''Mark request handler *fn* as not using its *ctx* argument.
+
+    Determining the `RequestContext` of a request requires a call into
+    libfuse and the creation of a new object. For handlers that are marked
+    with this decorator, this is skipped and the handler receives `None`
+    as *ctx* instead.
+
+    Handlers whose *ctx* parameter has a name starting with an underscore
+    (e.g. ``_ctx``) are treated the same way without needing the
+    decorator.
+    '''
+
+    fn._pyfuse3_ignores_ctx = True  # type: ignore[attr-defined]
+    return fn
+
+
+def _is_ctx_ignored(fn: Any, name: str) -> bool:
+    '''Return True if handler *fn* for the *name* request ignores *ctx*'''
+
+    if getattr(fn, '_pyfuse3_ignores_ctx', False):
+        return True
+    try:
+        params = list(inspect.signature(fn).parameters.values())
+    except (TypeError, ValueError):
+        return False
+
+    # Position of *ctx* in the signature of the `Operations` method
+    # (without *self*).
+    names = list(inspect.signature(getattr(Operations, name)).parameters)[1:]
+    if 'ctx' not in names:
+        return False
+    pos = names.index('ctx')
+    if pos >= len(params):
+        return False
+    param = params[pos]
+    return (param.name.startswith('_')
+            and param.kind in (inspect.Parameter.POSITIONAL_ONLY,
+                               inspect.Parameter.POSITIONAL_OR_KEYWORD))
+
+
+def _ctx_ignoring_handlers(ops: Any, names: Collection[str]) -> List[str]:
+    '''Return names of the request handlers of *ops* that ignore *ctx*
+
+    Only the handlers in *names* are considered.
+    '''
+
+    return [ name for name in names
+             if _is_ctx_ignored(getattr(ops, name, None), name) ]
+
+
+def _is_implemented(ops: Any, name: str) -> bool:
+    '''Return True if *ops* overrides the *name* method of `Operations`'''
+
+    fn = getattr(ops, name, None)
+    if fn is None:
+        return False
+    return getattr(fn, '__func__', fn) is not getattr(Operations, name)
+
+
+# Maximum values of the connection parameters that are set from
+# `Operations` attributes. The kernel uses 16 bit fields for
+# max_background and congestion_threshold.
+_CONN_LIMIT_MAX = {
+    'max_write': 2**32 - 1,
+    'max_readahead': 2**32 - 1,
+    'max_background': 2**16 - 1,
+    'congestion_threshold': 2**16 - 1,
+}
+
+def _check_conn_limits(limits: Dict[str, Any]) -> None:
+    '''Raise `ValueError` if a connection parameter in *limits* is out of range'''
+
+    for (name, val) in limits.items():
+        max_ = _CONN_LIMIT_MAX[name]
+        if not isinstance(val, int) or not 0 < val <= max_:
+            raise ValueError('%s must be an integer between 1 and %d, got %r'
+                             % (name, max_, val))
+    if limits.get('congestion_threshold', 0) > limits.get('max_background', 2**16):
+        raise ValueError('congestion_threshold must not exceed max_background')
+
+
+def _requested_conn_limits(ops: Any) -> Dict[str, int]:
+    '''Return connection parameters requested by *ops*
+
+    Raises `ValueError` if a value is out of range.
+    '''
+
+    limits = {}
+    for name in _CONN_LIMIT_MAX:
+        val = getattr(ops, name, None)
+        if val is not None:
+            limits[name] = val
+    _check_conn_limits(limits)
+    return limits
+
+
+def _init_takes_conn(ops: Any) -> bool:
+    '''Return True if the init() method of *ops* accepts a ConnectionInfo'''
+
+    try:
+        sig = inspect.signature(ops.init)
+    except (TypeError, ValueError):
+        return False
+    try:
+        sig.bind(None)
+    except TypeError:
+        return False
+    return True
+
+
+class WorkerScheduler:
+    '''
+    Instances of this class decide how many worker tasks `main` uses to
+    process requests. They can be passed to `main` as the *scheduler*
+    argument.
+
+    This class implements the same policy that `main` uses by default: a new
+    worker is started whenever a request is received while no other worker
+    is waiting for requests, and a worker terminates when more than
+    *min_tasks* workers are waiting for requests. Subclasses can override
+    `request_received`, `request_completed` and `worker_idle` to implement
+    different policies.
+
+    The `workers_started` and `workers_stopped` attributes count the
+    respective decisions.
+    '''
+
+    def __init__(self, min_tasks: int = 1, max_tasks: int = 99) -> None:
+        if min_tasks < 1 or max_tasks < min_tasks:
+            raise ValueError('Need 1 <= min_tasks <= max_tasks')
+        self.min_tasks = min_tasks
+        self.max_tasks = max_tasks
+        self.workers_started = 0
+        self.workers_stopped = 0
+
+    def request_received(
+        self,
+        now: float,
+        workers: int,
+        idle_workers: int,
+        backlog: bool
+    ) -> int:
+        '''Handle receipt of a new request.
+
+        *now* is the current value of `time.monotonic`, *workers* the
+        current number of worker tasks and *idle_workers* the number of
+        workers that are waiting for requests. *backlog* is true if the
+        request was already waiting when the worker asked for it. This can
+        only be detected if `main` was called with a *batch_size* larger
+        than 1 (otherwise, workers always wait for the FUSE device to
+        become readable first), so with the default *batch_size* *backlog*
+        is always false.
+
+        Returns the number of additional workers to start.
+        '''
+
+        if idle_workers or workers >= self.max_tasks:
+            return 0
+        self.workers_started += 1
+        return 1
+
+    def request_completed(self, duration: float) -> None:
+        '''Handle completion of a request that took *duration* seconds'''
+
+        pass
+
+    def worker_idle(self, workers: int, idle_workers: int) -> bool:
+        '''Decide if a worker that is ready for the next request should terminate.
+
+        *workers* and *idle_workers* have the same meaning as for
+        `request_received`.
+        '''
+
+        if idle_workers > self.min_tasks:
+            self.workers_stopped += 1
+            return True
+        return False
+
+    def stats(self) -> Dict[str, float]:
+        '''Return dict with counters and other internal state'''
+
+        return {'workers_started': self.workers_started,
+                'workers_stopped': self.workers_stopped}
+
+
+class AdaptiveScheduler(WorkerScheduler):
+    '''
+    A `WorkerScheduler` that sizes the worker pool from the observed request
+    rate and handler latency.
+
+    The scheduler keeps exponentially weighted moving averages (with weight
+    *smoothing*) of the time between requests and of the time it takes to
+    handle a request. By Little's law, their ratio is the average number of
+    requests in flight. The target number of workers is this value times
+    *headroom*, but at least *min_tasks* and at most *max_tasks*.
+
+    If a request is received while no worker is waiting for the next one,
+    up to *max_burst* workers are started at once to reach the target (but
+    always at least one). If the request had already been queued by the
+    kernel, the pool is additionally allowed to double in size (again
+    limited by *max_burst*; this requires a *batch_size* larger than 1, cf.
+    `WorkerScheduler.request_received`). Workers terminate only once the
+    number of workers exceeds the target by more than a factor of
+    1 + *hysteresis*, so that the pool does not oscillate under fluctuating
+    load. Until the request rate has been estimated, the target is
+    *min_tasks*.
+
+    In addition to the counters of `WorkerScheduler`, the `grow_events`
+    and `shrink_events` attributes count the decisions to grow and shrink
+    the pool, and `backlog_events` the requests that had already been
+    queued when a worker asked for them.
+    '''
+
+    def __init__(
+        self,
+        min_tasks: int = 1,
+        max_tasks: int = 99,
+        headroom: float = 1.5,
+        hysteresis: float = 0.5,
+        smoothing: float = 0.1,
+        max_burst: int = 8
+    ) -> None:
+        super().__init__(min_tasks, max_tasks)
+        if not 0 < smoothing <= 1:
+            raise ValueError('*smoothing* must be in (0, 1]')
+        if headroom < 1 or hysteresis < 0 or max_burst < 1:
+            raise ValueError('Need headroom >= 1, hysteresis >= 0 '
+                             'and max_burst >= 1')
+        self.headroom = headroom
+        self.hysteresis = hysteresis
+        self.smoothing = smoothing
+        self.max_burst = max_burst
+        self.interval = 0.0
+        self.latency = 0.0
+        self.target = min_tasks
+        self.grow_events = 0
+        self.shrink_events = 0
+        self.backlog_events = 0
+        self._last_arrival: Optional[float] = None
+
+    def _update_target(self) -> None:
+        if self.interval <= 0:
+            # No estimate of the request rate yet
+            self.target = self.min_tasks
+            return
+        in_flight = self.latency / self.interval
+        self.target = min(self.max_tasks,
+                          max(self.min_tasks,
+                              math.ceil(in_flight * self.headroom)))
+
+    def request_received(
+        self,
+        now: float,
+        workers: int,
+        idle_workers: int,
+        backlog: bool
+    ) -> int:
+        if self._last_arrival is not None:
+            self.interval += self.smoothing * (
+                now - self._last_arrival - self.interval)
+        self._last_arrival = now
+        self._update_target()
+
+        if backlog:
+            self.backlog_events += 1
+        if idle_workers or workers >= self.max_tasks:
+            return 0
+
+        count = max(1, self.target - workers)
+        if backlog:
+            count = max(count, workers)
+        count = min(count, self.max_burst, self.max_tasks - workers)
+        self.grow_events += 1
+        self.workers_started += count
+        return count
+
+    def request_completed(self, duration: float) -> None:
+        self.latency += self.smoothing * (duration - self.latency)
+
+    def worker_idle(self, workers: int, idle_workers: int) -> bool:
+        if not idle_workers or workers <= self.min_tasks:
+            return False
+        if workers <= self.target * (1 + self.hysteresis):
+            return False
+        self.shrink_events += 1
+        self.workers_stopped += 1
+        return True
+
+    def stats(self) -> Dict[str, float]:
+        stats = super().stats()
+        stats.update(target=self.target, interval=self.interval,
+                     latency=self.latency, grow_events=self.grow_events,
+                     shrink_events=self.shrink_events,
+                     backlog_events=self.backlog_events)
+        return stats
+
+
+class RequestTracer:
+    '''
+    Instances of this class can be passed to `set_tracer` to be informed
+    about every request that is processed (except for `~Operations.forget`,
+    which is never answered).
+
+    The methods are called from the event loop that processes the request,
+    so they must return quickly. With `main_mt`, they may be called from
+    several threads. Exceptions are logged and otherwise ignored.
+    '''
+
+    def on_request_start(self, event: "TraceEvent") -> None:
+        '''Handle start of processing of the request described by *event*'''
+
+        pass
+
+    def on_request_end(self, event: "TraceEvent") -> None:
+        '''Handle completion of the request described by *event*
+
+        *event* is the same object that has been passed to
+        `on_request_start`.
+        '''
+
+        pass
+
+
 class Operations:
     '''
     This class defines the request handler methods that an pyfuse3 file system
@@ -61,18 +454,42 @@ class Operations:
     It is recommended that file systems are derived from this class and only
     overwrite the handlers that they actually implement. (The methods defined in
     this class all just raise ``FUSEError(ENOSYS)`` or do nothing).
+
+    Request handlers are coroutine functions. Some handlers may instead be
+    regular functions, see `sync_handler` for details.
+
+    Raising an exception is comparatively expensive. The `lookup`,
+    `getattr`, `readlink`, `open`, `read`, `opendir`, `statfs`,
+    `getxattr`, `listxattr` and `access` handlers may therefore also
+    *return* a `FUSEError` instance instead of raising it, with the same
+    effect. Since the instance is not modified, file systems can create
+    one instance per errno (e.g. ``ENOENT_ERROR = FUSEError(errno.ENOENT)``)
+    and return it for every request that fails in the same way.
     '''
 
     supports_dot_lookup: bool = True
     enable_writeback_cache: bool = False
     enable_acl: bool = False
-
-    def init(self) -> None:
+    enable_interrupts: bool = False
+    enable_stats: bool = False
+    enable_zero_copy_write: bool = False
+    enable_passthrough: bool = False
+    max_receive_buffers: int = 16
+    max_write: Optional[int] = None
+    max_readahead: Optional[int] = None
+    max_background: Optional[int] = None
+    congestion_threshold: Optional[int] = None
+
+    def init(self, conn: "Optional[ConnectionInfo]" = None) -> None:
         '''Initialize operations.
 
         This method will be called just before the file system starts handling
         requests. It must not raise any exceptions (not even `FUSEError`), since
         it is not handling a particular client request.
+
+        If the method accepts an argument, *conn* will be a `ConnectionInfo`
+        instance that can be used to inspect and change the capabilities and
+        parameters of the connection to the kernel.
         '''
 
         pass
@@ -82,7 +499,7 @@ class Operations:
         parent_inode: InodeT,
         name: FileNameT,
         ctx: "RequestContext"
-    ) -> "EntryAttributes":
+    ) -> "Union[EntryAttributes, FUSEError]":
         '''Look up a directory entry by name and get its attributes.
 
         This method should return an `EntryAttributes` instance for the
@@ -135,7 +552,7 @@ class Operations:
         self,
         inode: InodeT,
         ctx: "RequestContext"
-    ) -> "EntryAttributes":
+    ) -> "Union[EntryAttributes, FUSEError]":
         '''Get attributes for *inode*.
 
         *ctx* will be a `RequestContext` instance.
@@ -185,7 +602,7 @@ class Operations:
         self,
         inode: InodeT,
         ctx: "RequestContext"
-    ) -> FileNameT:
+    ) -> "Union[FileNameT, FUSEError]":
         '''Return target of symbolic link *inode*.
 
         *ctx* will be a `RequestContext` instance.
@@ -382,7 +799,7 @@ class Operations:
         inode: InodeT,
         flags: FlagT,
         ctx: "RequestContext"
-    ) -> "FileInfo":
+    ) -> "Union[FileInfo, FUSEError]":
         '''Open a inode *inode* with *flags*.
 
         *ctx* will be a `RequestContext` instance.
@@ -405,7 +822,7 @@ class Operations:
         fh: FileHandleT,
         off: int,
         size: int
-    ) -> bytes:
+    ) -> "Union[bytes, Sequence[bytes], FileRange, FUSEError]":
         '''Read *size* bytes from *fh* at position *off*.
 
         *fh* will be an integer filehandle returned by a prior `open` or
@@ -414,6 +831,11 @@ class Operations:
         This function should return exactly the number of bytes requested except
         on EOF or error, otherwise the rest of the data will be substituted with
         zeroes.
+
+        If the data is stored in several buffers, the method may return a
+        list or tuple of them instead of concatenating them. Instead of the
+        data, the method may also return a `FileRange` instance that
+        specifies where the data can be read from.
         '''
 
         raise FUSEError(errno.ENOSYS)
@@ -433,10 +855,47 @@ class Operations:
         file system has been mounted with the ``direct_io`` option, the file
         system *must* always write *all* the provided data (i.e., return
         ``len(buf)``).
+
+        If `enable_zero_copy_write` is set, *buf* may be a read-only
+        `memoryview` of the buffer that the request was received into.
+        It becomes invalid as soon as the handler returns, so any data
+        that is needed afterwards must be copied (e.g. with
+        ``bytes(buf[a:b])``) first.
         '''
 
         raise FUSEError(errno.ENOSYS)
 
+    def write_to_fd(
+        self,
+        fh: FileHandleT,
+        off: int,
+        size: int
+    ) -> "Union[Tuple[int, int], FUSEError, None]":
+        '''Return file descriptor that *size* bytes written at *off* go to.
+
+        This optional handler allows file systems that store file contents
+        in other files (e.g. pass-through file systems) to write data
+        without it ever being copied into Python objects. It is called for
+        every write request before `write`, and should return a tuple
+        ``(fd, offset)``. pyfuse3 then copies the data directly into the
+        file descriptor *fd*, starting at *offset* (using :manpage:`splice(2)`
+        if the kernel supports it), and reports the number of bytes copied
+        to the kernel. If the method returns `None`, the data is instead
+        passed to `write` as usual.
+
+        *fh* will be an integer filehandle returned by a prior `open` or
+        `create` call. pyfuse3 uses *fd* right after the method returns,
+        but does not close it.
+
+        Unlike other handlers, this method has to be a regular function
+        rather than a coroutine, because the data has to be consumed before
+        the next request can be received (`init` raises `ValueError`
+        otherwise). It must not block for a long time. Errors may be raised
+        or returned as `FUSEError`.
+        '''
+
+        return None
+
     async def flush(
         self,
         fh: FileHandleT
@@ -494,7 +953,7 @@ class Operations:
         self,
         inode: InodeT,
         ctx: "RequestContext"
-    ) -> FileHandleT:
+    ) -> "Union[FileHandleT, FUSEError]":
         '''Open the directory with inode *inode*.
 
         *ctx* will be a `RequestContext` instance.
@@ -571,7 +1030,7 @@ class Operations:
     async def statfs(
         self,
         ctx: "RequestContext"
-    ) -> "StatvfsData":
+    ) -> "Union[StatvfsData, FUSEError]":
         '''Get file system statistics.
 
         *ctx* will be a `RequestContext` instance.
@@ -627,7 +1086,7 @@ class Operations:
         inode: InodeT,
         name: XAttrNameT,
         ctx: "RequestContext"
-    ) -> bytes:
+    ) -> "Union[bytes, FUSEError]":
         '''Return extended attribute *name* of *inode*.
 
         *ctx* will be a `RequestContext` instance.
@@ -643,7 +1102,7 @@ class Operations:
         self,
         inode: InodeT,
         ctx: "RequestContext"
-    ) -> Sequence[XAttrNameT]:
+    ) -> "Union[Sequence[XAttrNameT], FUSEError]":
         '''Get list of extended attributes for *inode*.
 
         *ctx* will be a `RequestContext` instance.
@@ -676,7 +1135,7 @@ class Operations:
         inode: InodeT,
         mode: ModeT,
         ctx: "RequestContext"
-    ) -> bool:
+    ) -> "Union[bool, FUSEError]":
         '''Check if requesting process has *mode* rights on *inode*.
 
         *ctx* will be a `RequestContext` instance.
@@ -714,3 +1173,616 @@ class Operations:
         '''
 
         raise FUSEError(errno.ENOSYS)
+
+
+async def _await_result(res: Any) -> Any:
+    '''Return *res*, or its result if it is awaitable
+
+    This allows mixins to call the handlers of subclasses that may be
+    synchronous (cf. `sync_handler`).
+    '''
+
+    if inspect.isawaitable(res):
+        return await res
+    return res
+
+
+def _event_loop() -> types.ModuleType:
+    '''Return the module that provides pyfuse3's event loop primitives
+
+    This is `trio`, or `pyfuse3.asyncio` if asyncio mode is enabled.
+    '''
+
+    return cast(types.ModuleType, sys.modules['pyfuse3'].trio)
+
+
+class _BlockFill:
+    '''A block that is being read by `BlockCacheMixin`'''
+
+    __slots__ = ('event', 'thread', 'result', 'stale')
+
+    def __init__(self, event: Any) -> None:
+        self.event = event
+        self.thread = threading.get_ident()
+        self.result: "Optional[Union[bytes, FUSEError]]" = None
+        self.stale = False
+
+
+class BlockCacheMixin:
+    '''
+    Mixin for `Operations` subclasses that caches the data returned by
+    `~Operations.read` in memory.
+
+    File contents are cached in blocks of `cache_block_size` bytes, keyed by
+    inode and block number. When the total size of the cached blocks
+    exceeds `cache_size`, the least recently used blocks are evicted. If a
+    block is requested again while it is still being read, the request
+    waits for the data instead of calling `~Operations.read` a second time
+    (only for requests that are processed by the same event loop, cf.
+    `main_mt`).
+
+    The mixin has to come before the file system class in the list of base
+    classes, e.g. ``class CachedFs(pyfuse3.BlockCacheMixin, MyFs)``.
+    Blocks are always read with the file handle of the request that first
+    needed them, and a block that is shorter than `cache_block_size` is
+    taken to end at the end of the file.
+
+    Cached data is invalidated when it is changed through `~Operations.write`
+    or `~Operations.setattr`, when the file is opened with ``O_TRUNC``, when
+    the inode is forgotten and when `invalidate_inode` is called. If the
+    data changes in any other way (e.g. through `~Operations.write_to_fd`,
+    or on a remote backend), the file system has to call
+    `invalidate_block_cache` itself.
+
+    The `cache_hits`, `cache_misses` and `cache_evictions` attributes count
+    the respective events.
+    '''
+
+    cache_block_size: int = 128 * 1024
+    cache_size: int = 64 * 1024 * 1024
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        if self.cache_block_size < 1 or self.cache_size < 0:
+            raise ValueError('Need cache_block_size >= 1 and cache_size >= 0')
+        self._cache_lock = threading.Lock()
+        self._cache_blocks: "collections.OrderedDict[Tuple[int, int], bytes]" = \
+            collections.OrderedDict()
+        # Block numbers of the cached blocks, and the block containing the end
+        # of the file (if cached), for every inode.
+        self._cache_index: Dict[int, Set[int]] = {}
+        self._cache_eof: Dict[int, int] = {}
+        self._cache_fills: Dict[Tuple[int, int], _BlockFill] = {}
+        self._cache_used = 0
+        self._cache_fh_inode: Dict[int, InodeT] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+
+    def block_cache_stats(self) -> Dict[str, int]:
+        '''Return dict with counters and current size of the cache'''
+
+        return {'hits': self.cache_hits,
+                'misses': self.cache_misses,
+                'evictions': self.cache_evictions,
+                'blocks': len(self._cache_blocks),
+                'bytes': self._cache_used}
+
+    def invalidate_block_cache(
+        self,
+        inode: Optional[InodeT] = None,
+        start: int = 0,
+        end: Optional[int] = None
+    ) -> None:
+        '''Drop cached data of *inode* between offsets *start* and *end*
+
+        If *end* is None, all data after *start* is dropped. If *inode* is
+        None, the entire cache is cleared. Blocks that are currently being
+        read are not added to the cache. If the end of the file is cached in
+        a block before *start*, this block is dropped too (since writing
+        beyond the end of the file extends it).
+        '''
+
+        bs = self.cache_block_size
+        with self._cache_lock:
+            for (key, fill) in self._cache_fills.items():
+                if inode is None or key[0] == inode:
+                    fill.stale = True
+
+            if inode is None:
+                self._cache_blocks.clear()
+                self._cache_index.clear()
+                self._cache_eof.clear()
+                self._cache_used = 0
+                return
+
+            blocks = self._cache_index.get(inode)
+            if not blocks:
+                return
+            first = start // bs
+            if end is None:
+                drop = [ no for no in blocks if no >= first ]
+            else:
+                last = (end - 1) // bs
+                if last - first < len(blocks):
+                    drop = [ no for no in range(first, last + 1) if no in blocks ]
+                else:
+                    drop = [ no for no in blocks if first <= no <= last ]
+            eof = self._cache_eof.get(inode)
+            if eof is not None and eof < first:
+                drop.append(eof)
+            for no in drop:
+                self._cache_remove((inode, no))
+
+    def _cache_remove(self, key: Tuple[int, int]) -> None:
+        (inode, no) = key
+        data = self._cache_blocks.pop(key)
+        self._cache_used -= len(data)
+        blocks = self._cache_index[inode]
+        blocks.discard(no)
+        if not blocks:
+            del self._cache_index[inode]
+        if self._cache_eof.get(inode) == no:
+            del self._cache_eof[inode]
+
+    def _cache_insert(self, key: Tuple[int, int], data: bytes) -> None:
+        if len(data) > self.cache_size:
+            return
+        if key in self._cache_blocks:
+            self._cache_remove(key)
+        (inode, no) = key
+        self._cache_blocks[key] = data
+        self._cache_used += len(data)
+        self._cache_index.setdefault(inode, set()).add(no)
+        if len(data) < self.cache_block_size:
+            self._cache_eof[inode] = no
+        while self._cache_used > self.cache_size:
+            self._cache_remove(next(iter(self._cache_blocks)))
+            self.cache_evictions += 1
+
+    async def _cache_get_block(
+        self,
+        fh: FileHandleT,
+        inode: int,
+        no: int
+    ) -> "Union[bytes, FUSEError]":
+        import pyfuse3
+
+        key = (inode, no)
+        while True:
+            with self._cache_lock:
+                data = self._cache_blocks.get(key)
+                if data is not None:
+                    self._cache_blocks.move_to_end(key)
+                    self.cache_hits += 1
+                    return data
+                fill = self._cache_fills.get(key)
+                if fill is None or fill.thread != threading.get_ident():
+                    own = _BlockFill(_event_loop().Event())
+                    if fill is None:
+                        self._cache_fills[key] = own
+                    self.cache_misses += 1
+                    break
+            await fill.event.wait()
+            if fill.result is not None:
+                return fill.result
+            # Reading the block failed with an exception or was cancelled,
+            # so try again.
+
+        bs = self.cache_block_size
+        res: "Union[bytes, FUSEError]"
+        try:
+            ret = await _await_result(
+                super().read(fh, no * bs, bs))  # type: ignore
+            if isinstance(ret, pyfuse3.FileRange):
+                res = os.pread(ret.fd, min(ret.length, bs), ret.offset)
+            elif isinstance(ret, (list, tuple)):
+                res = b''.join(ret)
+            elif isinstance(ret, FUSEError):
+                res = ret
+            else:
+                res = bytes(ret)
+            own.result = res
+        finally:
+            with self._cache_lock:
+                if self._cache_fills.get(key) is own:
+                    del self._cache_fills[key]
+                if (own.result is not None and not own.stale
+                    and not isinstance(own.result, FUSEError)):
+                    self._cache_insert(key, own.result)
+            own.event.set()
+        return res
+
+    async def read(
+        self,
+        fh: FileHandleT,
+        off: int,
+        size: int
+    ) -> "Union[bytes, Sequence[bytes], FileRange, FUSEError]":
+        inode = self._cache_fh_inode.get(fh)
+        if inode is None or size == 0:
+            res: "Union[bytes, Sequence[bytes], FileRange, FUSEError]" = \
+                await _await_result(super().read(fh, off, size))  # type: ignore
+            return res
+
+        bs = self.cache_block_size
+        end = off + size
+        no = off // bs
+        bufs: List[bytes] = []
+        while no * bs < end:
+            data = await self._cache_get_block(fh, inode, no)
+            if isinstance(data, FUSEError):
+                return data
+            start = max(off - no * bs, 0)
+            stop = min(end - no * bs, len(data))
+            if start == 0 and stop == len(data):
+                bufs.append(data)
+            elif start < stop:
+                # Replies may contain any bytes-like object
+                bufs.append(cast(bytes, memoryview(data)[start:stop]))
+            if len(data) < bs:
+                break
+            no += 1
+
+        if not bufs:
+            return b''
+        elif len(bufs) == 1:
+            return bufs[0]
+        return bufs
+
+    async def write(
+        self,
+        fh: FileHandleT,
+        off: int,
+        buf: bytes
+    ) -> int:
+        len_ = len(buf)
+        try:
+            written: int = await _await_result(
+                super().write(fh, off, buf))  # type: ignore
+            return written
+        finally:
+            inode = self._cache_fh_inode.get(fh)
+            if inode is not None:
+                self.invalidate_block_cache(inode, off, off + len_)
+
+    async def setattr(
+        self,
+        inode: InodeT,
+        attr: "EntryAttributes",
+        fields: "SetattrFields",
+        fh: Optional[FileHandleT],
+        ctx: "RequestContext"
+    ) -> "EntryAttributes":
+        try:
+            return await _await_result(super().setattr(  # type: ignore
+                inode, attr, fields, fh, ctx))
+        finally:
+            if fields.update_size:
+                self.invalidate_block_cache(inode)
+
+    async def open(
+        self,
+        inode: InodeT,
+        flags: FlagT,
+        ctx: "RequestContext"
+    ) -> "Union[FileInfo, FUSEError]":
+        if flags & os.O_TRUNC:
+            self.invalidate_block_cache(inode)
+        fi: "Union[FileInfo, FUSEError]" = await _await_result(
+            super().open(inode, flags, ctx))  # type: ignore
+        if not isinstance(fi, FUSEError):
+            self._cache_fh_inode[fi.fh] = inode
+        return fi
+
+    async def create(
+        self,
+        parent_inode: InodeT,
+        name: FileNameT,
+        mode: ModeT,
+        flags: FlagT,
+        ctx: "RequestContext"
+    ) -> Tuple["FileInfo", "EntryAttributes"]:
+        (fi, attr) = await _await_result(super().create(  # type: ignore
+            parent_inode, name, mode, flags, ctx))
+        self.invalidate_block_cache(attr.st_ino)
+        self._cache_fh_inode[fi.fh] = attr.st_ino
+        return (fi, attr)
+
+    async def release(self, fh: FileHandleT) -> None:
+        try:
+            await _await_result(super().release(fh))  # type: ignore
+        finally:
+            self._cache_fh_inode.pop(fh, None)
+
+    async def forget(self, inode_list: Sequence[Tuple[InodeT, int]]) -> None:
+        try:
+            await _await_result(super().forget(inode_list))  # type: ignore
+        finally:
+            for (inode, _) in inode_list:
+                self.invalidate_block_cache(inode)
+
+
+class _WriteState:
+    '''Buffered write data of a file handle for `WriteCoalescingMixin`'''
+
+    __slots__ = ('inode', 'lock', 'off', 'data', 'started', 'error')
+
+    def __init__(self, inode: Optional[int], lock: Any) -> None:
+        self.inode = inode
+        self.lock = lock
+        self.off = 0
+        self.data: Optional[bytearray] = None
+        self.started = 0.0
+        self.error: "Optional[FUSEError]" = None
+
+
+class WriteCoalescingMixin:
+    '''
+    Mixin for `Operations` subclasses that combines small sequential writes
+    into larger ones.
+
+    Data passed to `~Operations.write` is collected in a buffer for every
+    file handle, as long as every write starts within or right at the end
+    of the data that is already buffered. The buffered data is passed to the
+    `~Operations.write` handler of the file system (as a `bytearray` or
+    `memoryview`) when
+
+    * the buffer reaches `coalesce_size` bytes,
+    * a write to a different position is received,
+    * the buffer is older than `coalesce_max_age` seconds when a write (to
+      any file handle) is received or `flush_expired_writes` is called,
+    * `~Operations.flush`, `~Operations.fsync` or `~Operations.release` is
+      called for the file handle, or
+    * `~Operations.read`, `~Operations.getattr` or `~Operations.setattr`
+      (with a size change) is called for the inode.
+
+    Buffered writes always succeed. If writing the buffered data fails, the
+    error is returned by the request that caused the data to be written if
+    this is a `~Operations.write`, `~Operations.flush` or
+    `~Operations.fsync` request for the same file handle. Otherwise it is
+    returned by the next such request, and the data is discarded. Errors
+    that can no longer be reported when the file handle is released are
+    logged.
+
+    The mixin has to come before the file system class in the list of base
+    classes (and before `BlockCacheMixin`, if both are used). It must not
+    be used with `main_mt`. Other handlers (e.g. `~Operations.lookup`)
+    see the data only once it has been written.
+
+    The `writes_coalesced` and `extents_flushed` attributes count the writes
+    that have been appended to a buffer and the buffers that have been
+    written.
+    '''
+
+    coalesce_size: int = 1024 * 1024
+    coalesce_max_age: float = 1.0
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        if self.coalesce_size < 1 or self.coalesce_max_age < 0:
+            raise ValueError('Need coalesce_size >= 1 and coalesce_max_age >= 0')
+        self._wc_state: Dict[int, _WriteState] = {}
+        # File handles with buffered data, oldest first.
+        self._wc_dirty: "collections.OrderedDict[int, None]" = \
+            collections.OrderedDict()
+        self._wc_inode_fhs: Dict[int, Set[int]] = {}
+        self.writes_coalesced = 0
+        self.extents_flushed = 0
+
+    def _wc_get_state(self, fh: int, inode: Optional[int] = None) -> _WriteState:
+        st = self._wc_state.get(fh)
+        if st is None:
+            st = _WriteState(inode, _event_loop().Lock())
+            self._wc_state[fh] = st
+        return st
+
+    def _wc_attach(self, fh: int, st: _WriteState, off: int,
+                   data: bytearray) -> None:
+        '''Start buffering *data* (to be written at *off*) for *fh*'''
+
+        st.off = off
+        st.data = data
+        st.started = time.monotonic()
+        self._wc_dirty[fh] = None
+        if st.inode is not None:
+            self._wc_inode_fhs.setdefault(st.inode, set()).add(fh)
+
+    def _wc_detach(self, fh: int, st: _WriteState) -> None:
+        '''Stop buffering data for *fh*'''
+
+        st.data = None
+        del self._wc_dirty[fh]
+        if st.inode is not None:
+            fhs = self._wc_inode_fhs[st.inode]
+            fhs.discard(fh)
+            if not fhs:
+                del self._wc_inode_fhs[st.inode]
+
+    async def _wc_flush(self, fh: int, st: _WriteState) -> None:
+        '''Write buffered data of *fh*, raising errors'''
+
+        async with st.lock:
+            data = st.data
+            if data is None:
+                return
+            off = st.off
+            # Further writes start a new buffer while this one is written
+            self._wc_detach(fh, st)
+
+            pos = 0
+            try:
+                while pos < len(data):
+                    buf = data if pos == 0 else memoryview(data)[pos:]
+                    written = await _await_result(
+                        super().write(fh, off + pos, buf))  # type: ignore
+                    if written <= 0:
+                        raise FUSEError(errno.EIO)
+                    pos += written
+            except FUSEError:
+                raise
+            except BaseException:
+                # Cancelled (e.g. because the request was interrupted), or
+                # the file system failed unexpectedly. Keep the rest of the
+                # data for the next attempt if nothing has been buffered in
+                # the meantime, otherwise make sure the loss is reported.
+                if st.data is None:
+                    self._wc_attach(fh, st, off + pos, data[pos:])
+                elif st.error is None:
+                    st.error = FUSEError(errno.EIO)
+                raise
+            self.extents_flushed += 1
+
+    async def _wc_flush_deferred(self, fh: int, st: _WriteState) -> None:
+        '''Write buffered data of *fh*, saving errors for later'''
+
+        try:
+            await self._wc_flush(fh, st)
+        except FUSEError as exc:
+            log.debug('Writing buffered data for fh %d failed: %s', fh, exc)
+            if st.error is None:
+                st.error = exc
+
+    async def _wc_flush_inode(self, inode: int) -> None:
+        for fh in list(self._wc_inode_fhs.get(inode, ())):
+            await self._wc_flush_deferred(fh, self._wc_state[fh])
+
+    async def _wc_sync(self, fh: int) -> None:
+        '''Write buffered data of *fh* and raise pending errors'''
+
+        st = self._wc_state.get(fh)
+        if st is None:
+            return
+        try:
+            await self._wc_flush(fh, st)
+        except FUSEError as exc:
+            if st.error is None:
+                st.error = exc
+        if st.error is not None:
+            (pending, st.error) = (st.error, None)
+            raise pending
+
+    async def flush_expired_writes(self) -> None:
+        '''Write all buffers that are older than `coalesce_max_age`'''
+
+        deadline = time.monotonic() - self.coalesce_max_age
+        while self._wc_dirty:
+            fh = next(iter(self._wc_dirty))
+            st = self._wc_state[fh]
+            if st.started > deadline:
+                break
+            await self._wc_flush_deferred(fh, st)
+
+    async def write(
+        self,
+        fh: FileHandleT,
+        off: int,
+        buf: bytes
+    ) -> int:
+        st = self._wc_get_state(fh)
+        if st.error is not None:
+            (pending, st.error) = (st.error, None)
+            raise pending
+
+        len_ = len(buf)
+        while True:
+            data = st.data
+            if data is None:
+                self._wc_attach(fh, st, off, bytearray(buf))
+                break
+            elif st.off <= off <= st.off + len(data):
+                pos = off - st.off
+                data[pos:pos + len_] = buf
+                self.writes_coalesced += 1
+                break
+            await self._wc_flush(fh, st)
+
+        if st.data is not None and len(st.data) >= self.coalesce_size:
+            await self._wc_flush(fh, st)
+        await self.flush_expired_writes()
+        return len_
+
+    async def read(
+        self,
+        fh: FileHandleT,
+        off: int,
+        size: int
+    ) -> "Union[bytes, Sequence[bytes], FileRange, FUSEError]":
+        st = self._wc_state.get(fh)
+        if st is not None and st.inode is not None:
+            await self._wc_flush_inode(st.inode)
+        elif st is not None:
+            await self._wc_flush_deferred(fh, st)
+        res: "Union[bytes, Sequence[bytes], FileRange, FUSEError]" = \
+            await _await_result(super().read(fh, off, size))  # type: ignore
+        return res
+
+    async def getattr(
+        self,
+        inode: InodeT,
+        ctx: "RequestContext"
+    ) -> "Union[EntryAttributes, FUSEError]":
+        await self._wc_flush_inode(inode)
+        attr: "Union[EntryAttributes, FUSEError]" = await _await_result(
+            super().getattr(inode, ctx))  # type: ignore
+        return attr
+
+    async def setattr(
+        self,
+        inode: InodeT,
+        attr: "EntryAttributes",
+        fields: "SetattrFields",
+        fh: Optional[FileHandleT],
+        ctx: "RequestContext"
+    ) -> "EntryAttributes":
+        if fields.update_size:
+            await self._wc_flush_inode(inode)
+        return await _await_result(super().setattr(  # type: ignore
+            inode, attr, fields, fh, ctx))
+
+    async def open(
+        self,
+        inode: InodeT,
+        flags: FlagT,
+        ctx: "RequestContext"
+    ) -> "Union[FileInfo, FUSEError]":
+        fi: "Union[FileInfo, FUSEError]" = await _await_result(
+            super().open(inode, flags, ctx))  # type: ignore
+        if not isinstance(fi, FUSEError):
+            self._wc_get_state(fi.fh, inode)
+        return fi
+
+    async def create(
+        self,
+        parent_inode: InodeT,
+        name: FileNameT,
+        mode: ModeT,
+        flags: FlagT,
+        ctx: "RequestContext"
+    ) -> Tuple["FileInfo", "EntryAttributes"]:
+        (fi, attr) = await _await_result(super().create(  # type: ignore
+            parent_inode, name, mode, flags, ctx))
+        self._wc_get_state(fi.fh, attr.st_ino)
+        return (fi, attr)
+
+    async def flush(self, fh: FileHandleT) -> None:
+        await self._wc_sync(fh)
+        await _await_result(super().flush(fh))  # type: ignore
+
+    async def fsync(self, fh: FileHandleT, datasync: bool) -> None:
+        await self._wc_sync(fh)
+        await _await_result(super().fsync(fh, datasync))  # type: ignore
+
+    async def release(self, fh: FileHandleT) -> None:
+        try:
+            await self._wc_sync(fh)
+        except FUSEError as exc:
+            log.warning('Buffered data for fh %d could not be written: %s',
+                        fh, exc)
+        finally:
+            st = self._wc_state.pop(fh, None)
+            if st is not None and st.data is not None:
+                log.warning('Discarding %d bytes of buffered data for fh %d',
+                            len(st.data), fh)
+                self._wc_detach(fh, st)
+        await _await_result(super().release(fh))  # type: ignore
@@ -13,12 +13,36 @@ the terms of the GNU LGPL.
 import asyncio
 import collections
 import sys
-from typing import Any, Callable, Iterable, Optional, Set, Type
+import types
+from typing import (Any, Awaitable, Callable, DefaultDict, Iterable, Optional,
+                    Set, Tuple, Type)
 
 import pyfuse3
 from ._pyfuse3 import FileHandleT
 
-Lock = asyncio.Lock
+
+class WouldBlock(Exception):
+    pass
+
+
+class Lock(asyncio.Lock):
+    '''`asyncio.Lock` with the ``acquire_nowait`` method of `trio.Lock`'''
+
+    def acquire_nowait(self) -> None:
+        if self.locked():
+            raise WouldBlock()
+        # If nobody else is waiting for the lock, acquire() returns without
+        # suspending. Otherwise it would queue us behind the other waiters.
+        coro = self.acquire()
+        try:
+            coro.send(None)
+        except StopIteration:
+            return
+        coro.close()
+        raise WouldBlock()
+
+
+Event = asyncio.Event
 
 
 def enable() -> None:
@@ -36,36 +60,113 @@ def disable() -> None:
     pyfuse3.trio = sys.modules['trio']  # type: ignore
 
 
-def current_trio_token() -> str:
-    return 'asyncio'
+class _Token:
+    '''Stand-in for `trio.lowlevel.TrioToken`'''
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+
+    def run_sync_soon(self, fn: Callable[..., Any], *args: Any) -> None:
+        self._loop.call_soon_threadsafe(fn, *args)
+
+
+def current_trio_token() -> _Token:
+    return _Token(asyncio.get_event_loop())
+
+
+def run(fn: Callable[..., Awaitable[Any]], *args: Any) -> Any:
+    return asyncio.run(fn(*args))  # type: ignore
+
+
+async def _run_sync_in_thread(fn: Callable[..., Any], *args: Any) -> Any:
+    return await asyncio.get_event_loop().run_in_executor(None, fn, *args)
+
 
+to_thread = types.SimpleNamespace(run_sync=_run_sync_in_thread)
 
-_read_futures = collections.defaultdict(set)
+
+# Pending wait_readable() calls. With main_mt(), every thread runs its own
+# event loop, so the futures are kept separately for every loop.
+_read_futures: DefaultDict[
+    Tuple[asyncio.AbstractEventLoop, FileHandleT],
+    'Set[asyncio.Future[Any]]'] = collections.defaultdict(set)
 
 
 async def wait_readable(fd: FileHandleT) -> None:
-    future: 'asyncio.Future[Any]' = asyncio.Future()
-    _read_futures[fd].add(future)
+    loop = asyncio.get_event_loop()
+    key = (loop, fd)
+    future: 'asyncio.Future[Any]' = loop.create_future()
+    _read_futures[key].add(future)
     try:
-        loop = asyncio.get_event_loop()
         loop.add_reader(fd, future.set_result, None)
         future.add_done_callback(lambda f: loop.remove_reader(fd))
         await future
     finally:
-        _read_futures[fd].remove(future)
-        if not _read_futures[fd]:
-            del _read_futures[fd]
+        _read_futures[key].remove(future)
+        if not _read_futures[key]:
+            del _read_futures[key]
 
 
 def notify_closing(fd: FileHandleT) -> None:
-    for f in _read_futures[fd]:
-        f.set_exception(ClosedResourceError())
+    '''Wake up wait_readable() calls for *fd* in the calling thread's loop'''
+
+    for f in _read_futures.get((asyncio.get_event_loop(), fd), ()):
+        if not f.done():
+            f.set_exception(ClosedResourceError())
 
 
 class ClosedResourceError(Exception):
     pass
 
 
+class CancelScope:
+    '''Minimal stand-in for `trio.CancelScope`
+
+    Cancelling the scope cancels the task that entered it. The resulting
+    `asyncio.CancelledError` is swallowed when the scope is exited.
+    '''
+
+    def __init__(self) -> None:
+        self._task: 'Optional[asyncio.Task[Any]]' = None
+        self.cancel_called = False
+        self.cancelled_caught = False
+
+    def __enter__(self) -> 'CancelScope':
+        self._task = current_task()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[Any]
+    ) -> bool:
+        task = self._task
+        self._task = None
+        if (self.cancel_called and exc_type is not None
+            and issubclass(exc_type, asyncio.CancelledError)):
+            if task is not None and hasattr(task, 'uncancel'):
+                task.uncancel()
+            self.cancelled_caught = True
+            return True
+        return False
+
+    def cancel(self) -> None:
+        if self.cancel_called or self._task is None:
+            return
+        self.cancel_called = True
+        if self._task is current_task():
+            # Cancel once the task is suspended, and only if it has not
+            # left the scope by then.
+            asyncio.get_event_loop().call_soon(self._cancel_task)
+        else:
+            self._task.cancel()
+
+    def _cancel_task(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+
 def current_task() -> 'Optional[asyncio.Task[Any]]':
     if sys.version_info < (3, 7):
         return asyncio.Task.current_task()
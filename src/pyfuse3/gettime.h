@@ -19,6 +19,10 @@ static int gettime_realtime(struct timespec *tp) {
     return clock_gettime(CLOCK_REALTIME, tp);
 }
 
+static int gettime_monotonic(struct timespec *tp) {
+    return clock_gettime(CLOCK_MONOTONIC, tp);
+}
+
 
 /*
  * FreeBSD & NetBSD
@@ -30,11 +34,16 @@ static int gettime_realtime(struct timespec *tp) {
     return clock_gettime(CLOCK_REALTIME, tp);
 }
 
+static int gettime_monotonic(struct timespec *tp) {
+    return clock_gettime(CLOCK_MONOTONIC, tp);
+}
+
 /*
  * Darwin
  */
 #elif PLATFORM == PLATFORM_DARWIN
 #include <sys/time.h>
+#include <time.h>
 
 static int gettime_realtime(struct timespec *tp) {
     struct timeval tv;
@@ -50,6 +59,10 @@ static int gettime_realtime(struct timespec *tp) {
     return 0;
 }
 
+static int gettime_monotonic(struct timespec *tp) {
+    return clock_gettime(CLOCK_MONOTONIC, tp);
+}
+
 
 /*
  * Unknown system
@@ -30,7 +30,246 @@ cdef class _Container:
     cdef struct_stat stat
     cdef uint64_t fh
 
+    # For request statistics
+    cdef int      op
+    cdef int      error
+    cdef uint64_t t_start
+    cdef size_t   bytes_in
+    cdef size_t   bytes_out
+
+    # TraceEvent, if request is being traced
+    cdef object   trace
+
+# Request types, as reported by get_stats()
+cdef enum:
+    OP_LOOKUP = 0
+    OP_FORGET = 1
+    OP_GETATTR = 2
+    OP_SETATTR = 3
+    OP_READLINK = 4
+    OP_MKNOD = 5
+    OP_MKDIR = 6
+    OP_UNLINK = 7
+    OP_RMDIR = 8
+    OP_SYMLINK = 9
+    OP_RENAME = 10
+    OP_LINK = 11
+    OP_OPEN = 12
+    OP_READ = 13
+    OP_WRITE = 14
+    OP_FLUSH = 15
+    OP_RELEASE = 16
+    OP_FSYNC = 17
+    OP_OPENDIR = 18
+    OP_READDIR = 19
+    OP_RELEASEDIR = 20
+    OP_FSYNCDIR = 21
+    OP_STATFS = 22
+    OP_SETXATTR = 23
+    OP_GETXATTR = 24
+    OP_LISTXATTR = 25
+    OP_REMOVEXATTR = 26
+    OP_ACCESS = 27
+    OP_CREATE = 28
+    N_OPS = 29
+
+_op_names = ('lookup', 'forget', 'getattr', 'setattr', 'readlink',
+             'mknod', 'mkdir', 'unlink', 'rmdir', 'symlink', 'rename',
+             'link', 'open', 'read', 'write', 'flush', 'release',
+             'fsync', 'opendir', 'readdir', 'releasedir', 'fsyncdir',
+             'statfs', 'setxattr', 'getxattr', 'listxattr',
+             'removexattr', 'access', 'create')
+
+# Maximum number of _Container instances that each worker keeps for reuse.
+# Containers of synchronous handlers are returned by the request callback,
+# also if the handler raised (the exception is re-raised by the worker).
+# Containers of coroutine handlers are returned by the worker once the
+# handler has completed; if it raised, the worker terminates and the
+# container is left to the garbage collector.
+cdef enum:
+    CONTAINER_POOL_SIZE = 128
+
+cdef _Container new_container(fuse_req_t req, int op):
+    '''Return _Container for *req*, taken from the worker's pool if possible'''
+
+    cdef _WorkerData wd = <_WorkerData> pyfuse3_worker_data
+    cdef _Container c
+
+    if wd.free_containers:
+        c = <_Container> wd.free_containers.pop()
+    else:
+        c = _Container.__new__(_Container)
+    c.req = req
+    c.op = op
+    c.ino = 0
+    c.parent = 0
+    c.fh = 0
+    c.off = 0
+    c.size = 0
+    c.error = 0
+    c.bytes_in = 0
+    c.bytes_out = 0
+    return c
+
+cdef inline void request_started(_Container c):
+    '''Record start of request processing
+
+    Called once all request parameters have been stored in *c*.
+    '''
+
+    if stats_enabled:
+        stats_request_started(c)
+    if tracer is not None:
+        trace_request_started(c)
+
+cdef void free_container(_Container c):
+    '''Return *c* to the worker's pool
+
+    Must only be called once the request has been answered and nothing
+    refers to *c* anymore.
+    '''
+
+    cdef _WorkerData wd = <_WorkerData> pyfuse3_worker_data
+
+    if stats_enabled:
+        stats_request_finished(c)
+    if c.trace is not None:
+        trace_request_finished(c)
+    if len(wd.free_containers) < CONTAINER_POOL_SIZE:
+        wd.free_containers.append(c)
+
+cdef inline int reply_err(_Container c, int err):
+    '''Answer request with error *err* and record it for get_stats()'''
+
+    c.error = err
+    return fuse_reply_err(c.req, err)
+
+# Request classes with separate concurrency limits (cf. the *lanes*
+# argument of main())
+cdef enum:
+    LANE_METADATA = 0
+    LANE_DATA = 1
+    LANE_XATTR = 2
+    N_LANES = 3
+
+_lane_names = ('metadata', 'data', 'xattr')
+
+# Request handlers that may be regular functions rather than coroutine
+# functions (cf. `sync_handler`). For these, the C callback calls the
+# handler directly and sends the reply before returning. If the handler
+# returns an awaitable after all, the request is completed by the worker.
+cdef enum:
+    SYNC_LOOKUP = 1 << 0
+    SYNC_GETATTR = 1 << 1
+    SYNC_READLINK = 1 << 2
+    SYNC_OPEN = 1 << 3
+    SYNC_READ = 1 << 4
+    SYNC_OPENDIR = 1 << 5
+    SYNC_STATFS = 1 << 6
+    SYNC_GETXATTR = 1 << 7
+    SYNC_LISTXATTR = 1 << 8
+    SYNC_ACCESS = 1 << 9
+
+_sync_op_flags = {
+    'lookup': SYNC_LOOKUP,
+    'forget': 0, # works without special treatment
+    'getattr': SYNC_GETATTR,
+    'readlink': SYNC_READLINK,
+    'open': SYNC_OPEN,
+    'read': SYNC_READ,
+    'opendir': SYNC_OPENDIR,
+    'statfs': SYNC_STATFS,
+    'getxattr': SYNC_GETXATTR,
+    'listxattr': SYNC_LISTXATTR,
+    'access': SYNC_ACCESS,
+}
+
+# Bitmask of the SYNC_* flags of the handlers that are synchronous.
+# Set by init().
+cdef unsigned sync_ops = 0
+
+# Request handlers that receive a RequestContext. Handlers that do not use
+# it (cf. `ignores_ctx`) get None instead.
+cdef enum:
+    CTX_LOOKUP = 1 << 0
+    CTX_GETATTR = 1 << 1
+    CTX_SETATTR = 1 << 2
+    CTX_READLINK = 1 << 3
+    CTX_MKNOD = 1 << 4
+    CTX_MKDIR = 1 << 5
+    CTX_UNLINK = 1 << 6
+    CTX_RMDIR = 1 << 7
+    CTX_SYMLINK = 1 << 8
+    CTX_RENAME = 1 << 9
+    CTX_LINK = 1 << 10
+    CTX_OPEN = 1 << 11
+    CTX_OPENDIR = 1 << 12
+    CTX_STATFS = 1 << 13
+    CTX_SETXATTR = 1 << 14
+    CTX_GETXATTR = 1 << 15
+    CTX_LISTXATTR = 1 << 16
+    CTX_REMOVEXATTR = 1 << 17
+    CTX_ACCESS = 1 << 18
+    CTX_CREATE = 1 << 19
+
+_ctx_op_flags = {
+    'lookup': CTX_LOOKUP,
+    'getattr': CTX_GETATTR,
+    'setattr': CTX_SETATTR,
+    'readlink': CTX_READLINK,
+    'mknod': CTX_MKNOD,
+    'mkdir': CTX_MKDIR,
+    'unlink': CTX_UNLINK,
+    'rmdir': CTX_RMDIR,
+    'symlink': CTX_SYMLINK,
+    'rename': CTX_RENAME,
+    'link': CTX_LINK,
+    'open': CTX_OPEN,
+    'opendir': CTX_OPENDIR,
+    'statfs': CTX_STATFS,
+    'setxattr': CTX_SETXATTR,
+    'getxattr': CTX_GETXATTR,
+    'listxattr': CTX_LISTXATTR,
+    'removexattr': CTX_REMOVEXATTR,
+    'access': CTX_ACCESS,
+    'create': CTX_CREATE,
+}
+
+# Bitmask of the CTX_* flags of the handlers that ignore their *ctx*
+# argument. Set by init().
+cdef unsigned noctx_ops = 0
+
+# Set by init() if write() handlers should receive a memoryview of the
+# receive buffer rather than a copy of the data.
+cdef bint zero_copy_write = False
+
+# Set by init() if the file system implements the write_to_fd() handler
+cdef bint write_to_fd_enabled = False
+
+# Set by fuse_init() if the kernel agreed to FUSE passthrough
+cdef bint passthrough_enabled = False
+
+# Backing file ids registered for FileInfo.backing_fd, indexed by file
+# handle (one list entry for every open that used the file handle).
+cdef dict _backing_ids = dict()
+
+# Connection parameters requested by the file system (cf. the max_write,
+# max_readahead, max_background and congestion_threshold attributes of
+# Operations). Set by init().
+cdef dict _conn_limits = dict()
+
+# Connection parameters as negotiated with the kernel. Points into the
+# FUSE session, set by fuse_init().
+cdef fuse_conn_info *conn_info = NULL
+
 cdef void fuse_init (void *userdata, fuse_conn_info *conn):
+    global passthrough_enabled
+    global conn_info
+    cdef ConnectionInfo conn_obj
+    # libfuse has already limited this to the size of its receive buffer
+    # (minus the header).
+    cdef unsigned libfuse_max_write = conn.max_write
+
     if not conn.capable & FUSE_CAP_READDIRPLUS:
         raise RuntimeError('Kernel too old, pyfuse3 requires kernel 3.9 or newer!')
     conn.want &= ~(<unsigned> FUSE_CAP_READDIRPLUS_AUTO)
@@ -38,36 +277,153 @@ cdef void fuse_init (void *userdata, fuse_conn_info *conn):
     if (operations.supports_dot_lookup and
         conn.capable & FUSE_CAP_EXPORT_SUPPORT):
         conn.want |= FUSE_CAP_EXPORT_SUPPORT
-    if (operations.enable_writeback_cache and
+    passthrough_enabled = False
+    if (operations.enable_passthrough and
+        conn.capable & CAP_PASSTHROUGH):
+        conn.want |= CAP_PASSTHROUGH
+        passthrough_enabled = True
+    # The kernel does not support passthrough together with writeback
+    # caching.
+    if (operations.enable_writeback_cache and not passthrough_enabled and
         conn.capable & FUSE_CAP_WRITEBACK_CACHE):
         conn.want |= FUSE_CAP_WRITEBACK_CACHE
     if (operations.enable_acl and
         conn.capable & FUSE_CAP_POSIX_ACL):
         conn.want |= FUSE_CAP_POSIX_ACL
 
-    # Blocking rather than async, in case we decide to let the
-    # init handler modify `conn` in the future.
-    operations.init()
+    if 'max_write' in _conn_limits:
+        conn.max_write = _conn_limits['max_write']
+    if 'max_readahead' in _conn_limits:
+        if _conn_limits['max_readahead'] > conn.max_readahead:
+            log.warning('Kernel only supports readahead of up to %d bytes',
+                        conn.max_readahead)
+        else:
+            conn.max_readahead = _conn_limits['max_readahead']
+    if 'max_background' in _conn_limits:
+        conn.max_background = _conn_limits['max_background']
+    if 'congestion_threshold' in _conn_limits:
+        conn.congestion_threshold = _conn_limits['congestion_threshold']
+    # Allows FileRange replies to be spliced from the file into the
+    # FUSE device. Other replies are not affected.
+    if conn.capable & FUSE_CAP_SPLICE_WRITE:
+        conn.want |= FUSE_CAP_SPLICE_WRITE
+    if write_to_fd_enabled:
+        # Let the kernel pass write data in a pipe, so that write_to_fd()
+        # can splice it into the target file.
+        if conn.capable & FUSE_CAP_SPLICE_READ:
+            conn.want |= FUSE_CAP_SPLICE_READ
+    elif zero_copy_write:
+        # Write data must be in the receive buffer rather than in a pipe.
+        conn.want &= ~(<unsigned> FUSE_CAP_SPLICE_READ)
+
+    # libfuse may still reduce some values after we return, so the final
+    # values are only read out by get_connection_info().
+    conn_info = conn
+
+    # Blocking rather than async, so that the init handler can modify
+    # `conn`.
+    if _pyfuse3._init_takes_conn(operations):
+        conn_obj = ConnectionInfo.__new__(ConnectionInfo)
+        conn_obj.writable = True
+        try:
+            operations.init(conn_obj)
+        finally:
+            conn_obj.writable = False
+    else:
+        operations.init()
+
+    # pyfuse3 only implements READDIRPLUS
+    conn.want |= FUSE_CAP_READDIRPLUS
+    conn.want &= ~(<unsigned> FUSE_CAP_READDIRPLUS_AUTO)
+
+    passthrough_enabled = bool(conn.want & CAP_PASSTHROUGH)
+    if passthrough_enabled and conn.want & FUSE_CAP_WRITEBACK_CACHE:
+        log.warning('Writeback cache cannot be used together with passthrough, '
+                    'disabling writeback cache.')
+        conn.want &= ~(<unsigned> FUSE_CAP_WRITEBACK_CACHE)
+
+    # Receive buffers must be as large as the ones libfuse would use, and
+    # large enough for the largest write request the kernel may send.
+    set_recv_buf_size(max(libfuse_max_write, conn.max_write))
+
+cdef void fuse_interrupt (fuse_req_t req, void *data):
+    # Registered by _run_interruptible(). Since the request may already
+    # have been answered by the time this is called, *req* is only used as
+    # a key.
+    try:
+        (scope, thread_id) = _req_scopes[<uintptr_t> req]
+    except KeyError:
+        return
+
+    if thread_id == threading.get_ident():
+        scope.cancel()
+        return
+
+    # Request is being processed by an event loop in another thread
+    try:
+        _mt_tokens[thread_id].run_sync_soon(scope.cancel)
+    except (KeyError, RuntimeError):
+        # Event loop has already finished
+        pass
 
 cdef void fuse_lookup (fuse_req_t req, fuse_ino_t parent,
                        const_char *name):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_LOOKUP)
     c.parent = parent
-    save_retval(fuse_lookup_async(c, PyBytes_FromString(name)))
+    if sync_ops & SYNC_LOOKUP:
+        request_started(c)
+        try:
+            done = fuse_lookup_sync(c, PyBytes_FromString(name))
+        except BaseException as exc:
+            c.error = errno.EIO
+            save_exception(exc)
+            done = True
+        if done:
+            free_container(c)
+    else:
+        save_retval(fuse_lookup_async(c, PyBytes_FromString(name)), c)
 
-async def fuse_lookup_async (_Container c, name):
+cdef fuse_lookup_sync (_Container c, name):
     cdef EntryAttributes entry
     cdef int ret
 
-    ctx = get_request_context(c.req)
+    ctx = get_request_context(c.req, CTX_LOOKUP)
     try:
-        entry = <EntryAttributes?> await operations.lookup(
-            c.parent, name, ctx)
+        res = operations.lookup(c.parent, name, ctx)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
-        ret = fuse_reply_entry(c.req, &entry.fuse_param)
+        if inspect.isawaitable(res):
+            # Regular function that returned an awaitable after all
+            save_retval(fuse_lookup_async(c, name, res), c, LANE_METADATA, True)
+            return False
+        if isinstance(res, FUSEError):
+            ret = reply_err(c, (<FUSEError> res).errno_)
+        else:
+            entry = <EntryAttributes?> res
+            ret = fuse_reply_entry(c.req, &entry.fuse_param)
+
+    if ret != 0:
+        log.error('fuse_lookup(): fuse_reply_* failed with %s', strerror(-ret))
+    return True
+
+async def fuse_lookup_async (_Container c, name, pending=None):
+    cdef EntryAttributes entry
+    cdef int ret
+
+    ctx = get_request_context(c.req, CTX_LOOKUP)
+    try:
+        if pending is None:
+            pending = operations.lookup(c.parent, name, ctx)
+        res = await pending
+    except FUSEError as e:
+        ret = reply_err(c, e.errno)
+    else:
+        if isinstance(res, FUSEError):
+            ret = reply_err(c, (<FUSEError> res).errno_)
+        else:
+            entry = <EntryAttributes?> res
+            ret = fuse_reply_entry(c.req, &entry.fuse_param)
 
     if ret != 0:
         log.error('fuse_lookup(): fuse_reply_* failed with %s', strerror(-ret))
@@ -75,6 +431,8 @@ async def fuse_lookup_async (_Container c, name):
 
 cdef void fuse_forget (fuse_req_t req, fuse_ino_t ino,
                        uint64_t nlookup):
+    if stats_enabled:
+        op_stats[OP_FORGET].count += 1
     save_retval(operations.forget([(ino, nlookup)]))
     fuse_reply_none(req)
 
@@ -84,28 +442,70 @@ cdef void fuse_forget_multi(fuse_req_t req, size_t count,
     forget_list = list()
     for el in forgets[:count]:
         forget_list.append((el.ino, el.nlookup))
+    if stats_enabled:
+        op_stats[OP_FORGET].count += 1
     save_retval(operations.forget(forget_list))
     fuse_reply_none(req)
 
 
 cdef void fuse_getattr (fuse_req_t req, fuse_ino_t ino,
                         fuse_file_info *fi):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_GETATTR)
     c.ino = ino
-    save_retval(fuse_getattr_async(c))
+    if sync_ops & SYNC_GETATTR:
+        request_started(c)
+        try:
+            done = fuse_getattr_sync(c)
+        except BaseException as exc:
+            c.error = errno.EIO
+            save_exception(exc)
+            done = True
+        if done:
+            free_container(c)
+    else:
+        save_retval(fuse_getattr_async(c), c)
 
-async def fuse_getattr_async (_Container c):
+cdef fuse_getattr_sync (_Container c):
     cdef int ret
     cdef EntryAttributes entry
 
-    ctx = get_request_context(c.req)
+    ctx = get_request_context(c.req, CTX_GETATTR)
     try:
-        entry = <EntryAttributes?> await operations.getattr(c.ino, ctx)
+        res = operations.getattr(c.ino, ctx)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
-        ret = fuse_reply_attr(c.req, entry.attr, entry.fuse_param.attr_timeout)
+        if inspect.isawaitable(res):
+            # Regular function that returned an awaitable after all
+            save_retval(fuse_getattr_async(c, res), c, LANE_METADATA, True)
+            return False
+        if isinstance(res, FUSEError):
+            ret = reply_err(c, (<FUSEError> res).errno_)
+        else:
+            entry = <EntryAttributes?> res
+            ret = fuse_reply_attr(c.req, entry.attr, entry.fuse_param.attr_timeout)
+
+    if ret != 0:
+        log.error('fuse_getattr(): fuse_reply_* failed with %s', strerror(-ret))
+    return True
+
+async def fuse_getattr_async (_Container c, pending=None):
+    cdef int ret
+    cdef EntryAttributes entry
+
+    ctx = get_request_context(c.req, CTX_GETATTR)
+    try:
+        if pending is None:
+            pending = operations.getattr(c.ino, ctx)
+        res = await pending
+    except FUSEError as e:
+        ret = reply_err(c, e.errno)
+    else:
+        if isinstance(res, FUSEError):
+            ret = reply_err(c, (<FUSEError> res).errno_)
+        else:
+            entry = <EntryAttributes?> res
+            ret = fuse_reply_attr(c.req, entry.attr, entry.fuse_param.attr_timeout)
 
     if ret != 0:
         log.error('fuse_getattr(): fuse_reply_* failed with %s', strerror(-ret))
@@ -113,8 +513,7 @@ async def fuse_getattr_async (_Container c):
 
 cdef void fuse_setattr (fuse_req_t req, fuse_ino_t ino, struct_stat *stat,
                         int to_set, fuse_file_info *fi):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_SETATTR)
     c.ino = ino
     c.stat = stat[0]
     c.flags = to_set
@@ -122,7 +521,7 @@ cdef void fuse_setattr (fuse_req_t req, fuse_ino_t ino, struct_stat *stat,
         fh = None
     else:
         fh = fi.fh
-    save_retval(fuse_setattr_async(c, fh))
+    save_retval(fuse_setattr_async(c, fh), c)
 
 async def fuse_setattr_async (_Container c, fh):
     cdef int ret
@@ -132,7 +531,7 @@ async def fuse_setattr_async (_Container c, fh):
     cdef struct_stat *attr
     cdef int to_set = c.flags
 
-    ctx = get_request_context(c.req)
+    ctx = get_request_context(c.req, CTX_SETATTR)
     entry = EntryAttributes()
     fields = SetattrFields.__new__(SetattrFields)
     string.memcpy(entry.attr, &c.stat, sizeof(struct_stat))
@@ -167,7 +566,7 @@ async def fuse_setattr_async (_Container c, fh):
     try:
         entry = <EntryAttributes?> await operations.setattr(c.ino, entry, fields, fh, ctx)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
         ret = fuse_reply_attr(c.req, entry.attr, entry.fuse_param.attr_timeout)
 
@@ -176,22 +575,60 @@ async def fuse_setattr_async (_Container c, fh):
 
 
 cdef void fuse_readlink (fuse_req_t req, fuse_ino_t ino):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_READLINK)
     c.ino = ino
-    save_retval(fuse_readlink_async(c))
+    if sync_ops & SYNC_READLINK:
+        request_started(c)
+        try:
+            done = fuse_readlink_sync(c)
+        except BaseException as exc:
+            c.error = errno.EIO
+            save_exception(exc)
+            done = True
+        if done:
+            free_container(c)
+    else:
+        save_retval(fuse_readlink_async(c), c)
+
+cdef fuse_readlink_sync (_Container c):
+    cdef int ret
+    cdef char* name
+    ctx = get_request_context(c.req, CTX_READLINK)
+    try:
+        target = operations.readlink(c.ino, ctx)
+    except FUSEError as e:
+        ret = reply_err(c, e.errno)
+    else:
+        if inspect.isawaitable(target):
+            # Regular function that returned an awaitable after all
+            save_retval(fuse_readlink_async(c, target), c, LANE_METADATA, True)
+            return False
+        if isinstance(target, FUSEError):
+            ret = reply_err(c, (<FUSEError> target).errno_)
+        else:
+            name = PyBytes_AsString(target)
+            ret = fuse_reply_readlink(c.req, name)
+
+    if ret != 0:
+        log.error('fuse_readlink(): fuse_reply_* failed with %s', strerror(-ret))
+    return True
 
-async def fuse_readlink_async (_Container c):
+async def fuse_readlink_async (_Container c, pending=None):
     cdef int ret
     cdef char* name
-    ctx = get_request_context(c.req)
+    ctx = get_request_context(c.req, CTX_READLINK)
     try:
-        target = await operations.readlink(c.ino, ctx)
+        if pending is None:
+            pending = operations.readlink(c.ino, ctx)
+        target = await pending
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
-        name = PyBytes_AsString(target)
-        ret = fuse_reply_readlink(c.req, name)
+        if isinstance(target, FUSEError):
+            ret = reply_err(c, (<FUSEError> target).errno_)
+        else:
+            name = PyBytes_AsString(target)
+            ret = fuse_reply_readlink(c.req, name)
 
     if ret != 0:
         log.error('fuse_readlink(): fuse_reply_* failed with %s', strerror(-ret))
@@ -199,23 +636,22 @@ async def fuse_readlink_async (_Container c):
 
 cdef void fuse_mknod (fuse_req_t req, fuse_ino_t parent, const_char *name,
                       mode_t mode, dev_t rdev):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_MKNOD)
     c.parent = parent
     c.mode = mode
     c.rdev = rdev
-    save_retval(fuse_mknod_async(c, PyBytes_FromString(name)))
+    save_retval(fuse_mknod_async(c, PyBytes_FromString(name)), c)
 
 async def fuse_mknod_async (_Container c, name):
     cdef int ret
     cdef EntryAttributes entry
 
-    ctx = get_request_context(c.req)
+    ctx = get_request_context(c.req, CTX_MKNOD)
     try:
         entry = <EntryAttributes?> await operations.mknod(
             c.parent, name, c.mode, c.rdev, ctx)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
         ret = fuse_reply_entry(c.req, &entry.fuse_param)
 
@@ -225,11 +661,10 @@ async def fuse_mknod_async (_Container c, name):
 
 cdef void fuse_mkdir (fuse_req_t req, fuse_ino_t parent, const_char *name,
                       mode_t mode):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_MKDIR)
     c.parent = parent
     c.mode = mode
-    save_retval(fuse_mkdir_async(c, PyBytes_FromString(name)))
+    save_retval(fuse_mkdir_async(c, PyBytes_FromString(name)), c)
 
 async def fuse_mkdir_async (_Container c, name):
     cdef int ret
@@ -238,12 +673,12 @@ async def fuse_mkdir_async (_Container c, name):
     # Force the entry type to directory. We need to explicitly cast,
     # because on BSD the S_* are not of type mode_t.
     c.mode = (c.mode & ~ <mode_t> S_IFMT) | <mode_t> S_IFDIR
-    ctx = get_request_context(c.req)
+    ctx = get_request_context(c.req, CTX_MKDIR)
     try:
         entry = <EntryAttributes?> await operations.mkdir(
             c.parent, name, c.mode, ctx)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
         ret = fuse_reply_entry(c.req, &entry.fuse_param)
 
@@ -252,19 +687,18 @@ async def fuse_mkdir_async (_Container c, name):
 
 
 cdef void fuse_unlink (fuse_req_t req, fuse_ino_t parent, const_char *name):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_UNLINK)
     c.parent = parent
-    save_retval(fuse_unlink_async(c, PyBytes_FromString(name)))
+    save_retval(fuse_unlink_async(c, PyBytes_FromString(name)), c)
 
 async def fuse_unlink_async (_Container c, name):
     cdef int ret
 
-    ctx = get_request_context(c.req)
+    ctx = get_request_context(c.req, CTX_UNLINK)
     try:
         await operations.unlink(c.parent, name, ctx)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
         ret = fuse_reply_err(c.req, 0)
 
@@ -273,19 +707,18 @@ async def fuse_unlink_async (_Container c, name):
 
 
 cdef void fuse_rmdir (fuse_req_t req, fuse_ino_t parent, const_char *name):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_RMDIR)
     c.parent = parent
-    save_retval(fuse_rmdir_async(c, PyBytes_FromString(name)))
+    save_retval(fuse_rmdir_async(c, PyBytes_FromString(name)), c)
 
 async def fuse_rmdir_async (_Container c, name):
     cdef int ret
 
-    ctx = get_request_context(c.req)
+    ctx = get_request_context(c.req, CTX_RMDIR)
     try:
         await operations.rmdir(c.parent, name, ctx)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
         ret = fuse_reply_err(c.req, 0)
 
@@ -295,22 +728,21 @@ async def fuse_rmdir_async (_Container c, name):
 
 cdef void fuse_symlink (fuse_req_t req, const_char *link, fuse_ino_t parent,
                         const_char *name):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_SYMLINK)
     c.parent = parent
     save_retval(fuse_symlink_async(
-        c, PyBytes_FromString(name), PyBytes_FromString(link)))
+        c, PyBytes_FromString(name), PyBytes_FromString(link)), c)
 
 async def fuse_symlink_async (_Container c, name, link):
     cdef int ret
     cdef EntryAttributes entry
 
-    ctx = get_request_context(c.req)
+    ctx = get_request_context(c.req, CTX_SYMLINK)
     try:
         entry = <EntryAttributes?> await operations.symlink(
             c.parent, name, link, ctx)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
         ret = fuse_reply_entry(c.req, &entry.fuse_param)
 
@@ -320,13 +752,12 @@ async def fuse_symlink_async (_Container c, name, link):
 
 cdef void fuse_rename (fuse_req_t req, fuse_ino_t parent, const_char *name,
                        fuse_ino_t newparent, const_char *newname, unsigned flags):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_RENAME)
     c.parent = parent
     c.ino = newparent
     c.flags = <int> flags
     save_retval(fuse_rename_async(
-        c, PyBytes_FromString(name), PyBytes_FromString(newname)))
+        c, PyBytes_FromString(name), PyBytes_FromString(newname)), c)
 
 
 async def fuse_rename_async (_Container c, name, newname):
@@ -334,11 +765,11 @@ async def fuse_rename_async (_Container c, name, newname):
     cdef unsigned flags = <unsigned> c.flags
     cdef fuse_ino_t newparent = c.ino
 
-    ctx = get_request_context(c.req)
+    ctx = get_request_context(c.req, CTX_RENAME)
     try:
         await operations.rename(c.parent, name, newparent, newname, flags, ctx)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
         ret = fuse_reply_err(c.req, 0)
 
@@ -348,22 +779,21 @@ async def fuse_rename_async (_Container c, name, newname):
 
 cdef void fuse_link (fuse_req_t req, fuse_ino_t ino, fuse_ino_t newparent,
                      const_char *newname):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_LINK)
     c.ino = ino
     c.parent = newparent
-    save_retval(fuse_link_async(c, PyBytes_FromString(newname)))
+    save_retval(fuse_link_async(c, PyBytes_FromString(newname)), c)
 
 async def fuse_link_async (_Container c, newname):
     cdef int ret
     cdef EntryAttributes entry
 
-    ctx = get_request_context(c.req)
+    ctx = get_request_context(c.req, CTX_LINK)
     try:
         entry = <EntryAttributes?> await operations.link(
             c.ino, c.parent, newname, ctx)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
         ret = fuse_reply_entry(c.req, &entry.fuse_param)
 
@@ -372,51 +802,233 @@ async def fuse_link_async (_Container c, newname):
 
 
 cdef void fuse_open (fuse_req_t req, fuse_ino_t ino, fuse_file_info *fi):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_OPEN)
     c.ino = ino
     c.fi = fi[0]
-    save_retval(fuse_open_async(c))
+    if sync_ops & SYNC_OPEN:
+        request_started(c)
+        try:
+            done = fuse_open_sync(c)
+        except BaseException as exc:
+            c.error = errno.EIO
+            save_exception(exc)
+            done = True
+        if done:
+            free_container(c)
+    else:
+        save_retval(fuse_open_async(c), c)
 
-async def fuse_open_async (_Container c):
+cdef fuse_open_sync (_Container c):
     cdef int ret
     cdef FileInfo fi
 
-    ctx = get_request_context(c.req)
+    ctx = get_request_context(c.req, CTX_OPEN)
 
     try:
-        fi = <FileInfo?> await operations.open(c.ino, c.fi.flags, ctx)
+        res = operations.open(c.ino, c.fi.flags, ctx)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
-        fi._copy_to_fuse(&c.fi)
-        ret = fuse_reply_open(c.req, &c.fi)
+        if inspect.isawaitable(res):
+            # Regular function that returned an awaitable after all
+            save_retval(fuse_open_async(c, res), c, LANE_METADATA, True)
+            return False
+        if isinstance(res, FUSEError):
+            ret = reply_err(c, (<FUSEError> res).errno_)
+        else:
+            fi = <FileInfo?> res
+            fi._copy_to_fuse(&c.fi)
+            open_backing_file(c, fi)
+            ret = fuse_reply_open(c.req, &c.fi)
+            if ret != 0:
+                close_backing_file(c.req, c.fi.fh)
+
+    if ret != 0:
+        log.error('fuse_open(): fuse_reply_* failed with %s', strerror(-ret))
+    return True
+
+async def fuse_open_async (_Container c, pending=None):
+    cdef int ret
+    cdef FileInfo fi
+
+    ctx = get_request_context(c.req, CTX_OPEN)
+
+    try:
+        if pending is None:
+            pending = operations.open(c.ino, c.fi.flags, ctx)
+        res = await pending
+    except FUSEError as e:
+        ret = reply_err(c, e.errno)
+    else:
+        if isinstance(res, FUSEError):
+            ret = reply_err(c, (<FUSEError> res).errno_)
+        else:
+            fi = <FileInfo?> res
+            fi._copy_to_fuse(&c.fi)
+            open_backing_file(c, fi)
+            ret = fuse_reply_open(c.req, &c.fi)
+            if ret != 0:
+                close_backing_file(c.req, c.fi.fh)
 
     if ret != 0:
         log.error('fuse_link(): fuse_reply_* failed with %s', strerror(-ret))
 
 
+cdef void open_backing_file(_Container c, FileInfo fi):
+    '''Register *fi.backing_fd* for passthrough I/O on the file being opened
+
+    If passthrough is not available, the file is opened as usual and read
+    and write requests are sent to the file system.
+    '''
+
+    cdef int backing_id
+
+    if fi.backing_fd < 0 or not passthrough_enabled:
+        return
+    backing_id = PASSTHROUGH_OPEN(c.req, fi.backing_fd)
+    if backing_id <= 0:
+        # Error has already been logged by libfuse
+        return
+    SET_BACKING_ID(&c.fi, backing_id)
+    _backing_ids.setdefault(c.fi.fh, []).append(backing_id)
+
+cdef void close_backing_file(fuse_req_t req, uint64_t fh):
+    '''Release a backing file id registered by open_backing_file()'''
+
+    cdef int backing_id
+
+    ids = _backing_ids.get(fh)
+    if not ids:
+        return
+    backing_id = ids.pop()
+    if not ids:
+        del _backing_ids[fh]
+    PASSTHROUGH_CLOSE(req, backing_id)
+
+
 cdef void fuse_read (fuse_req_t req, fuse_ino_t ino, size_t size, off_t off,
                      fuse_file_info *fi):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_READ)
+    c.ino = ino
     c.size = size
     c.off = off
     c.fh = fi.fh
-    save_retval(fuse_read_async(c))
+    if sync_ops & SYNC_READ:
+        request_started(c)
+        try:
+            done = fuse_read_sync(c)
+        except BaseException as exc:
+            c.error = errno.EIO
+            save_exception(exc)
+            done = True
+        if done:
+            free_container(c)
+    else:
+        save_retval(fuse_read_async(c), c, LANE_DATA)
 
-async def fuse_read_async (_Container c):
+# libfuse adds one more iovec for the header, and writev() does not accept
+# more than IOV_MAX (1024 on Linux) elements.
+cdef enum:
+    MAX_READ_IOV = 1023
+
+cdef int fuse_read_reply (_Container c, buf) except? -1:
     cdef int ret
     cdef Py_buffer pybuf
+    cdef fuse_bufvec bufv
+    cdef FileRange fr
+
+    if isinstance(buf, FileRange):
+        fr = <FileRange> buf
+        bufv.count = 1
+        bufv.idx = 0
+        bufv.off = 0
+        bufv.buf[0].size = min(fr.length, c.size)
+        bufv.buf[0].flags = <fuse_buf_flags> (FUSE_BUF_IS_FD | FUSE_BUF_FD_SEEK)
+        bufv.buf[0].mem = NULL
+        bufv.buf[0].fd = fr.fd
+        bufv.buf[0].pos = fr.offset
+        c.bytes_out = bufv.buf[0].size
+        with nogil:
+            ret = fuse_reply_data(c.req, &bufv, FUSE_BUF_SPLICE_MOVE)
+        return ret
+
+    if isinstance(buf, (list, tuple)):
+        if 0 < len(buf) < MAX_READ_IOV:
+            return fuse_read_reply_iov(c, buf)
+        buf = b''.join(buf)
+
+    PyObject_GetBuffer(buf, &pybuf, PyBUF_CONTIG_RO)
+    c.bytes_out = <size_t> pybuf.len
+    ret = fuse_reply_buf(c.req, <const_char*> pybuf.buf, <size_t> pybuf.len)
+    PyBuffer_Release(&pybuf)
+    return ret
+
+cdef int fuse_read_reply_iov (_Container c, bufs) except? -1:
+    '''Reply to read request with the concatenation of the buffers in *bufs*'''
 
+    cdef int ret
+    cdef int count = len(bufs)
+    cdef int i = 0
+    cdef Py_buffer *pybufs
+    cdef iovec *iov
+
+    pybufs = <Py_buffer*> stdlib.calloc(count, sizeof(Py_buffer))
+    iov = <iovec*> stdlib.calloc(count, sizeof(iovec))
+    if pybufs is NULL or iov is NULL:
+        stdlib.free(pybufs)
+        stdlib.free(iov)
+        raise MemoryError()
     try:
-        buf = await operations.read(c.fh, c.off, c.size)
+        for el in bufs:
+            PyObject_GetBuffer(el, &pybufs[i], PyBUF_CONTIG_RO)
+            iov[i].iov_base = pybufs[i].buf
+            iov[i].iov_len = <size_t> pybufs[i].len
+            c.bytes_out += <size_t> pybufs[i].len
+            i += 1
+        ret = fuse_reply_iov(c.req, iov, count)
+    finally:
+        while i > 0:
+            i -= 1
+            PyBuffer_Release(&pybufs[i])
+        stdlib.free(iov)
+        stdlib.free(pybufs)
+    return ret
+
+cdef fuse_read_sync (_Container c):
+    cdef int ret
+
+    try:
+        buf = operations.read(c.fh, c.off, c.size)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
-        PyObject_GetBuffer(buf, &pybuf, PyBUF_CONTIG_RO)
-        ret = fuse_reply_buf(c.req, <const_char*> pybuf.buf, <size_t> pybuf.len)
-        PyBuffer_Release(&pybuf)
+        if inspect.isawaitable(buf):
+            # Regular function that returned an awaitable after all
+            save_retval(fuse_read_async(c, buf), c, LANE_DATA, True)
+            return False
+        if isinstance(buf, FUSEError):
+            ret = reply_err(c, (<FUSEError> buf).errno_)
+        else:
+            ret = fuse_read_reply(c, buf)
+
+    if ret != 0:
+        log.error('fuse_read(): fuse_reply_* failed with %s', strerror(-ret))
+    return True
+
+async def fuse_read_async (_Container c, pending=None):
+    cdef int ret
+
+    try:
+        if pending is None:
+            pending = operations.read(c.fh, c.off, c.size)
+        buf = await pending
+    except FUSEError as e:
+        ret = reply_err(c, e.errno)
+    else:
+        if isinstance(buf, FUSEError):
+            ret = reply_err(c, (<FUSEError> buf).errno_)
+        else:
+            ret = fuse_read_reply(c, buf)
 
     if ret != 0:
         log.error('fuse_read(): fuse_reply_* failed with %s', strerror(-ret))
@@ -424,16 +1036,17 @@ async def fuse_read_async (_Container c):
 
 cdef void fuse_write (fuse_req_t req, fuse_ino_t ino, const_char *buf,
                       size_t size, off_t off, fuse_file_info *fi):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_WRITE)
+    c.ino = ino
     c.size = size
     c.off = off
     c.fh = fi.fh
+    c.bytes_in = size
 
     if size > PY_SSIZE_T_MAX:
         raise OverflowError('Value too long to convert to Python')
-    pbuf = PyBytes_FromStringAndSize(buf, <ssize_t> size)
-    save_retval(fuse_write_async(c, pbuf))
+    pbuf = write_data(buf, <ssize_t> size)
+    save_retval(fuse_write_async(c, pbuf), c, LANE_DATA)
 
 async def fuse_write_async (_Container c, pbuf):
     cdef int ret
@@ -442,9 +1055,11 @@ async def fuse_write_async (_Container c, pbuf):
     try:
         len_ = await operations.write(c.fh, c.off, pbuf)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
         ret = fuse_reply_write(c.req, len_)
+    finally:
+        release_write_data(pbuf)
 
     if ret != 0:
         log.error('fuse_write(): fuse_reply_* failed with %s', strerror(-ret))
@@ -452,12 +1067,31 @@ async def fuse_write_async (_Container c, pbuf):
 
 cdef void fuse_write_buf(fuse_req_t req, fuse_ino_t ino, fuse_bufvec *bufv,
                          off_t off, fuse_file_info *fi):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_WRITE)
+    cdef fuse_buf *src = &bufv.buf[bufv.idx]
+    c.ino = ino
     c.off = off
     c.fh = fi.fh
-    buf = PyBytes_from_bufvec(bufv)
-    save_retval(fuse_write_buf_async(c, buf))
+
+    if write_to_fd_enabled:
+        try:
+            done = fuse_write_to_fd(c, bufv)
+        except BaseException as exc:
+            c.error = errno.EIO
+            save_exception(exc)
+            done = True
+        if done:
+            free_container(c)
+            return
+
+    if (bufv.count - bufv.idx == 1 and not (src.flags & FUSE_BUF_IS_FD)
+        and src.size - bufv.off <= PY_SSIZE_T_MAX):
+        buf = write_data(<const_char*> src.mem + bufv.off,
+                         <ssize_t> (src.size - bufv.off))
+    else:
+        buf = PyBytes_from_bufvec(bufv)
+    c.bytes_in = <size_t> len(buf)
+    save_retval(fuse_write_buf_async(c, buf), c, LANE_DATA)
 
 async def fuse_write_buf_async (_Container c, buf):
     cdef int ret
@@ -466,19 +1100,146 @@ async def fuse_write_buf_async (_Container c, buf):
     try:
         len_ = await operations.write(c.fh, c.off, buf)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
         ret = fuse_reply_write(c.req, len_)
+    finally:
+        release_write_data(buf)
+
+    if ret != 0:
+        log.error('fuse_write_buf(): fuse_reply_* failed with %s', strerror(-ret))
+
+cdef bint fuse_write_to_fd(_Container c, fuse_bufvec *bufv) except -1:
+    '''Copy data of write request to the fd returned by write_to_fd()
+
+    The data is copied (spliced, if the kernel passed it in a pipe) before
+    returning, since the receive pipe is reused for the next request.
+    Returns False if the handler did not return a file descriptor. In this
+    case, the data has to be passed to the write() handler instead.
+    '''
+
+    cdef fuse_bufvec dst
+    cdef size_t len_
+    cdef ssize_t res
+    cdef int ret
+
+    len_ = fuse_buf_size(bufv) - bufv.off
+    try:
+        target = operations.write_to_fd(c.fh, c.off, len_)
+    except FUSEError as e:
+        target = e
+    if target is None:
+        return False
+
+    request_started(c)
+    if isinstance(target, FUSEError):
+        ret = reply_err(c, (<FUSEError> target).errno_)
+    else:
+        (fd, off) = target
+        dst.count = 1
+        dst.idx = 0
+        dst.off = 0
+        dst.buf[0].size = len_
+        dst.buf[0].flags = <fuse_buf_flags> (FUSE_BUF_IS_FD | FUSE_BUF_FD_SEEK)
+        dst.buf[0].mem = NULL
+        dst.buf[0].fd = fd
+        dst.buf[0].pos = off
+        with nogil:
+            res = fuse_buf_copy(&dst, bufv, FUSE_BUF_SPLICE_MOVE)
+        if res < 0:
+            ret = reply_err(c, <int> -res)
+        else:
+            c.bytes_in = <size_t> res
+            ret = fuse_reply_write(c.req, <size_t> res)
 
     if ret != 0:
         log.error('fuse_write_buf(): fuse_reply_* failed with %s', strerror(-ret))
+    return True
+
+cdef class _WriteDataView:
+    '''Exports the data of a write request that is held in a receive buffer
+
+    Counts the buffer exports, so that the session loop can tell whether
+    the write() handler kept a reference to the data (e.g. a slice or
+    another memoryview) after it returned.
+    '''
+
+    cdef const_char *buf
+    cdef Py_ssize_t size
+    cdef int exports
+
+    # Set if the receive buffer could not be returned to the pool because
+    # it was still exported. Freed together with this object.
+    cdef void *owned_mem
+
+    def __getbuffer__(self, Py_buffer *pybuf, int flags):
+        PyBuffer_FillInfo(pybuf, self, <void*> self.buf, self.size, 1, flags)
+        self.exports += 1
+
+    def __releasebuffer__(self, Py_buffer *pybuf):
+        self.exports -= 1
+
+    def __dealloc__(self):
+        stdlib.free(self.owned_mem)
+
+cdef object write_data(const_char *buf, ssize_t size):
+    '''Return data of write request for passing to write() handler
+
+    If zero-copy writes are enabled, this is a read-only memoryview of
+    *buf*. This is only possible if the handler is going to run right away,
+    i.e. if the request will not be added to the backlog of the data lane,
+    and if the receive buffer pool can spare the buffer until the handler
+    returns.
+    '''
+
+    cdef _WorkerData wd = <_WorkerData> pyfuse3_worker_data
+    cdef _WriteDataView view
+
+    if (zero_copy_write and
+        wd.lane_active[LANE_DATA] < wd.lane_limit[LANE_DATA] and
+        recv_pool.n_in_use < recv_pool.limit):
+        view = _WriteDataView.__new__(_WriteDataView)
+        view.buf = buf
+        view.size = size
+        wd.pinned_view = view
+        recv_pool.n_pinned += 1
+        return memoryview(view)
+    return PyBytes_FromStringAndSize(buf, size)
+
+cdef inline void release_write_data(buf):
+    '''Make *buf* unusable if it refers to the receive buffer'''
+
+    if not PyMemoryView_Check(buf):
+        return
+    try:
+        buf.release()
+    except BufferError:
+        # Still exported, reported by unpin_recv_buf()
+        pass
+
+cdef void unpin_recv_buf(_WriteDataView view, void *mem, size_t size):
+    '''Return receive buffer *mem* after the write() handler has finished
+
+    If the handler kept a reference to the data in *view*, the buffer is
+    not reused but handed over to *view*, so that it remains valid for as
+    long as it is referenced.
+    '''
+
+    recv_pool.n_pinned -= 1
+    if view.exports == 0:
+        put_recv_buf(mem, size)
+        return
+    log.error('write() handler retained a reference to its data buffer, '
+              'not reusing the receive buffer')
+    recv_pool.n_in_use -= 1
+    view.owned_mem = mem
 
 
 cdef void fuse_flush (fuse_req_t req, fuse_ino_t ino, fuse_file_info *fi):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_FLUSH)
+    c.ino = ino
     c.fh = fi.fh
-    save_retval(fuse_flush_async(c))
+    save_retval(fuse_flush_async(c), c, LANE_DATA)
 
 async def fuse_flush_async (_Container c):
     cdef int ret
@@ -486,7 +1247,7 @@ async def fuse_flush_async (_Container c):
     try:
         await operations.flush(c.fh)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
         ret = fuse_reply_err(c.req, 0)
 
@@ -495,10 +1256,12 @@ async def fuse_flush_async (_Container c):
 
 
 cdef void fuse_release (fuse_req_t req, fuse_ino_t ino, fuse_file_info *fi):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_RELEASE)
+    c.ino = ino
     c.fh = fi.fh
-    save_retval(fuse_release_async(c))
+    if _backing_ids:
+        close_backing_file(req, fi.fh)
+    save_retval(fuse_release_async(c), c, LANE_DATA)
 
 async def fuse_release_async (_Container c):
     cdef int ret
@@ -506,7 +1269,7 @@ async def fuse_release_async (_Container c):
     try:
         await operations.release(c.fh)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
         ret = fuse_reply_err(c.req, 0)
 
@@ -516,11 +1279,11 @@ async def fuse_release_async (_Container c):
 
 cdef void fuse_fsync (fuse_req_t req, fuse_ino_t ino, int datasync,
                       fuse_file_info *fi):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_FSYNC)
+    c.ino = ino
     c.flags = datasync
     c.fh = fi.fh
-    save_retval(fuse_fsync_async(c))
+    save_retval(fuse_fsync_async(c), c, LANE_DATA)
 
 async def fuse_fsync_async (_Container c):
     cdef int ret
@@ -528,7 +1291,7 @@ async def fuse_fsync_async (_Container c):
     try:
         await operations.fsync(c.fh, c.flags != 0)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
         ret = fuse_reply_err(c.req, 0)
 
@@ -537,22 +1300,61 @@ async def fuse_fsync_async (_Container c):
 
 
 cdef void fuse_opendir (fuse_req_t req, fuse_ino_t ino, fuse_file_info *fi):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_OPENDIR)
     c.ino = ino
     c.fi = fi[0]
-    save_retval(fuse_opendir_async(c))
+    if sync_ops & SYNC_OPENDIR:
+        request_started(c)
+        try:
+            done = fuse_opendir_sync(c)
+        except BaseException as exc:
+            c.error = errno.EIO
+            save_exception(exc)
+            done = True
+        if done:
+            free_container(c)
+    else:
+        save_retval(fuse_opendir_async(c), c)
 
-async def fuse_opendir_async (_Container c):
+cdef fuse_opendir_sync (_Container c):
     cdef int ret
 
-    ctx = get_request_context(c.req)
+    ctx = get_request_context(c.req, CTX_OPENDIR)
     try:
-        c.fi.fh = await operations.opendir(c.ino, ctx)
+        fh = operations.opendir(c.ino, ctx)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
-        ret = fuse_reply_open(c.req, &c.fi)
+        if inspect.isawaitable(fh):
+            # Regular function that returned an awaitable after all
+            save_retval(fuse_opendir_async(c, fh), c, LANE_METADATA, True)
+            return False
+        if isinstance(fh, FUSEError):
+            ret = reply_err(c, (<FUSEError> fh).errno_)
+        else:
+            c.fi.fh = fh
+            ret = fuse_reply_open(c.req, &c.fi)
+
+    if ret != 0:
+        log.error('fuse_opendir(): fuse_reply_* failed with %s', strerror(-ret))
+    return True
+
+async def fuse_opendir_async (_Container c, pending=None):
+    cdef int ret
+
+    ctx = get_request_context(c.req, CTX_OPENDIR)
+    try:
+        if pending is None:
+            pending = operations.opendir(c.ino, ctx)
+        fh = await pending
+    except FUSEError as e:
+        ret = reply_err(c, e.errno)
+    else:
+        if isinstance(fh, FUSEError):
+            ret = reply_err(c, (<FUSEError> fh).errno_)
+        else:
+            c.fi.fh = fh
+            ret = fuse_reply_open(c.req, &c.fi)
 
     if ret != 0:
         log.error('fuse_opendir(): fuse_reply_* failed with %s', strerror(-ret))
@@ -567,13 +1369,12 @@ cdef class ReaddirToken:
 
 cdef void fuse_readdirplus (fuse_req_t req, fuse_ino_t ino, size_t size, off_t off,
                             fuse_file_info *fi):
-    global py_retval
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_READDIR)
+    c.ino = ino
     c.size = size
     c.off = off
     c.fh = fi.fh
-    save_retval(fuse_readdirplus_async(c))
+    save_retval(fuse_readdirplus_async(c), c)
 
 async def fuse_readdirplus_async (_Container c):
     cdef int ret
@@ -585,12 +1386,13 @@ async def fuse_readdirplus_async (_Container c):
     try:
         await operations.readdir(c.fh, c.off, token)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
         if token.buf_start == NULL:
             ret = fuse_reply_buf(c.req, NULL, 0)
         else:
-            ret = fuse_reply_buf(c.req, token.buf_start, c.size - token.size)
+            c.bytes_out = c.size - token.size
+            ret = fuse_reply_buf(c.req, token.buf_start, c.bytes_out)
     finally:
         stdlib.free(token.buf_start)
 
@@ -599,10 +1401,10 @@ async def fuse_readdirplus_async (_Container c):
 
 
 cdef void fuse_releasedir (fuse_req_t req, fuse_ino_t ino, fuse_file_info *fi):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_RELEASEDIR)
+    c.ino = ino
     c.fh = fi.fh
-    save_retval(fuse_releasedir_async(c))
+    save_retval(fuse_releasedir_async(c), c)
 
 async def fuse_releasedir_async (_Container c):
     cdef int ret
@@ -610,7 +1412,7 @@ async def fuse_releasedir_async (_Container c):
     try:
         await operations.releasedir(c.fh)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
         ret = fuse_reply_err(c.req, 0)
 
@@ -621,11 +1423,11 @@ async def fuse_releasedir_async (_Container c):
 
 cdef void fuse_fsyncdir (fuse_req_t req, fuse_ino_t ino, int datasync,
                          fuse_file_info *fi):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_FSYNCDIR)
+    c.ino = ino
     c.flags = datasync
     c.fh = fi.fh
-    save_retval(fuse_fsyncdir_async(c))
+    save_retval(fuse_fsyncdir_async(c), c)
 
 async def fuse_fsyncdir_async (_Container c):
     cdef int ret
@@ -633,7 +1435,7 @@ async def fuse_fsyncdir_async (_Container c):
     try:
         await operations.fsyncdir(c.fh, c.flags != 0)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
         ret = fuse_reply_err(c.req, 0)
 
@@ -643,21 +1445,61 @@ async def fuse_fsyncdir_async (_Container c):
 
 
 cdef void fuse_statfs (fuse_req_t req, fuse_ino_t ino):
-    cdef _Container c = _Container()
-    c.req = req
-    save_retval(fuse_statfs_async(c))
+    cdef _Container c = new_container(req, OP_STATFS)
+    if sync_ops & SYNC_STATFS:
+        request_started(c)
+        try:
+            done = fuse_statfs_sync(c)
+        except BaseException as exc:
+            c.error = errno.EIO
+            save_exception(exc)
+            done = True
+        if done:
+            free_container(c)
+    else:
+        save_retval(fuse_statfs_async(c), c)
+
+cdef fuse_statfs_sync (_Container c):
+    cdef int ret
+    cdef StatvfsData stats
+
+    ctx = get_request_context(c.req, CTX_STATFS)
+    try:
+        res = operations.statfs(ctx)
+    except FUSEError as e:
+        ret = reply_err(c, e.errno)
+    else:
+        if inspect.isawaitable(res):
+            # Regular function that returned an awaitable after all
+            save_retval(fuse_statfs_async(c, res), c, LANE_METADATA, True)
+            return False
+        if isinstance(res, FUSEError):
+            ret = reply_err(c, (<FUSEError> res).errno_)
+        else:
+            stats = <StatvfsData?> res
+            ret = fuse_reply_statfs(c.req, &stats.stat)
+
+    if ret != 0:
+        log.error('fuse_statfs(): fuse_reply_* failed with %s', strerror(-ret))
+    return True
 
-async def fuse_statfs_async (_Container c):
+async def fuse_statfs_async (_Container c, pending=None):
     cdef int ret
     cdef StatvfsData stats
 
-    ctx = get_request_context(c.req)
+    ctx = get_request_context(c.req, CTX_STATFS)
     try:
-        stats = <StatvfsData?> await operations.statfs(ctx)
+        if pending is None:
+            pending = operations.statfs(ctx)
+        res = await pending
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
-        ret = fuse_reply_statfs(c.req, &stats.stat)
+        if isinstance(res, FUSEError):
+            ret = reply_err(c, (<FUSEError> res).errno_)
+        else:
+            stats = <StatvfsData?> res
+            ret = fuse_reply_statfs(c.req, &stats.stat)
 
     if ret != 0:
         log.error('fuse_statfs(): fuse_reply_* failed with %s', strerror(-ret))
@@ -665,18 +1507,18 @@ async def fuse_statfs_async (_Container c):
 
 cdef void fuse_setxattr (fuse_req_t req, fuse_ino_t ino, const_char *cname,
                          const_char *cvalue, size_t size, int flags):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_SETXATTR)
     c.ino = ino
     c.size = size
     c.flags = flags
+    c.bytes_in = size
 
     name = PyBytes_FromString(cname)
     if c.size > PY_SSIZE_T_MAX:
         raise OverflowError('Value too long to convert to Python')
     value = PyBytes_FromStringAndSize(cvalue, <ssize_t> c.size)
 
-    save_retval(fuse_setxattr_async(c, name, value))
+    save_retval(fuse_setxattr_async(c, name, value), c, LANE_XATTR)
 
 async def fuse_setxattr_async (_Container c, name, value):
     cdef int ret
@@ -691,23 +1533,28 @@ async def fuse_setxattr_async (_Container c, name, value):
     if c.flags & ~(libc_extra.XATTR_CREATE | libc_extra.XATTR_REPLACE):
         raise ValueError('unknown flag(s): %o' % c.flags)
 
-    ctx = get_request_context(c.req)
+    ctx = get_request_context(c.req, CTX_SETXATTR | CTX_GETXATTR)
     try:
         if c.flags & libc_extra.XATTR_CREATE: # Attribute must not exist
             try:
-                await operations.getxattr(c.ino, name, ctx)
+                res = await operations.getxattr(c.ino, name, ctx)
             except FUSEError as e:
                 if e.errno != ENOATTR:
                     raise
             else:
-                raise FUSEError(errno.EEXIST)
+                if not isinstance(res, FUSEError):
+                    raise FUSEError(errno.EEXIST)
+                elif (<FUSEError> res).errno_ != ENOATTR:
+                    raise FUSEError((<FUSEError> res).errno_)
 
         elif c.flags & libc_extra.XATTR_REPLACE: # Attribute must exist
-            await operations.getxattr(c.ino, name, ctx)
+            res = await operations.getxattr(c.ino, name, ctx)
+            if isinstance(res, FUSEError):
+                raise FUSEError((<FUSEError> res).errno_)
 
         await operations.setxattr(c.ino, name, value, ctx)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
         ret = fuse_reply_err(c.req, 0)
 
@@ -717,91 +1564,175 @@ async def fuse_setxattr_async (_Container c, name, value):
 
 cdef void fuse_getxattr (fuse_req_t req, fuse_ino_t ino, const_char *name,
                          size_t size):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_GETXATTR)
     c.ino = ino
     c.size = size
-    save_retval(fuse_getxattr_async(c, PyBytes_FromString(name)))
+    if sync_ops & SYNC_GETXATTR:
+        request_started(c)
+        try:
+            done = fuse_getxattr_sync(c, PyBytes_FromString(name))
+        except BaseException as exc:
+            c.error = errno.EIO
+            save_exception(exc)
+            done = True
+        if done:
+            free_container(c)
+    else:
+        save_retval(fuse_getxattr_async(c, PyBytes_FromString(name)), c,
+                    LANE_XATTR)
 
-async def fuse_getxattr_async (_Container c, name):
-    cdef int ret
+cdef int fuse_getxattr_reply (_Container c, buf) except? -1:
     cdef ssize_t len_s
     cdef size_t len_
     cdef char *cbuf
 
-    ctx = get_request_context(c.req)
+    PyBytes_AsStringAndSize(buf, &cbuf, &len_s)
+    len_ = <size_t> len_s # guaranteed positive
+
+    if c.size == 0:
+        return fuse_reply_xattr(c.req, len_)
+    elif len_ <= c.size:
+        c.bytes_out = len_
+        return fuse_reply_buf(c.req, cbuf, len_)
+    else:
+        return reply_err(c, errno.ERANGE)
+
+cdef fuse_getxattr_sync (_Container c, name):
+    cdef int ret
+
+    ctx = get_request_context(c.req, CTX_GETXATTR)
     try:
-        buf = await operations.getxattr(c.ino, name, ctx)
+        buf = operations.getxattr(c.ino, name, ctx)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
-        PyBytes_AsStringAndSize(buf, &cbuf, &len_s)
-        len_ = <size_t> len_s # guaranteed positive
+        if inspect.isawaitable(buf):
+            # Regular function that returned an awaitable after all
+            save_retval(fuse_getxattr_async(c, name, buf), c, LANE_XATTR, True)
+            return False
+        if isinstance(buf, FUSEError):
+            ret = reply_err(c, (<FUSEError> buf).errno_)
+        else:
+            ret = fuse_getxattr_reply(c, buf)
+
+    if ret != 0:
+        log.error('fuse_getxattr(): fuse_reply_* failed with %s', strerror(-ret))
+    return True
+
+async def fuse_getxattr_async (_Container c, name, pending=None):
+    cdef int ret
 
-        if c.size == 0:
-            ret = fuse_reply_xattr(c.req, len_)
-        elif len_ <= c.size:
-            ret = fuse_reply_buf(c.req, cbuf, len_)
+    ctx = get_request_context(c.req, CTX_GETXATTR)
+    try:
+        if pending is None:
+            pending = operations.getxattr(c.ino, name, ctx)
+        buf = await pending
+    except FUSEError as e:
+        ret = reply_err(c, e.errno)
+    else:
+        if isinstance(buf, FUSEError):
+            ret = reply_err(c, (<FUSEError> buf).errno_)
         else:
-            ret = fuse_reply_err(c.req, errno.ERANGE)
+            ret = fuse_getxattr_reply(c, buf)
 
     if ret != 0:
         log.error('fuse_getxattr(): fuse_reply_* failed with %s', strerror(-ret))
 
 
 cdef void fuse_listxattr (fuse_req_t req, fuse_ino_t ino, size_t size):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_LISTXATTR)
     c.ino = ino
     c.size = size
-    save_retval(fuse_listxattr_async(c))
+    if sync_ops & SYNC_LISTXATTR:
+        request_started(c)
+        try:
+            done = fuse_listxattr_sync(c)
+        except BaseException as exc:
+            c.error = errno.EIO
+            save_exception(exc)
+            done = True
+        if done:
+            free_container(c)
+    else:
+        save_retval(fuse_listxattr_async(c), c, LANE_XATTR)
 
-async def fuse_listxattr_async (_Container c):
-    cdef int ret
+cdef int fuse_listxattr_reply (_Container c, res) except? -1:
     cdef ssize_t len_s
     cdef size_t len_
     cdef char *cbuf
 
+    buf = b'\0'.join(res) + b'\0'
+
+    PyBytes_AsStringAndSize(buf, &cbuf, &len_s)
+    len_ = <size_t> len_s # guaranteed positive
 
-    ctx = get_request_context(c.req)
+    if len_ == 1: # No attributes
+        len_ = 0
+
+    if c.size == 0:
+        return fuse_reply_xattr(c.req, len_)
+    elif len_ <= c.size:
+        c.bytes_out = len_
+        return fuse_reply_buf(c.req, cbuf, len_)
+    else:
+        return reply_err(c, errno.ERANGE)
+
+cdef fuse_listxattr_sync (_Container c):
+    cdef int ret
+
+    ctx = get_request_context(c.req, CTX_LISTXATTR)
     try:
-        res = await operations.listxattr(c.ino, ctx)
+        res = operations.listxattr(c.ino, ctx)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
-        buf = b'\0'.join(res) + b'\0'
+        if inspect.isawaitable(res):
+            # Regular function that returned an awaitable after all
+            save_retval(fuse_listxattr_async(c, res), c, LANE_XATTR, True)
+            return False
+        if isinstance(res, FUSEError):
+            ret = reply_err(c, (<FUSEError> res).errno_)
+        else:
+            ret = fuse_listxattr_reply(c, res)
 
-        PyBytes_AsStringAndSize(buf, &cbuf, &len_s)
-        len_ = <size_t> len_s # guaranteed positive
+    if ret != 0:
+        log.error('fuse_listxattr(): fuse_reply_* failed with %s', strerror(-ret))
+    return True
 
-        if len_ == 1: # No attributes
-            len_ = 0
+async def fuse_listxattr_async (_Container c, pending=None):
+    cdef int ret
 
-        if c.size == 0:
-            ret = fuse_reply_xattr(c.req, len_)
-        elif len_ <= c.size:
-            ret = fuse_reply_buf(c.req, cbuf, len_)
+    ctx = get_request_context(c.req, CTX_LISTXATTR)
+    try:
+        if pending is None:
+            pending = operations.listxattr(c.ino, ctx)
+        res = await pending
+    except FUSEError as e:
+        ret = reply_err(c, e.errno)
+    else:
+        if isinstance(res, FUSEError):
+            ret = reply_err(c, (<FUSEError> res).errno_)
         else:
-            ret = fuse_reply_err(c.req, errno.ERANGE)
+            ret = fuse_listxattr_reply(c, res)
 
     if ret != 0:
         log.error('fuse_listxattr(): fuse_reply_* failed with %s', strerror(-ret))
 
 
 cdef void fuse_removexattr (fuse_req_t req, fuse_ino_t ino, const_char *name):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_REMOVEXATTR)
     c.ino = ino
-    save_retval(fuse_removexattr_async(c, PyBytes_FromString(name)))
+    save_retval(fuse_removexattr_async(c, PyBytes_FromString(name)), c,
+                LANE_XATTR)
 
 async def fuse_removexattr_async (_Container c, name):
     cdef int ret
 
-    ctx = get_request_context(c.req)
+    ctx = get_request_context(c.req, CTX_REMOVEXATTR)
     try:
         await operations.removexattr(c.ino, name, ctx)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
         ret = fuse_reply_err(c.req, 0)
 
@@ -810,26 +1741,65 @@ async def fuse_removexattr_async (_Container c, name):
 
 
 cdef void fuse_access (fuse_req_t req, fuse_ino_t ino, int mask):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_ACCESS)
     c.ino = ino
     c.flags = mask
-    save_retval(fuse_access_async(c))
+    if sync_ops & SYNC_ACCESS:
+        request_started(c)
+        try:
+            done = fuse_access_sync(c)
+        except BaseException as exc:
+            c.error = errno.EIO
+            save_exception(exc)
+            done = True
+        if done:
+            free_container(c)
+    else:
+        save_retval(fuse_access_async(c), c)
 
-async def fuse_access_async (_Container c):
+cdef fuse_access_sync (_Container c):
     cdef int ret
     cdef int mask = c.flags
 
-    ctx = get_request_context(c.req)
+    ctx = get_request_context(c.req, CTX_ACCESS)
     try:
-        allowed = await operations.access(c.ino, mask, ctx)
+        allowed = operations.access(c.ino, mask, ctx)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
-        if allowed:
+        if inspect.isawaitable(allowed):
+            # Regular function that returned an awaitable after all
+            save_retval(fuse_access_async(c, allowed), c, LANE_METADATA, True)
+            return False
+        if isinstance(allowed, FUSEError):
+            ret = reply_err(c, (<FUSEError> allowed).errno_)
+        elif allowed:
             ret = fuse_reply_err(c.req, 0)
         else:
-            ret = fuse_reply_err(c.req, EACCES)
+            ret = reply_err(c, EACCES)
+
+    if ret != 0:
+        log.error('fuse_access(): fuse_reply_* failed with %s', strerror(-ret))
+    return True
+
+async def fuse_access_async (_Container c, pending=None):
+    cdef int ret
+    cdef int mask = c.flags
+
+    ctx = get_request_context(c.req, CTX_ACCESS)
+    try:
+        if pending is None:
+            pending = operations.access(c.ino, mask, ctx)
+        allowed = await pending
+    except FUSEError as e:
+        ret = reply_err(c, e.errno)
+    else:
+        if isinstance(allowed, FUSEError):
+            ret = reply_err(c, (<FUSEError> allowed).errno_)
+        elif allowed:
+            ret = fuse_reply_err(c.req, 0)
+        else:
+            ret = reply_err(c, EACCES)
 
     if ret != 0:
         log.error('fuse_access(): fuse_reply_* failed with %s', strerror(-ret))
@@ -838,28 +1808,69 @@ async def fuse_access_async (_Container c):
 
 cdef void fuse_create (fuse_req_t req, fuse_ino_t parent, const_char *name,
                        mode_t mode, fuse_file_info *fi):
-    cdef _Container c = _Container()
-    c.req = req
+    cdef _Container c = new_container(req, OP_CREATE)
     c.parent = parent
     c.mode = mode
     c.fi = fi[0]
-    save_retval(fuse_create_async(c, PyBytes_FromString(name)))
+    save_retval(fuse_create_async(c, PyBytes_FromString(name)), c)
 
 async def fuse_create_async (_Container c, name):
     cdef int ret
     cdef EntryAttributes entry
     cdef FileInfo fi
 
-    ctx = get_request_context(c.req)
+    ctx = get_request_context(c.req, CTX_CREATE)
     try:
         tmp = await operations.create(c.parent, name, c.mode, c.fi.flags, ctx)
     except FUSEError as e:
-        ret = fuse_reply_err(c.req, e.errno)
+        ret = reply_err(c, e.errno)
     else:
         fi = <FileInfo?> tmp[0]
         entry = <EntryAttributes?> tmp[1]
         fi._copy_to_fuse(&c.fi)
+        open_backing_file(c, fi)
         ret = fuse_reply_create(c.req, &entry.fuse_param, &c.fi)
+        if ret != 0:
+            close_backing_file(c.req, c.fi.fh)
 
     if ret != 0:
         log.error('fuse_create(): fuse_reply_* failed with %s', strerror(-ret))
+
+
+cdef class _RetrieveRequest:
+    """For internal use by pyfuse3 only."""
+
+    # State of a retrieve() call that is waiting for the kernel's
+    # NOTIFY_REPLY. The reply may be processed by a different event loop
+    # (with main_mt), so the waiter is woken up through its trio token.
+    cdef object event
+    cdef object token
+    cdef object thread_id
+    cdef object data
+    cdef object error
+
+# Pending retrieve() calls, indexed by the cookie passed to the kernel.
+cdef dict _retrieve_reqs = dict()
+cdef uintptr_t _retrieve_serial = 0
+
+cdef void fuse_retrieve_reply (fuse_req_t req, void *cookie, fuse_ino_t ino,
+                               off_t offset, fuse_bufvec *bufv):
+    cdef _RetrieveRequest rr
+
+    rr = _retrieve_reqs.pop(<uintptr_t> cookie, None)
+    if rr is not None:
+        # The data is still in the receive buffer, so it has to be copied.
+        try:
+            rr.data = PyBytes_from_bufvec(bufv)
+        except Exception as exc:
+            rr.error = exc
+        finally:
+            # The caller must be woken up no matter what went wrong
+            if rr.thread_id == threading.get_ident():
+                rr.event.set()
+            else:
+                rr.token.run_sync_soon(rr.event.set)
+    else:
+        log.debug('Ignoring retrieve reply for inode %d (caller has gone away)',
+                  ino)
+    fuse_reply_none(req)
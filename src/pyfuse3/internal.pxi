@@ -10,19 +10,46 @@ This file is part of pyfuse3. This work may be distributed under
 the terms of the GNU LGPL.
 '''
 
-cdef void save_retval(object val):
-    global py_retval
-    if py_retval is not None and val is not None:
-        log.error('py_retval was not awaited - please report a bug at '
+cdef void save_retval(object val, _Container c=None, int lane=LANE_METADATA,
+                      bint started=False):
+    '''Hand *val* to the worker to be awaited
+
+    If *c* is given, it is returned to the pool once *val* has completed.
+    *started* indicates that request_started() has already been called for
+    *c* (as is the case when a synchronous handler returns an awaitable).
+    '''
+
+    cdef _WorkerData wd = <_WorkerData> pyfuse3_worker_data
+    if wd.retval is not None and val is not None:
+        log.error('retval was not awaited - please report a bug at '
                   'https://github.com/libfuse/pyfuse3/issues!')
-    py_retval = val
+    wd.retval = val
+    wd.retval_container = c
+    wd.retval_lane = lane
+    if c is not None and not started:
+        request_started(c)
+
+async def _reraise(exc):
+    raise exc
+
+cdef void save_exception(exc):
+    '''Propagate exception from a synchronous request handler to the worker'''
 
-cdef object get_request_context(fuse_req_t req):
-    '''Get RequestContext() object'''
+    save_retval(_reraise(exc))
+
+cdef object get_request_context(fuse_req_t req, unsigned ops):
+    '''Get RequestContext() object
+
+    Returns None if all the handlers in *ops* (a combination of CTX_* flags)
+    ignore their *ctx* argument.
+    '''
 
     cdef const_fuse_ctx* context
     cdef RequestContext ctx
 
+    if (noctx_ops & ops) == ops:
+        return None
+
     context = fuse_req_ctx(req)
     ctx = RequestContext.__new__(RequestContext)
     ctx.pid = context.pid
@@ -32,6 +59,114 @@ cdef object get_request_context(fuse_req_t req):
 
     return ctx
 
+# Latency histogram: 2**LAT_SUB_BITS buckets for every power of two
+cdef enum:
+    LAT_SUB_BITS = 2
+    N_LAT_BUCKETS = 64 << LAT_SUB_BITS
+
+cdef struct op_stats_t:
+    uint64_t count
+    uint64_t errors
+    uint64_t bytes_in
+    uint64_t bytes_out
+    uint64_t time_ns
+    uint64_t latency[N_LAT_BUCKETS]
+
+# Set by init() if request statistics should be collected
+cdef bint stats_enabled = False
+
+# Statistics for each OP_* request type
+cdef op_stats_t op_stats[N_OPS]
+
+# Number of failed requests, indexed by (OP_*, errno) tuples
+cdef dict op_errors = dict()
+
+# Number of requests that have been received but not yet answered
+cdef long requests_in_flight = 0
+
+cdef inline uint64_t monotonic_ns():
+    cdef timespec now
+    libc_extra.gettime_monotonic(&now)
+    return <uint64_t> now.tv_sec * 1000000000 + <uint64_t> now.tv_nsec
+
+cdef inline int latency_bucket(uint64_t ns):
+    '''Return histogram bucket for a latency of *ns* nanoseconds'''
+
+    cdef int msb
+    if ns < (1 << LAT_SUB_BITS):
+        return <int> ns
+    msb = 63 - CLZ64(ns)
+    return (((msb - LAT_SUB_BITS + 1) << LAT_SUB_BITS)
+            | <int> ((ns >> (msb - LAT_SUB_BITS)) & ((1 << LAT_SUB_BITS) - 1)))
+
+cdef uint64_t latency_bucket_start(int bucket):
+    '''Return smallest latency (in nanoseconds) that falls into *bucket*'''
+
+    cdef int shift
+    if bucket < (1 << LAT_SUB_BITS):
+        return <uint64_t> bucket
+    shift = (bucket >> LAT_SUB_BITS) - 1
+    return (<uint64_t> ((1 << LAT_SUB_BITS) | (bucket & ((1 << LAT_SUB_BITS) - 1)))
+            << shift)
+
+cdef void stats_request_started(_Container c):
+    global requests_in_flight
+    requests_in_flight += 1
+    c.t_start = monotonic_ns()
+
+cdef void stats_request_finished(_Container c):
+    global requests_in_flight
+    cdef op_stats_t *st = &op_stats[c.op]
+    cdef uint64_t duration = monotonic_ns() - c.t_start
+
+    requests_in_flight -= 1
+    st.count += 1
+    st.bytes_in += c.bytes_in
+    st.bytes_out += c.bytes_out
+    st.time_ns += duration
+    st.latency[latency_bucket(duration)] += 1
+    if c.error != 0:
+        st.errors += 1
+        key = (c.op, c.error)
+        op_errors[key] = op_errors.get(key, 0) + 1
+
+# Set by set_tracer()
+cdef object tracer = None
+
+cdef void trace_request_started(_Container c):
+    cdef TraceEvent ev
+    cdef const_fuse_ctx* context
+
+    ev = TraceEvent.__new__(TraceEvent)
+    ev.op = _op_names[c.op]
+    ev.inode = c.parent if c.parent != 0 else c.ino
+    ev.fh = c.fh
+    ev.offset = c.off
+    ev.size = c.size
+    context = fuse_req_ctx(c.req)
+    ev.pid = context.pid
+    ev.uid = context.uid
+    ev.start_ns = monotonic_ns()
+    ev.tracer = tracer
+    c.trace = ev
+    try:
+        ev.tracer.on_request_start(ev)
+    except Exception:
+        log.exception('Request tracer failed')
+
+cdef void trace_request_finished(_Container c):
+    cdef TraceEvent ev = <TraceEvent> c.trace
+
+    c.trace = None
+    ev.end_ns = monotonic_ns()
+    ev.errno_ = c.error
+    ev_tracer = ev.tracer
+    ev.tracer = None
+    try:
+        ev_tracer.on_request_end(ev)
+    except Exception:
+        log.exception('Request tracer failed')
+
 cdef void init_fuse_ops():
     '''Initialize fuse_lowlevel_ops structure'''
 
@@ -69,6 +204,7 @@ cdef void init_fuse_ops():
     fuse_ops.create = fuse_create
     fuse_ops.forget_multi = fuse_forget_multi
     fuse_ops.write_buf = fuse_write_buf
+    fuse_ops.retrieve_reply = fuse_retrieve_reply
 
 cdef make_fuse_args(args, fuse_args* f_args):
     cdef char* arg
@@ -178,6 +314,136 @@ cdef void* calloc_or_raise(size_t nmemb, size_t size) except NULL:
         raise MemoryError()
     return mem
 
+# Receive buffers are shared by all workers (in all threads). A worker only
+# holds a buffer while it receives and dispatches a request (or, if the
+# write() handler got a zero-copy view of it, until the handler returns),
+# so a few buffers are usually enough for any number of workers.
+cdef struct recv_pool_t:
+    void **idle
+    size_t n_idle
+    size_t n_in_use
+    size_t n_pinned
+    size_t limit
+    size_t buf_size
+    size_t page_size
+    size_t peak_in_use
+    size_t n_gets
+    size_t n_allocs
+
+cdef recv_pool_t recv_pool
+
+# Space that libfuse reserves for the request header in its receive buffer
+# (FUSE_BUFFER_HEADER_SIZE in fuse_lowlevel.c).
+cdef enum:
+    RECV_HEADER_SIZE = 0x1000
+
+cdef configure_recv_pool(size_t limit):
+    if recv_pool.idle is not NULL:
+        free_recv_pool()
+    recv_pool.idle = <void**> calloc_or_raise(limit, sizeof(void*))
+    recv_pool.limit = limit
+    recv_pool.page_size = os.sysconf('SC_PAGESIZE')
+    # Large enough for the INIT request. Once the connection has been
+    # negotiated, fuse_init() adjusts this to the value used by libfuse.
+    recv_pool.buf_size = 256 * recv_pool.page_size + RECV_HEADER_SIZE
+    recv_pool.n_idle = 0
+    recv_pool.n_in_use = 0
+    recv_pool.n_pinned = 0
+    recv_pool.peak_in_use = 0
+    recv_pool.n_gets = 0
+    recv_pool.n_allocs = 0
+
+cdef set_recv_buf_size(size_t max_write):
+    '''Size receive buffers for requests with up to *max_write* bytes of data
+
+    Idle buffers of a different size are freed, buffers that are in use
+    are freed when they are returned.
+    '''
+
+    cdef size_t i
+    cdef size_t size = max_write + RECV_HEADER_SIZE
+
+    size = (size + recv_pool.page_size - 1) // recv_pool.page_size * recv_pool.page_size
+    if size == recv_pool.buf_size:
+        return
+    for i in range(recv_pool.n_idle):
+        stdlib.free(recv_pool.idle[i])
+    recv_pool.n_idle = 0
+    recv_pool.buf_size = size
+
+cdef free_recv_pool():
+    cdef size_t i
+
+    if recv_pool.n_in_use:
+        log.warning('%d receive buffers still in use, not freeing them.',
+                    recv_pool.n_in_use)
+    for i in range(recv_pool.n_idle):
+        stdlib.free(recv_pool.idle[i])
+    stdlib.free(recv_pool.idle)
+    recv_pool.idle = NULL
+    recv_pool.n_idle = 0
+    recv_pool.limit = 0
+
+cdef void* get_recv_buf(size_t *size) except NULL:
+    '''Take a buffer from the pool, allocating a new one if none is idle
+
+    The size of the buffer is stored in *size*, it has to be passed to
+    put_recv_buf() together with the buffer.
+    '''
+
+    cdef void *mem
+    cdef int ret
+
+    recv_pool.n_gets += 1
+    if recv_pool.n_idle:
+        recv_pool.n_idle -= 1
+        mem = recv_pool.idle[recv_pool.n_idle]
+    else:
+        ret = libc_extra.posix_memalign(&mem, recv_pool.page_size,
+                                        recv_pool.buf_size)
+        if ret != 0:
+            raise MemoryError()
+        recv_pool.n_allocs += 1
+    recv_pool.n_in_use += 1
+    if recv_pool.n_in_use > recv_pool.peak_in_use:
+        recv_pool.peak_in_use = recv_pool.n_in_use
+    size[0] = recv_pool.buf_size
+    return mem
+
+cdef void put_recv_buf(void *mem, size_t size):
+    '''Return *mem* to the pool, or free it if the pool is full'''
+
+    recv_pool.n_in_use -= 1
+    if (size == recv_pool.buf_size and
+        recv_pool.n_idle + recv_pool.n_in_use < recv_pool.limit):
+        recv_pool.idle[recv_pool.n_idle] = mem
+        recv_pool.n_idle += 1
+    else:
+        stdlib.free(mem)
+
+cdef int receive_request(fuse_buf *buf, void **mem, size_t *size) except? -1:
+    '''Receive next request into a buffer from the pool
+
+    The buffer is stored in *mem* and *size*. If the return value is
+    positive, it has to be returned with put_recv_buf() once the request has
+    been processed (libfuse may have pointed *buf* elsewhere in the meantime,
+    so *buf.mem* must not be used for this). Otherwise, *mem* is NULL.
+    '''
+
+    cdef int res
+
+    mem[0] = get_recv_buf(size)
+    buf.mem = mem[0]
+    buf.size = size[0]
+    buf.pos = 0
+    buf.flags = 0
+    with nogil:
+        res = fuse_session_receive_buf(session, buf)
+    if res <= 0:
+        put_recv_buf(mem[0], size[0])
+        mem[0] = NULL
+    return res
+
 cdef class _WorkerData:
     """For internal use by pyfuse3 only."""
 
@@ -185,20 +451,73 @@ cdef class _WorkerData:
     cdef int task_serial
     cdef object read_lock
     cdef int active_readers
-
-    def __init__(self):
+    cdef object retval
+    cdef _Container retval_container
+    cdef int retval_lane
+    cdef int lane_limit[N_LANES]
+    cdef int lane_active[N_LANES]
+    cdef list lane_backlog
+    cdef list free_containers
+    cdef object name_prefix
+    cdef int min_tasks
+    cdef int max_tasks
+    cdef int batch_size
+    cdef object scheduler
+    cdef object thread_id
+    cdef _WriteDataView pinned_view
+
+    def __init__(self, name_prefix='pyfuse'):
         self.read_lock = trio.Lock()
         self.active_readers = 0
+        self.name_prefix = name_prefix
+        self.lane_backlog = [ collections.deque() for _ in _lane_names ]
+        self.free_containers = []
+
+    cdef configure(self, int min_tasks, int max_tasks, int batch_size,
+                   scheduler=None, lanes=None):
+        cdef int i
+
+        if batch_size < 1:
+            raise ValueError('*batch_size* must be at least 1')
+        if lanes is None:
+            lanes = {}
+        for name in lanes:
+            if name not in _lane_names:
+                raise ValueError('Unknown lane: %r' % name)
+        for (i, name) in enumerate(_lane_names):
+            limit = lanes.get(name, None)
+            if limit is None:
+                self.lane_limit[i] = INT_MAX
+            elif limit < 1:
+                raise ValueError('Limit for %s lane must be at least 1' % name)
+            else:
+                self.lane_limit[i] = limit
+            self.lane_active[i] = 0
+        self.min_tasks = min_tasks
+        self.max_tasks = max_tasks
+        self.batch_size = batch_size
+        self.scheduler = scheduler
 
     cdef get_name(self):
         self.task_serial += 1
-        return 'pyfuse-%02d' % self.task_serial
+        return '%s-%02d' % (self.name_prefix, self.task_serial)
 
 # Delay initialization so that pyfuse3.asyncio can replace
 # the trio module.
 cdef _WorkerData worker_data
 
-async def _wait_fuse_readable():
+# Trio tokens of the event loops started by main_mt(), indexed by thread id.
+cdef dict _mt_tokens = dict()
+
+# Set by init() if request handlers should be cancelled when the kernel
+# sends an interrupt.
+cdef bint interrupts_enabled = False
+
+# (cancel scope, thread id) of the requests that are currently processed
+# by _run_interruptible(), indexed by request pointer.
+cdef dict _req_scopes = dict()
+
+async def _wait_fuse_readable(_WorkerData wd):
     '''Wait for FUSE fd to become readable
 
     Return True if the fd is readable, or False if the main loop
@@ -206,10 +525,17 @@ async def _wait_fuse_readable():
     '''
 
     #name = trio.lowlevel.current_task().name
-    worker_data.active_readers += 1
+    wd.active_readers += 1
     try:
         #log.debug('%s: Waiting for read lock...', name)
-        async with worker_data.read_lock:
+        # trio.Lock.acquire() always passes through the scheduler, even if
+        # the lock is free. Since wait_readable() is a checkpoint anyway,
+        # this would just add another round-trip for every request.
+        try:
+            wd.read_lock.acquire_nowait()
+        except trio.WouldBlock:
+            await wd.read_lock.acquire()
+        try:
             #log.debug('%s: Waiting for fuse fd to become readable...', name)
             if fuse_session_exited(session):
                 log.debug('FUSE session exit flag set while waiting for FUSE fd '
@@ -217,44 +543,80 @@ async def _wait_fuse_readable():
                 return False
             await trio.lowlevel.wait_readable(session_fd)
             #log.debug('%s: fuse fd readable, unparking next task.', name)
+        finally:
+            wd.read_lock.release()
     except trio.ClosedResourceError:
         log.debug('FUSE fd about to be closed.')
         return False
 
     finally:
-        worker_data.active_readers -= 1
+        wd.active_readers -= 1
 
     return True
 
 @async_wrapper
-async def _session_loop(nursery, int min_tasks, int max_tasks):
+async def _session_loop(nursery, _WorkerData wd):
+    global pyfuse3_worker_data
     cdef int res
+    cdef int batch_count = 0
+    cdef int new_tasks
     cdef fuse_buf buf
+    cdef void *mem = NULL
+    cdef size_t mem_size = 0
+    cdef void *pinned
+    cdef size_t pinned_size
+    cdef _WriteDataView pinned_view
 
     name = trio.lowlevel.current_task().name
+    scheduler = wd.scheduler
 
-    buf.mem = NULL
-    buf.size = 0
-    buf.pos = 0
-    buf.flags = 0
     while not fuse_session_exited(session):
-        if worker_data.active_readers > min_tasks:
-            log.debug('%s: too many idle tasks (%d total, %d waiting), terminating.',
-                      name, worker_data.task_count, worker_data.active_readers)
-            break
-
-        if not await _wait_fuse_readable():
+        if scheduler is None:
+            if wd.active_readers > wd.min_tasks:
+                log.debug('%s: too many idle tasks (%d total, %d waiting), terminating.',
+                          name, wd.task_count, wd.active_readers)
+                break
+        elif scheduler.worker_idle(wd.task_count, wd.active_readers):
+            log.debug('%s: scheduler stopped worker (%d total, %d waiting), terminating.',
+                      name, wd.task_count, wd.active_readers)
             break
 
-        res = fuse_session_receive_buf(session, &buf)
-        if not worker_data.active_readers and worker_data.task_count < max_tasks:
-            worker_data.task_count += 1
-            log.debug('%s: No tasks waiting, starting another worker (now %d total).',
-                      name, worker_data.task_count)
-            nursery.start_soon(_session_loop, nursery, min_tasks, max_tasks,
-                               name=worker_data.get_name())
-
-        if res == -errno.EINTR:
+        # Under load, the next request is usually already waiting. In that
+        # case, skip the read lock and the readiness notification (up to
+        # *batch_size* requests in a row, so that other tasks still get to
+        # run if the handlers never block).
+        if 0 < batch_count < wd.batch_size:
+            res = receive_request(&buf, &mem, &mem_size)
+        else:
+            res = -errno.EAGAIN
+
+        if res == -errno.EAGAIN:
+            if not await _wait_fuse_readable(wd):
+                break
+            batch_count = 0
+            res = receive_request(&buf, &mem, &mem_size)
+        batch_count += 1
+
+        if scheduler is None:
+            if not wd.active_readers and wd.task_count < wd.max_tasks:
+                wd.task_count += 1
+                log.debug('%s: No tasks waiting, starting another worker (now %d total).',
+                          name, wd.task_count)
+                nursery.start_soon(_session_loop, nursery, wd, name=wd.get_name())
+        elif res > 0:
+            t_start = time.monotonic()
+            new_tasks = scheduler.request_received(
+                t_start, wd.task_count, wd.active_readers, batch_count > 1)
+            if new_tasks > 0:
+                log.debug('%s: scheduler starting %d more workers (now %d total).',
+                          name, new_tasks, wd.task_count + new_tasks)
+            for _ in range(new_tasks):
+                wd.task_count += 1
+                nursery.start_soon(_session_loop, nursery, wd, name=wd.get_name())
+
+        # The fd is non-blocking, and event loops in other threads may have
+        # picked up the request first.
+        if res == -errno.EINTR or res == -errno.EAGAIN:
             continue
         elif res < 0:
             raise OSError(-res, 'fuse_session_receive_buf failed with '
@@ -264,14 +626,154 @@ async def _session_loop(nursery, int min_tasks, int max_tasks):
 
         # When fuse_session_process_buf() calls back into one of our handler
         # methods, the handler will start a co-routine and store it in
-        # py_retval.
+        # wd.retval. Awaiting it runs it right away, up to the point where
+        # it first suspends - so handlers that never block complete without
+        # involving the event loop.
         #log.debug('%s: processing request...', name)
-        save_retval(None)
+        pyfuse3_worker_data = <void*> wd
+        wd.retval = None
+        wd.pinned_view = None
         fuse_session_process_buf(session, &buf)
-        if py_retval is not None:
-            await py_retval
+        pinned_view = wd.pinned_view
+        wd.pinned_view = None
+
+        # Unless the write() handler is still going to access the buffer,
+        # it can be used for the next request right away. If the request
+        # data was passed in a pipe, the buffer was never handed out.
+        if pinned_view is not None and not (buf.flags & FUSE_BUF_IS_FD):
+            pinned = mem
+            pinned_size = mem_size
+        else:
+            if pinned_view is not None:
+                recv_pool.n_pinned -= 1
+            pinned = NULL
+            put_recv_buf(mem, mem_size)
+        mem = NULL
+
+        if wd.retval is not None:
+            retval = wd.retval
+            c = wd.retval_container
+            lane = wd.retval_lane
+            if interrupts_enabled and c is not None:
+                retval = _run_interruptible(wd, retval, c)
+            wd.retval = None
+            wd.retval_container = None
+            if wd.lane_active[lane] >= wd.lane_limit[lane]:
+                # Leave it to one of the workers that are already busy
+                # with this request class, and look for other requests.
+                wd.lane_backlog[lane].append((retval, c))
+                continue
+            wd.lane_active[lane] += 1
+            try:
+                await retval
+                if c is not None:
+                    free_container(c)
+                if scheduler is not None:
+                    scheduler.request_completed(time.monotonic() - t_start)
+                # Requests from the backlog are reported one by one, so
+                # that the scheduler sees the latency of each of them.
+                backlog = wd.lane_backlog[lane]
+                while backlog:
+                    (retval, c) = backlog.popleft()
+                    t_start = time.monotonic()
+                    await retval
+                    if c is not None:
+                        free_container(c)
+                    if scheduler is not None:
+                        scheduler.request_completed(time.monotonic() - t_start)
+            finally:
+                wd.lane_active[lane] -= 1
+                if pinned is not NULL:
+                    unpin_recv_buf(pinned_view, pinned, pinned_size)
+                    pinned_view = None
+        elif scheduler is not None:
+            scheduler.request_completed(time.monotonic() - t_start)
         #log.debug('%s: processing complete.', name)
 
     log.debug('%s: terminated', name)
-    stdlib.free(buf.mem)
-    worker_data.task_count -= 1
+    wd.task_count -= 1
+
+async def _run_interruptible(_WorkerData wd, coro, _Container c):
+    '''Run request handler *coro* so that the kernel can interrupt it
+
+    If the request is interrupted, *coro* is cancelled and the request
+    is answered with EINTR.
+    '''
+
+    cdef int ret
+    cdef uintptr_t req = <uintptr_t> c.req
+
+    with trio.CancelScope() as scope:
+        _req_scopes[req] = (scope, wd.thread_id)
+        try:
+            # If the kernel has already sent the interrupt, this calls
+            # fuse_interrupt() right away.
+            fuse_req_interrupt_func(<fuse_req_t> req, fuse_interrupt, NULL)
+            await coro
+        finally:
+            del _req_scopes[req]
+
+    # Handlers reply only after their last checkpoint, so if they have been
+    # cancelled the request has not been answered yet.
+    if scope.cancelled_caught:
+        log.debug('Request interrupted, replying EINTR')
+        ret = reply_err(c, errno.EINTR)
+        if ret != 0:
+            log.error('fuse_interrupt(): fuse_reply_* failed with %s',
+                      strerror(-ret))
+
+async def _run_workers(_WorkerData wd):
+    '''Process requests in the current event loop until the session ends'''
+
+    wd.thread_id = threading.get_ident()
+    try:
+        async with trio.open_nursery() as nursery:
+            wd.task_count = 1
+            wd.task_serial = 1
+            nursery.start_soon(_session_loop, nursery, wd, name=wd.get_name())
+    finally:
+        # Requests that never made it out of a lane backlog
+        for backlog in wd.lane_backlog:
+            while backlog:
+                backlog.popleft()[0].close()
+
+@async_wrapper
+async def _mt_loop_main(int thread_no, int min_tasks, int max_tasks,
+                        int batch_size, lanes):
+    cdef _WorkerData wd
+
+    wd = _WorkerData('pyfuse-t%d' % thread_no)
+    wd.configure(min_tasks, max_tasks, batch_size, None, lanes)
+    _mt_tokens[threading.get_ident()] = trio.lowlevel.current_trio_token()
+    try:
+        await _run_workers(wd)
+    finally:
+        del _mt_tokens[threading.get_ident()]
+
+def _mt_thread_main(int thread_no, int min_tasks, int max_tasks,
+                    int batch_size, lanes, list errors):
+    '''Run an additional event loop for main_mt()'''
+
+    try:
+        trio.run(_mt_loop_main, thread_no, min_tasks, max_tasks, batch_size,
+                 lanes)
+    except BaseException as exc:
+        log.exception('Event loop in thread %d terminated with exception',
+                      thread_no)
+        errors.append(exc)
+        # Take down the remaining event loops as well
+        fuse_session_exit(session)
+        _wake_mt_loops()
+
+cdef _wake_mt_loops():
+    '''Wake up main_mt() event loops in other threads'''
+
+    ident = threading.get_ident()
+    for (thread_id, token) in list(_mt_tokens.items()):
+        if thread_id == ident:
+            continue
+        try:
+            token.run_sync_soon(trio.lowlevel.notify_closing, session_fd)
+        except RuntimeError:
+            # Event loop has already finished
+            pass
@@ -51,3 +51,28 @@ the terms of the GNU LGPL.
 #else
 #error This should not happen
 #endif
+
+
+/*
+ * Number of leading zero bits in a (non-zero) 64 bit value
+ */
+#define CLZ64(x) __builtin_clzll(x)
+
+
+/*
+ * FUSE passthrough (libfuse 3.16 and newer, Linux only). With older
+ * versions, opening a backing file always fails and the capability
+ * is never offered.
+ */
+#if PLATFORM == PLATFORM_LINUX && \
+    (FUSE_MAJOR_VERSION > 3 || (FUSE_MAJOR_VERSION == 3 && FUSE_MINOR_VERSION >= 16))
+#define CAP_PASSTHROUGH FUSE_CAP_PASSTHROUGH
+#define PASSTHROUGH_OPEN(req, fd) fuse_passthrough_open((req), (fd))
+#define PASSTHROUGH_CLOSE(req, id) fuse_passthrough_close((req), (id))
+#define SET_BACKING_ID(fi, id) ((fi)->backing_id = (id))
+#else
+#define CAP_PASSTHROUGH 0
+#define PASSTHROUGH_OPEN(req, fd) ((void) (req), (void) (fd), 0)
+#define PASSTHROUGH_CLOSE(req, id) ((void) (req), (void) (id), 0)
+#define SET_BACKING_ID(fi, id) do {} while (0)
+#endif
@@ -10,6 +10,9 @@ the terms of the GNU LGPL.
 '''
 
 from posix.stat cimport struct_stat
+from libc.stdint cimport uint64_t
+from fuse_common cimport fuse_file_info
+from fuse_lowlevel cimport fuse_req_t
 
 cdef extern from "macros.c" nogil:
     long GET_BIRTHTIME(struct_stat* buf)
@@ -26,3 +29,10 @@ cdef extern from "macros.c" nogil:
 
     void ASSIGN_DARWIN(void*, void*)
     void ASSIGN_NOT_DARWIN(void*, void*)
+
+    int CLZ64(uint64_t x)
+
+    unsigned CAP_PASSTHROUGH
+    int PASSTHROUGH_OPEN(fuse_req_t req, int fd)
+    int PASSTHROUGH_CLOSE(fuse_req_t req, int backing_id)
+    void SET_BACKING_ID(fuse_file_info *fi, int backing_id)
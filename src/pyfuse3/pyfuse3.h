@@ -38,3 +38,8 @@ the terms of the GNU LGPL.
 #if FUSE_VERSION < 32
 #error FUSE version too old, 3.2.0 or newer required
 #endif
+
+/* The _WorkerData instance of the event loop that is processing requests in
+ * the current thread (borrowed reference). Request handlers use this to
+ * pass their coroutine back to the event loop. */
+static __thread void *pyfuse3_worker_data = NULL;
@@ -19,6 +19,8 @@ import tempfile
 import os
 import errno
 import pytest
+import trio
+import trio.testing
 from copy import copy
 from pickle import PicklingError
 
@@ -100,3 +102,278 @@ def test_copy():
 
     inst = pyfuse3.FUSEError(10)
     assert inst.errno == copy(inst).errno
+
+def test_sync_handler():
+    class Ops(pyfuse3.Operations):
+        def getattr(self, inode, ctx):
+            pass
+
+        @pyfuse3.sync_handler
+        def read(self, fh, off, size):
+            pass
+
+        # Not a plain function, so treated as async unless marked
+        lookup = staticmethod(len)
+
+    supported = ('getattr', 'lookup', 'read')
+    assert sorted(pyfuse3._pyfuse3._sync_handlers(Ops(), supported)) == [
+        'getattr', 'read']
+
+    class Ops2(pyfuse3.Operations):
+        @pyfuse3.sync_handler
+        def mkdir(self, parent_inode, name, mode, ctx):
+            pass
+
+    with pytest.raises(ValueError):
+        pyfuse3._pyfuse3._sync_handlers(Ops2(), supported)
+
+def test_ignores_ctx():
+    class Ops(pyfuse3.Operations):
+        @pyfuse3.ignores_ctx
+        async def getattr(self, inode, ctx):
+            pass
+
+        async def lookup(self, parent_inode, name, _ctx):
+            pass
+
+        async def readlink(self, inode, ctx):
+            pass
+
+        async def mkdir(self, parent_inode, name, mode, *_args):
+            pass
+
+        # Only the parameter in the position of *ctx* counts
+        async def rmdir(self, parent_inode, name, ctx, _unused=None):
+            pass
+
+    names = ('getattr', 'lookup', 'readlink', 'mkdir', 'rmdir', 'unlink')
+    assert sorted(pyfuse3._pyfuse3._ctx_ignoring_handlers(Ops(), names)) == [
+        'getattr', 'lookup']
+
+def test_conn_limits():
+    class Ops(pyfuse3.Operations):
+        max_write = 1024*1024
+        max_background = 64
+
+    assert pyfuse3._pyfuse3._requested_conn_limits(Ops()) == {
+        'max_write': 1024*1024, 'max_background': 64 }
+    assert pyfuse3._pyfuse3._requested_conn_limits(pyfuse3.Operations()) == {}
+
+    for (name, val) in (('max_write', 0), ('max_background', 2**16),
+                        ('congestion_threshold', 128), ('max_readahead', 1.5)):
+        ops = Ops()
+        setattr(ops, name, val)
+        with pytest.raises(ValueError):
+            pyfuse3._pyfuse3._requested_conn_limits(ops)
+
+def test_async_write_to_fd():
+    class Ops(pyfuse3.Operations):
+        async def write_to_fd(self, fh, off, size):
+            return None
+
+    with pytest.raises(ValueError):
+        pyfuse3.init(Ops(), '/nonexistent')
+
+def test_init_takes_conn():
+    class Ops(pyfuse3.Operations):
+        def init(self, conn):
+            pass
+
+    class OldOps(pyfuse3.Operations):
+        def init(self):
+            pass
+
+    assert pyfuse3._pyfuse3._init_takes_conn(Ops())
+    assert pyfuse3._pyfuse3._init_takes_conn(pyfuse3.Operations())
+    assert not pyfuse3._pyfuse3._init_takes_conn(OldOps())
+
+class BlockBackend(pyfuse3.Operations):
+    def __init__(self, data):
+        super().__init__()
+        self.data = data
+        self.reads = []
+        self.gate = None
+
+    async def open(self, inode, flags, ctx):
+        return pyfuse3.FileInfo(fh=inode)
+
+    async def read(self, fh, off, size):
+        self.reads.append(off)
+        if self.gate is not None:
+            await self.gate.wait()
+        else:
+            await trio.sleep(0)
+        return self.data[off:off+size]
+
+    async def write(self, fh, off, buf):
+        data = self.data.ljust(off, b'\0')
+        self.data = data[:off] + bytes(buf) + data[off+len(buf):]
+        return len(buf)
+
+class CachedBackend(pyfuse3.BlockCacheMixin, BlockBackend):
+    cache_block_size = 4
+    cache_size = 12
+
+def _join(res):
+    if isinstance(res, list):
+        return b''.join(res)
+    return bytes(res)
+
+def test_block_cache():
+    async def run():
+        fs = CachedBackend(b'0123456789')
+        fh = (await fs.open(1, os.O_RDONLY, None)).fh
+        assert _join(await fs.read(fh, 2, 5)) == b'23456'
+        assert fs.reads == [0, 4]
+        assert _join(await fs.read(fh, 0, 100)) == b'0123456789'
+        assert fs.reads == [0, 4, 8]
+        assert fs.cache_hits == 2
+
+        await fs.write(fh, 5, b'x')
+        assert _join(await fs.read(fh, 0, 100)) == b'01234x6789'
+        assert fs.reads == [0, 4, 8, 4]
+
+        # Extending the file invalidates the (short) last block
+        await fs.write(fh, 12, b'ab')
+        assert _join(await fs.read(fh, 0, 100)) == b'01234x6789\0\0ab'
+        assert fs.reads == [0, 4, 8, 4, 8, 12]
+        assert fs.cache_evictions == 1
+        assert fs.block_cache_stats()['bytes'] <= 12
+
+        await fs.forget([(1, 1)])
+        assert fs.block_cache_stats()['blocks'] == 0
+
+    trio.run(run)
+
+def test_block_cache_single_flight():
+    async def run():
+        fs = CachedBackend(b'0123456789')
+        fh = (await fs.open(1, os.O_RDONLY, None)).fh
+        results = []
+        async def reader():
+            results.append(_join(await fs.read(fh, 0, 4)))
+        async with trio.open_nursery() as nursery:
+            for _ in range(3):
+                nursery.start_soon(reader)
+        assert results == [b'0123'] * 3
+        assert fs.reads == [0]
+        assert fs.cache_misses == 1
+
+        # Data that is invalidated while being read is not cached
+        fs.invalidate_block_cache()
+        fs.gate = trio.Event()
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(reader)
+            await trio.testing.wait_all_tasks_blocked()
+            fs.invalidate_block_cache(1, 2)
+            fs.gate.set()
+        assert results[-1] == b'0123'
+        assert fs.block_cache_stats()['blocks'] == 0
+
+    trio.run(run)
+
+class WriteBackend(pyfuse3.Operations):
+    def __init__(self):
+        super().__init__()
+        self.data = bytearray()
+        self.writes = []
+        self.fail = False
+        self.gate = None
+
+    async def open(self, inode, flags, ctx):
+        return pyfuse3.FileInfo(fh=inode)
+
+    async def write(self, fh, off, buf):
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.fail:
+            raise pyfuse3.FUSEError(errno.ENOSPC)
+        self.writes.append((off, len(buf)))
+        self.data[off:off+len(buf)] = buf
+        return len(buf)
+
+    async def read(self, fh, off, size):
+        return bytes(self.data[off:off+size])
+
+    async def flush(self, fh):
+        pass
+
+    async def release(self, fh):
+        pass
+
+class CoalescingBackend(pyfuse3.WriteCoalescingMixin, WriteBackend):
+    coalesce_size = 8
+    coalesce_max_age = 3600
+
+def test_write_coalescing():
+    async def run():
+        fs = CoalescingBackend()
+        fh = (await fs.open(1, os.O_WRONLY, None)).fh
+        for i in range(3):
+            assert await fs.write(fh, i*2, b'ab') == 2
+        assert fs.writes == []
+        await fs.write(fh, 2, b'XY')
+        assert await fs.read(fh, 0, 100) == b'abXYab'
+        assert fs.writes == [(0, 6)]
+
+        # Flush on size, and on non-sequential writes
+        await fs.write(fh, 6, b'0123')
+        await fs.write(fh, 10, b'4567')
+        assert fs.writes == [(0, 6), (6, 8)]
+        await fs.write(fh, 100, b'z')
+        await fs.write(fh, 0, b'A')
+        assert fs.writes == [(0, 6), (6, 8), (100, 1)]
+        await fs.flush(fh)
+        assert fs.writes == [(0, 6), (6, 8), (100, 1), (0, 1)]
+        assert fs.writes_coalesced == 4
+
+        # Errors are reported on the next call
+        fs.fail = True
+        await fs.write(fh, 0, b'x')
+        await fs.read(fh, 0, 1)
+        with pytest.raises(pyfuse3.FUSEError) as exc_info:
+            await fs.write(fh, 1, b'y')
+        assert exc_info.value.errno == errno.ENOSPC
+        await fs.write(fh, 1, b'y')
+        with pytest.raises(pyfuse3.FUSEError):
+            await fs.flush(fh)
+        fs.fail = False
+        await fs.flush(fh)
+        await fs.release(fh)
+
+    trio.run(run)
+
+def test_write_coalescing_cancelled():
+    async def run():
+        fs = CoalescingBackend()
+        fh = (await fs.open(1, os.O_WRONLY, None)).fh
+        await fs.write(fh, 0, b'abc')
+
+        # Cancel flush while the data is being written
+        fs.gate = trio.Event()
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(fs.flush, fh)
+            await trio.testing.wait_all_tasks_blocked()
+            nursery.cancel_scope.cancel()
+        assert fs.writes == []
+
+        # Data must still be written by the next flush
+        fs.gate = None
+        await fs.flush(fh)
+        assert fs.data == b'abc'
+
+        # If data has been buffered in the meantime, the loss is reported
+        await fs.write(fh, 0, b'xyz')
+        fs.gate = trio.Event()
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(fs.flush, fh)
+            await trio.testing.wait_all_tasks_blocked()
+            await fs.write(fh, 10, b'0')
+            nursery.cancel_scope.cancel()
+        fs.gate = None
+        with pytest.raises(pyfuse3.FUSEError) as exc_info:
+            await fs.flush(fh)
+        assert exc_info.value.errno == errno.EIO
+        await fs.release(fh)
+
+    trio.run(run)
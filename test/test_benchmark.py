@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+test_benchmark.py - Unit tests for util/benchmark.py
+
+Copyright © 2026 Nikolaus Rath <Nikolaus.org>
+
+This file is part of pyfuse3. This work may be distributed under
+the terms of the GNU LGPL.
+'''
+
+if __name__ == '__main__':
+    import pytest
+    import sys
+    sys.exit(pytest.main([__file__] + sys.argv[1:]))
+
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+basename = os.path.join(os.path.dirname(__file__), '..')
+
+@pytest.mark.parametrize('args', ([], ['--sync', '--batch-size', '4']))
+def test_benchmark(tmpdir, args):
+    out_file = str(tmpdir.join('results.json'))
+    cases = ['getattr', 'lookup', 'read-4k', 'write-64k', 'readdir-1000',
+             'getxattr', 'listxattr', 'setxattr', 'entry_attributes']
+    cmdline = [sys.executable,
+               os.path.join(basename, 'util', 'benchmark.py'),
+               '--count', '100', '--output', out_file] + args + cases
+    subprocess.check_call(cmdline, stdin=subprocess.DEVNULL)
+    with open(out_file) as fh:
+        report = json.load(fh)
+    assert sorted(report['results']) == sorted(cases)
+    for res in report['results'].values():
+        assert res['ops_per_sec'] > 0
+        assert res['blocks_per_request'] == res['allocated_blocks'] / res['requests']
+
+    # Comparing with itself must not find regressions
+    subprocess.check_call(cmdline + ['--compare', out_file],
+                          stdin=subprocess.DEVNULL)
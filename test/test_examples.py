@@ -38,12 +38,14 @@ def name_generator(__ctr=[0]):
     __ctr[0] += 1
     return 'testfile_%d' % __ctr[0]
 
-@pytest.mark.parametrize('filename', ('hello.py', 'hello_asyncio.py'))
-def test_hello(tmpdir, filename):
+@pytest.mark.parametrize('filename,args', (('hello.py', []),
+                                           ('hello.py', ['--threads', '4']),
+                                           ('hello_asyncio.py', [])))
+def test_hello(tmpdir, filename, args):
     mnt_dir = str(tmpdir)
     cmdline = [sys.executable,
                os.path.join(basename, 'examples', filename),
-               mnt_dir ]
+               mnt_dir ] + args
     mount_process = subprocess.Popen(cmdline, stdin=subprocess.DEVNULL,
                                      universal_newlines=True)
     try:
@@ -94,12 +96,13 @@ def test_tmpfs(tmpdir):
     else:
         umount(mount_process, mnt_dir)
 
-def test_passthroughfs(tmpdir):
+@pytest.mark.parametrize('options', ([], ['--passthrough']))
+def test_passthroughfs(tmpdir, options):
     mnt_dir = str(tmpdir.mkdir('mnt'))
     src_dir = str(tmpdir.mkdir('src'))
     cmdline = [sys.executable,
                os.path.join(basename, 'examples', 'passthroughfs.py'),
-               src_dir, mnt_dir ]
+               src_dir, mnt_dir ] + options
     mount_process = subprocess.Popen(cmdline, stdin=subprocess.DEVNULL,
                                      universal_newlines=True)
     try:
@@ -16,15 +16,22 @@ if __name__ == '__main__':
     sys.exit(pytest.main([__file__] + sys.argv[1:]))
 
 import pyfuse3
+import pyfuse3.asyncio
 from pyfuse3 import FUSEError
+import asyncio
+import concurrent.futures
 import multiprocessing
 import os
 import errno
 import stat
 import time
 import logging
+import functools
+import signal
 import trio
 import threading
+import tempfile
+import contextlib
 from util import fuse_test_marker, wait_for_mount, umount, cleanup
 
 pytestmark = fuse_test_marker()
@@ -43,26 +50,49 @@ def get_mp():
 
     return mp
 
+@contextlib.contextmanager
+def mount_fs(mnt_dir, fs_class=None, main_kwargs=None, **state):
+    '''Mount *fs_class* at *mnt_dir* in a separate process
 
-@pytest.fixture()
-def testfs(tmpdir):
-    mnt_dir = str(tmpdir)
+    Keyword arguments are stored in the shared state namespace before the
+    file system is started. Yields the namespace.
+    '''
     mp = get_mp()
     with mp.Manager() as mgr:
-        cross_process = mgr.Namespace()
+        fs_state = mgr.Namespace()
+        for (name, value) in state.items():
+            setattr(fs_state, name, value)
         mount_process = mp.Process(target=run_fs,
-                                   args=(mnt_dir, cross_process))
+                                   args=(mnt_dir, fs_state, fs_class or Fs,
+                                         main_kwargs))
 
         mount_process.start()
         try:
             wait_for_mount(mount_process, mnt_dir)
-            yield (mnt_dir, cross_process)
+            yield fs_state
         except:
-            cleanup(mnt_process, mnt_dir)
+            cleanup(mount_process, mnt_dir)
             raise
         else:
             umount(mount_process, mnt_dir)
 
+@pytest.fixture()
+def testfs(tmpdir, request):
+    # Use indirect parametrization (see `with_fs`) to select the file
+    # system class and the keyword arguments for `pyfuse3.main`.
+    (fs_name, main_kwargs) = getattr(request, 'param', ('Fs', None))
+    mnt_dir = str(tmpdir)
+    with mount_fs(mnt_dir, globals()[fs_name], main_kwargs) as fs_state:
+        yield (mnt_dir, fs_state)
+
+def with_fs(fs_name, **main_kwargs):
+    '''Run the decorated test against the file system class *fs_name*
+
+    The class is given by name because it is defined further down.
+    '''
+    return pytest.mark.parametrize('testfs', [(fs_name, main_kwargs)],
+                                   indirect=True, ids=[fs_name])
+
 def test_invalidate_entry(testfs):
     (mnt_dir, fs_state) = testfs
     path = os.path.join(mnt_dir, 'message')
@@ -102,6 +132,22 @@ def test_notify_store(testfs):
         assert fh.read() == 'hello world\n'
         assert not fs_state.read_called
 
+def test_notify_store_stream(testfs):
+    (mnt_dir, fs_state) = testfs
+    with open(os.path.join(mnt_dir, 'message'), 'r') as fh:
+        pyfuse3.setxattr(mnt_dir, 'command', b'store_stream')
+        fs_state.read_called = False
+        assert fh.read() == 'hello world\n'
+        assert not fs_state.read_called
+        assert fs_state.progress == [2, 3, 5, 6, 8, 9, 11, 12]
+
+def test_retrieve(testfs):
+    (mnt_dir, fs_state) = testfs
+    with open(os.path.join(mnt_dir, 'message'), 'r') as fh:
+        assert fh.read() == 'hello world\n'
+        pyfuse3.setxattr(mnt_dir, 'command', b'retrieve')
+        assert fs_state.retrieved == b'hello world\n'
+
 def test_entry_timeout(testfs):
     (mnt_dir, fs_state) = testfs
     fs_state.entry_timeout = 1
@@ -151,8 +197,263 @@ def test_terminate(tmpdir):
             cleanup(mount_process, mnt_dir)
             raise
 
+@with_fs('SyncFs')
+def test_sync_handlers(testfs):
+    (mnt_dir, fs_state) = testfs
+    path = os.path.join(mnt_dir, 'message')
+    with pytest.raises(FileNotFoundError):
+        os.stat(path + '.bak')
+    assert os.stat(path).st_size == len(b'hello world\n')
+    assert fs_state.lookup_called
+    with open(path, 'r') as fh:
+        assert fh.read() == 'hello world\n'
+    assert fs_state.read_called
+
+@with_fs('ForwardingFs')
+def test_sync_handlers_returning_awaitables(testfs):
+    (mnt_dir, fs_state) = testfs
+    path = os.path.join(mnt_dir, 'message')
+    with pytest.raises(FileNotFoundError):
+        os.stat(path + '.bak')
+    assert os.stat(path).st_size == len(b'hello world\n')
+    assert fs_state.lookup_called
+    with open(path, 'r') as fh:
+        assert fh.read() == 'hello world\n'
+    assert fs_state.read_called
+    assert os.listxattr(path) == []
+
+def _stat_and_read(path):
+    for _ in range(20):
+        assert os.stat(path).st_size == len(b'hello world\n')
+        with open(path, 'rb') as fh:
+            assert fh.read() == b'hello world\n'
+
+@with_fs('AsyncioFs', max_tasks=4, batch_size=8)
+def test_asyncio_batched(testfs):
+    # Several workers contend for the read lock, and requests that are
+    # already queued are read in batches.
+    (mnt_dir, fs_state) = testfs
+    path = os.path.join(mnt_dir, 'message')
+    with pytest.raises(FileNotFoundError):
+        os.stat(path + '.bak')
+    with concurrent.futures.ThreadPoolExecutor(4) as pool:
+        futures = [ pool.submit(_stat_and_read, path) for _ in range(4) ]
+        for f in futures:
+            f.result(timeout=10)
+    assert fs_state.read_called
+
+@with_fs('ReturnedErrorFs')
+def test_returned_errors(testfs):
+    (mnt_dir, fs_state) = testfs
+    path = os.path.join(mnt_dir, 'message')
+    for _ in range(3):
+        with pytest.raises(FileNotFoundError):
+            os.stat(path + '.bak')
+    assert os.stat(path).st_size == len(b'hello world\n')
+    with pytest.raises(OSError) as exc_info:
+        pyfuse3.getxattr(path, 'user.foo')
+    assert exc_info.value.errno == pyfuse3.ENOATTR
+
+@with_fs('ZeroCopyWriteFs')
+def test_zero_copy_write(testfs):
+    (mnt_dir, fs_state) = testfs
+    data = os.urandom(4096)
+    fd = os.open(os.path.join(mnt_dir, 'message'), os.O_WRONLY)
+    try:
+        assert os.write(fd, data) == len(data)
+    finally:
+        os.close(fd)
+    assert fs_state.written == data
+
+@with_fs('RetainingWriteFs')
+def test_zero_copy_write_retained(testfs):
+    (mnt_dir, fs_state) = testfs
+    data = [ os.urandom(4096) for _ in range(3) ]
+    fd = os.open(os.path.join(mnt_dir, 'message'), os.O_WRONLY)
+    try:
+        for buf in data:
+            assert os.write(fd, buf) == len(buf)
+    finally:
+        os.close(fd)
+    # The retained slice must not be overwritten by subsequent requests
+    pyfuse3.setxattr(mnt_dir, 'command', b'retained')
+    assert fs_state.retained == data[0][1:]
+    pyfuse3.setxattr(mnt_dir, 'command', b'buffers')
+    assert fs_state.buffers['pinned'] == 0
+
+def test_write_to_fd(tmpdir):
+    mnt_dir = str(tmpdir.mkdir('mnt'))
+    backing_file = str(tmpdir.join('backing'))
+    with open(backing_file, 'wb'):
+        pass
+    with mount_fs(mnt_dir, WriteToFdFs, backing_file=backing_file):
+        data = os.urandom(256*1024)
+        fd = os.open(os.path.join(mnt_dir, 'message'), os.O_WRONLY)
+        try:
+            assert os.pwrite(fd, data, 4096) == len(data)
+        finally:
+            os.close(fd)
+        with open(backing_file, 'rb') as fh:
+            assert fh.read() == bytes(4096) + data
+
+@with_fs('ChunkedReadFs')
+def test_chunked_read(testfs):
+    (mnt_dir, fs_state) = testfs
+    with open(os.path.join(mnt_dir, 'message'), 'rb') as fh:
+        assert fh.read() == b'hello world\n'
+    assert fs_state.read_called
+
+@with_fs('FileRangeFs')
+def test_file_range(testfs):
+    (mnt_dir, fs_state) = testfs
+    with open(os.path.join(mnt_dir, 'message'), 'rb') as fh:
+        assert fh.read() == FILE_RANGE_DATA
+        fh.seek(4097)
+        assert fh.read(8192) == FILE_RANGE_DATA[4097:4097+8192]
+    assert fs_state.read_called
+
+def _reader(path):
+    with open(path, 'rb') as fh:
+        assert fh.read() == b'hello world\n'
+
+def test_lanes(tmpdir):
+    mnt_dir = str(tmpdir)
+    path = os.path.join(mnt_dir, 'message')
+    mp = get_mp()
+    with mount_fs(mnt_dir, LaneFs, {'lanes': {'data': 1}},
+                  reads_started=0, max_active_reads=0) as fs_state:
+        readers = [ mp.Process(target=_reader, args=(path,))
+                    for _ in range(3) ]
+        readers[0].start()
+        for _ in range(50):
+            if fs_state.reads_started:
+                break
+            time.sleep(0.1)
+        assert fs_state.reads_started == 1
+
+        # While the first read is blocked, the other reads have to wait
+        # but metadata requests are still processed.
+        for reader in readers[1:]:
+            reader.start()
+        for _ in range(5):
+            with pytest.raises(FileNotFoundError):
+                os.stat(path + '.bak')
+            time.sleep(0.1)
+        assert fs_state.reads_started == 1
+
+        pyfuse3.setxattr(mnt_dir, 'command', b'unblock')
+        for reader in readers:
+            reader.join(5)
+            assert reader.exitcode == 0
+        assert fs_state.reads_started >= 3
+        assert fs_state.max_active_reads == 1
+
+def _interrupted_reader(path):
+    # Make sure that the signal interrupts the read() syscall, but does not
+    # terminate the process. Python retries the read() afterwards.
+    signal.signal(signal.SIGUSR1, lambda *a: None)
+    with open(path, 'rb') as fh:
+        assert fh.read() == b'hello world\n'
+
+def test_interrupt(tmpdir):
+    mnt_dir = str(tmpdir)
+    mp = get_mp()
+    with mount_fs(mnt_dir, InterruptFs, read_started=False,
+                  read_interrupted=False) as fs_state:
+        reader = mp.Process(target=_interrupted_reader,
+                            args=(os.path.join(mnt_dir, 'message'),))
+        reader.start()
+        for _ in range(50):
+            if fs_state.read_started:
+                break
+            time.sleep(0.1)
+        assert fs_state.read_started
+        os.kill(reader.pid, signal.SIGUSR1)
+        reader.join(5)
+        assert reader.exitcode == 0
+        assert fs_state.read_interrupted
+
+
+@with_fs('StatsFs')
+def test_stats(testfs):
+    (mnt_dir, fs_state) = testfs
+    path = os.path.join(mnt_dir, 'message')
+    with pytest.raises(FileNotFoundError):
+        os.stat(path + '.bak')
+    with open(path, 'rb') as fh:
+        assert fh.read() == b'hello world\n'
+    pyfuse3.setxattr(mnt_dir, 'command', b'stats')
+    stats = fs_state.stats
+    assert stats['in_flight'] >= 1
+    assert stats['ops']['lookup']['count'] >= 2
+    assert stats['ops']['lookup']['errors'][errno.ENOENT] >= 1
+    assert stats['ops']['read']['bytes_out'] == len(b'hello world\n')
+    read_stats = stats['ops']['read']
+    assert sum(read_stats['latency'].values()) == read_stats['count']
+
+
+@with_fs('Fs', max_tasks=8)
+def test_buffer_pool(testfs):
+    (mnt_dir, fs_state) = testfs
+    path = os.path.join(mnt_dir, 'message')
+    for _ in range(5):
+        with open(path, 'rb') as fh:
+            assert fh.read() == b'hello world\n'
+    pyfuse3.setxattr(mnt_dir, 'command', b'buffers')
+    stats = fs_state.buffers
+    assert stats['limit'] == 16
+    assert stats['in_use'] == 0
+    assert stats['pinned'] == 0
+    assert stats['requests'] >= 15
+    # With a single event loop, a buffer is never needed by more
+    # than one worker at a time.
+    assert stats['allocations'] == stats['peak_in_use'] == 1
+    assert stats['idle'] == 1
+    assert stats['buffer_size'] > 1024*1024
+
+
+@with_fs('TunedFs')
+def test_conn_limits(testfs):
+    (mnt_dir, fs_state) = testfs
+    pyfuse3.setxattr(mnt_dir, 'command', b'conn')
+    conn = fs_state.conn
+    assert conn['max_background'] == 32
+    assert conn['congestion_threshold'] == 24
+    assert conn['max_write'] > 0
+
+
+@with_fs('InitConnFs')
+def test_init_conn(testfs):
+    (mnt_dir, fs_state) = testfs
+    pyfuse3.setxattr(mnt_dir, 'command', b'conn')
+    conn = fs_state.conn
+    assert conn['max_background'] == 16
+    assert conn['congestion_threshold'] == 12
+    assert conn['want'] & pyfuse3.FUSE_CAP_READDIRPLUS
+    assert conn['want'] & conn['capable'] == conn['want']
+
+
+@with_fs('TracingFs')
+def test_tracer(testfs):
+    (mnt_dir, fs_state) = testfs
+    path = os.path.join(mnt_dir, 'message')
+    with pytest.raises(FileNotFoundError):
+        os.stat(path + '.bak')
+    with open(path, 'rb') as fh:
+        assert fh.read() == b'hello world\n'
+    pyfuse3.setxattr(mnt_dir, 'command', b'trace')
+    events = fs_state.trace
+    assert ('lookup', pyfuse3.ROOT_INODE, errno.ENOENT,
+            os.getpid()) in events
+    # Reads may be issued by the kernel on behalf of the process
+    assert any(ev[:3] == ('read', pyfuse3.ROOT_INODE+1, 0)
+               for ev in events)
+
 
 class Fs(pyfuse3.Operations):
+    # Set to run the file system in asyncio rather than trio mode
+    asyncio_mode = False
+
     def __init__(self, cross_process):
         super(Fs, self).__init__()
         self.hello_name = b"message"
@@ -167,6 +468,9 @@ class Fs(pyfuse3.Operations):
         self.status.attr_timeout = 99999
 
     async def getattr(self, inode, ctx=None):
+        return self._getattr(inode)
+
+    def _getattr(self, inode):
         entry = pyfuse3.EntryAttributes()
         if inode == pyfuse3.ROOT_INODE:
             entry.st_mode = (stat.S_IFDIR | 0o755)
@@ -199,11 +503,14 @@ class Fs(pyfuse3.Operations):
                 assert inode == pyfuse3.ROOT_INODE
 
     async def lookup(self, parent_inode, name, ctx=None):
+        return self._lookup(parent_inode, name)
+
+    def _lookup(self, parent_inode, name):
         if parent_inode != pyfuse3.ROOT_INODE or name != self.hello_name:
             raise pyfuse3.FUSEError(errno.ENOENT)
         self.lookup_cnt += 1
         self.status.lookup_called = True
-        return await self.getattr(self.hello_inode)
+        return self._getattr(self.hello_inode)
 
     async def opendir(self, inode, ctx):
         if inode != pyfuse3.ROOT_INODE:
@@ -214,7 +521,7 @@ class Fs(pyfuse3.Operations):
         assert fh == pyfuse3.ROOT_INODE
         if off == 0:
             pyfuse3.readdir_reply(
-                token, self.hello_name, await self.getattr(self.hello_inode), 1)
+                token, self.hello_name, self._getattr(self.hello_inode), 1)
         return
 
     async def open(self, inode, flags, ctx):
@@ -246,13 +553,276 @@ class Fs(pyfuse3.Operations):
             pyfuse3.notify_store(self.hello_inode, offset=0,
                                  data=self.hello_data)
 
+        elif value == b'store_stream':
+            async def chunks():
+                for i in range(0, len(self.hello_data), 3):
+                    yield self.hello_data[i:i+3]
+            progress = []
+            await pyfuse3.notify_store_stream(self.hello_inode, 0, chunks(),
+                                              chunk_size=2,
+                                              progress=progress.append)
+            self.status.progress = progress
+
+        elif value == b'retrieve':
+            self.status.retrieved = await pyfuse3.retrieve(
+                self.hello_inode, 0, 4096)
+
         elif value == b'terminate':
             pyfuse3.terminate()
+
+        elif value == b'stats':
+            self.status.stats = pyfuse3.get_stats()
+
+        elif value == b'buffers':
+            self.status.buffers = pyfuse3.get_buffer_stats()
+
+        elif value == b'conn':
+            self.status.conn = pyfuse3.get_connection_info()
+
+        elif value == b'trace':
+            self.status.trace = self.tracer.events
         else:
             raise FUSEError(errno.EINVAL)
 
 
-def run_fs(mountpoint, cross_process):
+ENOENT_ERROR = FUSEError(errno.ENOENT)
+
+class SyncFs(Fs):
+    '''Like Fs, but with synchronous request handlers'''
+
+    def getattr(self, inode, ctx=None):
+        return self._getattr(inode)
+
+    def lookup(self, parent_inode, name, ctx=None):
+        if parent_inode == pyfuse3.ROOT_INODE and name != self.hello_name:
+            return ENOENT_ERROR
+        return self._lookup(parent_inode, name)
+
+    def open(self, inode, flags, ctx):
+        if inode != self.hello_inode:
+            raise pyfuse3.FUSEError(errno.ENOENT)
+        return pyfuse3.FileInfo(fh=inode)
+
+    def read(self, fh, off, size):
+        assert fh == self.hello_inode
+        self.status.read_called = True
+        return self.hello_data[off:off+size]
+
+
+class ForwardingFs(Fs):
+    '''Like Fs, but with regular functions that return coroutines'''
+
+    def getattr(self, inode, ctx=None):
+        return super().getattr(inode, ctx)
+
+    def lookup(self, parent_inode, name, ctx=None):
+        return super().lookup(parent_inode, name, ctx)
+
+    def open(self, inode, flags, ctx):
+        return super().open(inode, flags, ctx)
+
+    def read(self, fh, off, size):
+        return super().read(fh, off, size)
+
+    def listxattr(self, inode, ctx):
+        return self._listxattr()
+
+    async def _listxattr(self):
+        return []
+
+
+class AsyncioFs(Fs):
+    asyncio_mode = True
+
+
+class ReturnedErrorFs(Fs):
+    '''Like Fs, but returns rather than raises some errors'''
+
+    async def lookup(self, parent_inode, name, ctx=None):
+        if parent_inode == pyfuse3.ROOT_INODE and name != self.hello_name:
+            return ENOENT_ERROR
+        return self._lookup(parent_inode, name)
+
+    async def getxattr(self, inode, name, ctx):
+        return FUSEError(pyfuse3.ENOATTR)
+
+
+class ZeroCopyWriteFs(Fs):
+    enable_zero_copy_write = True
+
+    async def open(self, inode, flags, ctx):
+        if inode != self.hello_inode:
+            raise pyfuse3.FUSEError(errno.ENOENT)
+        return pyfuse3.FileInfo(fh=inode, direct_io=True)
+
+    async def write(self, fh, off, buf):
+        assert fh == self.hello_inode
+        assert isinstance(buf, memoryview) and buf.readonly
+        self.status.written = bytes(buf)
+        return len(buf)
+
+
+class RetainingWriteFs(ZeroCopyWriteFs):
+    '''Keeps a slice of the first write buffer beyond the write() call'''
+
+    async def write(self, fh, off, buf):
+        if not hasattr(self, 'retained'):
+            self.retained = buf[1:]
+        return len(buf)
+
+    async def setxattr(self, inode, name, value, ctx):
+        if value == b'retained':
+            self.status.retained = bytes(self.retained)
+        else:
+            await super().setxattr(inode, name, value, ctx)
+
+
+class WriteToFdFs(Fs):
+    '''Like Fs, but stores written data in the file *status.backing_file*'''
+
+    async def open(self, inode, flags, ctx):
+        if inode != self.hello_inode:
+            raise pyfuse3.FUSEError(errno.ENOENT)
+        if not hasattr(self, 'backing_fd'):
+            self.backing_fd = os.open(self.status.backing_file, os.O_WRONLY)
+        return pyfuse3.FileInfo(fh=inode, direct_io=True)
+
+    def write_to_fd(self, fh, off, size):
+        assert fh == self.hello_inode
+        return (self.backing_fd, off)
+
+    async def write(self, fh, off, buf):
+        raise FUSEError(errno.EIO)
+
+
+class ChunkedReadFs(Fs):
+    '''Like Fs, but returns read data in several pieces'''
+
+    async def read(self, fh, off, size):
+        assert fh == self.hello_inode
+        self.status.read_called = True
+        data = self.hello_data[off:off+size]
+        return [ data[i:i+3] for i in range(0, len(data), 3) ]
+
+
+# Spans several pages, so that the data is spliced from the file
+FILE_RANGE_DATA = bytes(range(256)) * 80 + b'hello world\n'
+
+class FileRangeFs(Fs):
+    '''Like Fs, but returns data from a temporary file'''
+
+    def __init__(self, cross_process):
+        super().__init__(cross_process)
+        self.hello_data = FILE_RANGE_DATA
+
+    def init(self):
+        self.backing_fh = tempfile.TemporaryFile()
+        self.backing_fh.write(b'x' * 100 + self.hello_data)
+        self.backing_fh.flush()
+
+    async def read(self, fh, off, size):
+        assert fh == self.hello_inode
+        self.status.read_called = True
+        return pyfuse3.FileRange(self.backing_fh.fileno(), off + 100, size)
+
+
+class LaneFs(Fs):
+    '''Like Fs, but reads block until the *unblock* command is received'''
+
+    def __init__(self, cross_process):
+        super().__init__(cross_process)
+        self.unblocked = trio.Event()
+        self.active_reads = 0
+
+    async def open(self, inode, flags, ctx):
+        # Make sure that every read() reaches the file system
+        fi = await super().open(inode, flags, ctx)
+        fi.direct_io = True
+        return fi
+
+    async def read(self, fh, off, size):
+        self.status.reads_started += 1
+        self.active_reads += 1
+        self.status.max_active_reads = max(self.status.max_active_reads,
+                                           self.active_reads)
+        try:
+            await self.unblocked.wait()
+        finally:
+            self.active_reads -= 1
+        return await super().read(fh, off, size)
+
+    async def setxattr(self, inode, name, value, ctx):
+        if value == b'unblock':
+            self.unblocked.set()
+        else:
+            await super().setxattr(inode, name, value, ctx)
+
+
+class InterruptFs(Fs):
+    '''Like Fs, but the first read blocks until it is interrupted'''
+
+    enable_interrupts = True
+
+    async def open(self, inode, flags, ctx):
+        # Reads through the page cache are sent as background requests,
+        # which the kernel does not interrupt.
+        fi = await super().open(inode, flags, ctx)
+        fi.direct_io = True
+        return fi
+
+    async def read(self, fh, off, size):
+        if not self.status.read_started:
+            self.status.read_started = True
+            try:
+                await trio.sleep(30)
+            except trio.Cancelled:
+                self.status.read_interrupted = True
+                raise
+        return await super().read(fh, off, size)
+
+
+class TunedFs(Fs):
+    max_background = 32
+    congestion_threshold = 24
+
+
+class InitConnFs(Fs):
+    def init(self, conn):
+        assert conn.capable & pyfuse3.FUSE_CAP_READDIRPLUS
+        conn.max_background = 16
+        conn.congestion_threshold = 12
+        for (name, val) in (('congestion_threshold', 17),
+                            ('max_background', 8), ('max_background', 2**16),
+                            ('max_write', 0)):
+            with pytest.raises(ValueError):
+                setattr(conn, name, val)
+        if conn.capable & pyfuse3.FUSE_CAP_PARALLEL_DIROPS:
+            conn.want |= pyfuse3.FUSE_CAP_PARALLEL_DIROPS
+
+
+class StatsFs(Fs):
+    enable_stats = True
+
+
+class Tracer(pyfuse3.RequestTracer):
+    def __init__(self):
+        self.events = []
+
+    def on_request_end(self, event):
+        assert event.end_ns >= event.start_ns
+        self.events.append((event.op, event.inode, event.errno, event.pid))
+
+
+class TracingFs(Fs):
+    def __init__(self, cross_process):
+        super().__init__(cross_process)
+        self.tracer = Tracer()
+
+    def init(self):
+        pyfuse3.set_tracer(self.tracer)
+
+
+def run_fs(mountpoint, cross_process, fs_class=Fs, main_kwargs=None):
     # Logging (note that we run in a new process, so we can't
     # rely on direct log capture and instead print to stdout)
     root_logger = logging.getLogger()
@@ -265,11 +835,16 @@ def run_fs(mountpoint, cross_process):
     root_logger.addHandler(handler)
     root_logger.setLevel(logging.DEBUG)
 
-    testfs = Fs(cross_process)
+    testfs = fs_class(cross_process)
     fuse_options = set(pyfuse3.default_options)
     fuse_options.add('fsname=pyfuse3_testfs')
     pyfuse3.init(testfs, mountpoint, fuse_options)
+    main = functools.partial(pyfuse3.main, **(main_kwargs or {}))
     try:
-        trio.run(pyfuse3.main)
+        if fs_class.asyncio_mode:
+            pyfuse3.asyncio.enable()
+            asyncio.run(main())
+        else:
+            trio.run(main)
     finally:
         pyfuse3.close()
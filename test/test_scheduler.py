@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+test_scheduler.py - Unit tests for pyfuse3 worker schedulers.
+
+Copyright © 2026 Nikolaus Rath <Nikolaus.org>
+
+This file is part of pyfuse3. This work may be distributed under
+the terms of the GNU LGPL.
+'''
+
+if __name__ == '__main__':
+    import pytest
+    import sys
+    sys.exit(pytest.main([__file__] + sys.argv[1:]))
+
+import pytest
+import pyfuse3
+
+def test_default_policy():
+    sched = pyfuse3.WorkerScheduler(min_tasks=2, max_tasks=3)
+
+    # Start a worker only if nobody is waiting for requests
+    assert sched.request_received(0, 1, 0, False) == 1
+    assert sched.request_received(0, 2, 1, False) == 0
+    assert sched.request_received(0, 3, 0, True) == 0
+
+    assert not sched.worker_idle(3, 2)
+    assert sched.worker_idle(3, 3)
+    assert sched.stats() == {'workers_started': 1, 'workers_stopped': 1}
+
+def test_invalid_limits():
+    with pytest.raises(ValueError):
+        pyfuse3.WorkerScheduler(min_tasks=5, max_tasks=2)
+    with pytest.raises(ValueError):
+        pyfuse3.AdaptiveScheduler(smoothing=0)
+
+def test_adaptive_grow():
+    sched = pyfuse3.AdaptiveScheduler(max_tasks=50, smoothing=1,
+                                      headroom=1, max_burst=8)
+
+    # 1000 requests/s that take 10 ms each need 10 workers
+    sched.request_received(0.000, 1, 1, False)
+    sched.request_completed(0.01)
+    assert sched.request_received(0.001, 1, 0, False) == 8
+    assert sched.target == 10
+    assert sched.request_received(0.002, 9, 0, False) == 1
+
+    # Backlog doubles the pool even beyond the target
+    assert sched.request_received(0.003, 10, 0, True) == 8
+    assert sched.request_received(0.004, 50, 0, True) == 0
+    assert sched.backlog_events == 2
+
+def test_adaptive_initial_target():
+    sched = pyfuse3.AdaptiveScheduler(min_tasks=2, max_tasks=50)
+
+    # Without an estimate of the request rate, start small
+    assert sched.request_received(0.000, 1, 0, False) == 1
+    assert sched.target == 2
+
+def test_adaptive_hysteresis():
+    sched = pyfuse3.AdaptiveScheduler(max_tasks=50, smoothing=1,
+                                      headroom=1, hysteresis=0.5)
+    sched.request_received(0.000, 1, 1, False)
+    sched.request_completed(0.01)
+    sched.request_received(0.001, 1, 1, False)
+    assert sched.target == 10
+
+    # Keep workers until the target is exceeded by 50%
+    assert not sched.worker_idle(15, 5)
+    assert sched.worker_idle(16, 5)
+
+    # Never stop the last waiting worker
+    assert not sched.worker_idle(16, 0)
+
+    # Load drops: 10 requests/s
+    sched.request_received(0.101, 16, 5, False)
+    assert sched.target == 1
+    assert sched.worker_idle(2, 1)
+    assert not sched.worker_idle(1, 1)
+    assert sched.shrink_events == 2
+    assert sched.stats()['workers_stopped'] == 2
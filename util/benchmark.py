@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+benchmark.py - Measure request processing overhead of pyfuse3.
+
+This program measures how many requests per second pyfuse3 can dispatch to
+a trivial in-memory file system. No FUSE mount is needed: requests are
+written to one end of a socket pair by a client process, and the other end
+is passed to libfuse as the FUSE device (using libfuse's support for
+``/dev/fd/N`` mount points, which requires libfuse 3.3 or newer). The
+client keeps a number of requests in flight, and checks each reply.
+
+Results are written as JSON. They can be saved and compared to later runs
+to find performance regressions. Besides the request rate, the results
+contain the number of Python memory blocks that remain allocated after
+each case (per request), which shows requests that leave objects behind
+(including garbage that the collector has not yet freed).
+
+Copyright © 2026 Nikolaus Rath <Nikolaus.org>
+
+This file is part of pyfuse3. This work may be distributed under
+the terms of the GNU LGPL.
+'''
+
+import os
+import sys
+
+# If we are running from the pyfuse3 source directory, try
+# to load the module from there first.
+basedir = os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), '..'))
+if (os.path.exists(os.path.join(basedir, 'setup.py')) and
+    os.path.exists(os.path.join(basedir, 'src', 'pyfuse3', '__init__.pyx'))):
+    sys.path.insert(0, os.path.join(basedir, 'src'))
+
+from argparse import ArgumentParser
+import errno
+import functools
+import gc
+import json
+import multiprocessing
+import platform
+import socket
+import stat
+import struct
+import time
+import timeit
+import pyfuse3
+import trio
+
+# FUSE protocol version that the client claims to speak
+FUSE_KERNEL_VERSION = 7
+FUSE_KERNEL_MINOR_VERSION = 31
+
+# Opcodes (from <linux/fuse.h>)
+FUSE_LOOKUP = 1
+FUSE_GETATTR = 3
+FUSE_READ = 15
+FUSE_WRITE = 16
+FUSE_SETXATTR = 21
+FUSE_GETXATTR = 22
+FUSE_LISTXATTR = 23
+FUSE_INIT = 26
+FUSE_READDIRPLUS = 44
+
+# FUSE_INIT flags
+FUSE_ASYNC_READ = 1 << 0
+FUSE_BIG_WRITES = 1 << 5
+FUSE_DO_READDIRPLUS = 1 << 13
+FUSE_READDIRPLUS_AUTO = 1 << 14
+
+# struct fuse_in_header, fuse_out_header
+IN_HEADER = struct.Struct('=IIQQIIIHH')
+OUT_HEADER = struct.Struct('=IiQ')
+
+# struct fuse_init_in, fuse_getattr_in, fuse_read_in (also used for
+# fuse_write_in), fuse_getxattr_in (also used for fuse_setxattr_in)
+INIT_IN = struct.Struct('=IIII')
+GETATTR_IN = struct.Struct('=IIQ')
+READ_IN = struct.Struct('=QQIIQII')
+GETXATTR_IN = struct.Struct('=II')
+
+# Leading fields of struct fuse_direntplus. The entry is followed by the
+# name, padded to a multiple of 8 bytes.
+DIRENTPLUS = struct.Struct('=128xQQII')
+
+FILE_INODE = pyfuse3.ROOT_INODE + 1
+FILE_NAME = b'file'
+XATTR_NAME = b'user.bench'
+XATTR_VALUE = b'x' * 64
+TERMINATE_XATTR = b'user.bench.terminate'
+MAX_IO_SIZE = 128 * 1024
+SOCKET_BUFSIZE = 4 * 1024 * 1024
+
+
+class BenchFs(pyfuse3.Operations):
+    '''In-memory file system with a single file and a single directory'''
+
+    def __init__(self, dir_size=0):
+        super().__init__()
+        self.data = bytes(MAX_IO_SIZE)
+        self.dir_names = [ b'entry-%07d' % i for i in range(dir_size) ]
+        self.dir_attr = self._make_attr(FILE_INODE)
+        self.xattrs = { XATTR_NAME: XATTR_VALUE }
+
+    def _make_attr(self, inode):
+        entry = pyfuse3.EntryAttributes()
+        if inode == pyfuse3.ROOT_INODE:
+            entry.st_mode = (stat.S_IFDIR | 0o755)
+        else:
+            entry.st_mode = (stat.S_IFREG | 0o644)
+            entry.st_size = len(self.data)
+        entry.st_ino = inode
+        entry.st_atime_ns = entry.st_mtime_ns = entry.st_ctime_ns = 1
+        return entry
+
+    def _lookup(self, parent_inode, name):
+        if parent_inode != pyfuse3.ROOT_INODE or name != FILE_NAME:
+            raise pyfuse3.FUSEError(errno.ENOENT)
+        return self._make_attr(FILE_INODE)
+
+    def _getxattr(self, name):
+        try:
+            return self.xattrs[name]
+        except KeyError:
+            raise pyfuse3.FUSEError(pyfuse3.ENOATTR)
+
+    async def lookup(self, parent_inode, name, ctx):
+        return self._lookup(parent_inode, name)
+
+    async def getattr(self, inode, ctx):
+        return self._make_attr(inode)
+
+    async def read(self, fh, off, size):
+        return self.data[off:off+size]
+
+    async def write(self, fh, off, buf):
+        return len(buf)
+
+    async def readdir(self, fh, start_id, token):
+        names = self.dir_names
+        for i in range(start_id, len(names)):
+            if not pyfuse3.readdir_reply(token, names[i], self.dir_attr, i+1):
+                break
+
+    async def getxattr(self, inode, name, ctx):
+        return self._getxattr(name)
+
+    async def listxattr(self, inode, ctx):
+        return list(self.xattrs)
+
+    async def setxattr(self, inode, name, value, ctx):
+        if name == TERMINATE_XATTR:
+            pyfuse3.terminate()
+        else:
+            self.xattrs[name] = value
+
+
+class SyncBenchFs(BenchFs):
+    '''Like BenchFs, but with synchronous handlers where supported'''
+
+    def lookup(self, parent_inode, name, ctx):
+        return self._lookup(parent_inode, name)
+
+    def getattr(self, inode, ctx):
+        return self._make_attr(inode)
+
+    def read(self, fh, off, size):
+        return self.data[off:off+size]
+
+    def getxattr(self, inode, name, ctx):
+        return self._getxattr(name)
+
+    def listxattr(self, inode, ctx):
+        return list(self.xattrs)
+
+
+def make_request(opcode, nodeid, payload=b'', unique=1):
+    return IN_HEADER.pack(IN_HEADER.size + len(payload), opcode, unique,
+                          nodeid, os.getuid(), os.getgid(), os.getpid(),
+                          0, 0) + payload
+
+
+def read_reply(sock):
+    buf = sock.recv(MAX_IO_SIZE + 4096)
+    (len_, error, unique) = OUT_HEADER.unpack_from(buf)
+    if error != 0:
+        raise OSError(-error, 'request %d failed: %s'
+                      % (unique, os.strerror(-error)))
+    assert len_ == len(buf)
+    return buf[OUT_HEADER.size:]
+
+
+def request_for(case, size):
+    '''Return request that is sent repeatedly for *case*'''
+
+    if case == 'lookup':
+        return make_request(FUSE_LOOKUP, pyfuse3.ROOT_INODE, FILE_NAME + b'\0')
+    elif case == 'getattr':
+        return make_request(FUSE_GETATTR, FILE_INODE, GETATTR_IN.pack(0, 0, 0))
+    elif case == 'read':
+        return make_request(FUSE_READ, FILE_INODE,
+                            READ_IN.pack(0, 0, size, 0, 0, 0, 0))
+    elif case == 'write':
+        return make_request(FUSE_WRITE, FILE_INODE,
+                            READ_IN.pack(0, 0, size, 0, 0, 0, 0) + bytes(size))
+    elif case == 'getxattr':
+        return make_request(FUSE_GETXATTR, FILE_INODE,
+                            GETXATTR_IN.pack(4096, 0) + XATTR_NAME + b'\0')
+    elif case == 'listxattr':
+        return make_request(FUSE_LISTXATTR, FILE_INODE,
+                            GETXATTR_IN.pack(4096, 0))
+    elif case == 'setxattr':
+        return make_request(FUSE_SETXATTR, FILE_INODE,
+                            GETXATTR_IN.pack(len(XATTR_VALUE), 0)
+                            + XATTR_NAME + b'\0' + XATTR_VALUE)
+    raise ValueError('Unknown case: %s' % case)
+
+
+def run_requests(sock, req, count, depth):
+    '''Send *req* *count* times, with up to *depth* requests in flight'''
+
+    sent = 0
+    for _ in range(min(depth, count)):
+        sock.send(req)
+        sent += 1
+    for _ in range(count):
+        read_reply(sock)
+        if sent < count:
+            sock.send(req)
+            sent += 1
+
+
+def list_directory(sock, dir_size):
+    '''List directory, return number of readdirplus requests'''
+
+    off = 0
+    requests = 0
+    entries = 0
+    while True:
+        sock.send(make_request(FUSE_READDIRPLUS, pyfuse3.ROOT_INODE,
+                               READ_IN.pack(0, off, 4096, 0, 0, 0, 0)))
+        requests += 1
+        buf = read_reply(sock)
+        if not buf:
+            break
+        pos = 0
+        while pos < len(buf):
+            (_, off, namelen, _) = DIRENTPLUS.unpack_from(buf, pos)
+            pos += (DIRENTPLUS.size + namelen + 7) & ~7
+            entries += 1
+    assert entries == dir_size
+    return requests
+
+
+def client_main(sock, case, size, count, depth, conn):
+    sock.send(make_request(FUSE_INIT, 0, INIT_IN.pack(
+        FUSE_KERNEL_VERSION, FUSE_KERNEL_MINOR_VERSION, MAX_IO_SIZE,
+        FUSE_ASYNC_READ | FUSE_BIG_WRITES | FUSE_DO_READDIRPLUS
+        | FUSE_READDIRPLUS_AUTO)))
+    read_reply(sock)
+
+    stamp = time.perf_counter()
+    if case == 'readdir':
+        requests = 0
+        for _ in range(count):
+            requests += list_directory(sock, size)
+    else:
+        run_requests(sock, request_for(case, size), count, depth)
+        requests = count
+    duration = time.perf_counter() - stamp
+
+    sock.send(make_request(FUSE_SETXATTR, pyfuse3.ROOT_INODE,
+                           GETXATTR_IN.pack(0, 0) + TERMINATE_XATTR + b'\0'))
+    read_reply(sock)
+    conn.send((requests, duration))
+
+
+def count_blocks(fn, *args):
+    '''Call *fn*, return its result and the change in allocated blocks'''
+
+    gc.collect()
+    before = sys.getallocatedblocks()
+    res = fn(*args)
+    return (res, sys.getallocatedblocks() - before)
+
+
+def run_case(case, size, count, options):
+    '''Process requests for *case*, return (ops, requests, seconds, blocks)'''
+
+    (server_sock, client_sock) = socket.socketpair(socket.AF_UNIX,
+                                                   socket.SOCK_SEQPACKET)
+    for sock in (server_sock, client_sock):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFSIZE)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFSIZE)
+
+    mp = multiprocessing.get_context('fork')
+    (conn_recv, conn_send) = mp.Pipe(duplex=False)
+    client = mp.Process(target=client_main, args=(
+        client_sock, case, size, count, options.depth, conn_send))
+    client.start()
+    client_sock.close()
+
+    if options.sync:
+        fs = SyncBenchFs(size if case == 'readdir' else 0)
+    else:
+        fs = BenchFs(size if case == 'readdir' else 0)
+
+    # libfuse closes the fd when the session is destroyed
+    fd = server_sock.detach()
+    pyfuse3.init(fs, '/dev/fd/%d' % fd, set())
+    try:
+        (_, blocks) = count_blocks(trio.run, functools.partial(
+            pyfuse3.main, batch_size=options.batch_size))
+    finally:
+        pyfuse3.close(unmount=False)
+
+    (requests, duration) = conn_recv.recv()
+    client.join()
+    if client.exitcode != 0:
+        raise RuntimeError('Client process failed')
+    return (count, requests, duration, blocks)
+
+
+def run_entry_attributes(count):
+    '''Measure construction of EntryAttributes instances'''
+
+    def make():
+        entry = pyfuse3.EntryAttributes()
+        entry.st_mode = stat.S_IFREG | 0o644
+        entry.st_size = 42
+        entry.st_ino = FILE_INODE
+        entry.st_atime_ns = entry.st_mtime_ns = entry.st_ctime_ns = 1
+    (duration, blocks) = count_blocks(
+        functools.partial(timeit.timeit, make, number=count))
+    return (count, count, duration, blocks)
+
+
+# Name -> (case, size, fraction of --count)
+CASES = {
+    'getattr': ('getattr', 0, 1),
+    'lookup': ('lookup', 0, 1),
+    'read-4k': ('read', 4096, 1),
+    'read-64k': ('read', 64 * 1024, 1/4),
+    'read-128k': ('read', 128 * 1024, 1/8),
+    'write-4k': ('write', 4096, 1),
+    'write-64k': ('write', 64 * 1024, 1/4),
+    'write-128k': ('write', 128 * 1024, 1/8),
+    'readdir-1000': ('readdir', 1000, 1/500),
+    'readdir-10000': ('readdir', 10000, 1/5000),
+    'getxattr': ('getxattr', 0, 1),
+    'listxattr': ('listxattr', 0, 1),
+    'setxattr': ('setxattr', 0, 1),
+    'entry_attributes': ('entry_attributes', 0, 10),
+}
+
+
+def compare(results, baseline, threshold):
+    '''Print comparison with *baseline*, return True if there are regressions'''
+
+    regressed = False
+    print('%-20s %14s %14s %8s' % ('case', 'baseline', 'current', 'change'),
+          file=sys.stderr)
+    for (name, res) in results.items():
+        old = baseline.get(name)
+        if old is None:
+            print('%-20s %14s %14.0f' % (name, '-', res['ops_per_sec']),
+                  file=sys.stderr)
+            continue
+        change = res['ops_per_sec'] / old['ops_per_sec'] - 1
+        flag = ''
+        if change < -threshold:
+            regressed = True
+            flag = '  <-- regression'
+        print('%-20s %14.0f %14.0f %+7.1f%%%s' % (
+            name, old['ops_per_sec'], res['ops_per_sec'], 100 * change, flag),
+              file=sys.stderr)
+    return regressed
+
+
+def parse_args(args):
+    '''Parse command line'''
+
+    parser = ArgumentParser(
+        description='Measure pyfuse3 request processing overhead.')
+
+    parser.add_argument('cases', nargs='*', metavar='<case>',
+                        help='Cases to run (default: all). Available: %s'
+                        % ', '.join(CASES))
+    parser.add_argument('--count', type=int, default=20000,
+                        help='Number of requests for small requests (larger '
+                        'requests and directory listings are scaled down '
+                        'accordingly). Default: %(default)d')
+    parser.add_argument('--depth', type=int, default=16,
+                        help='Number of requests in flight. Default: %(default)d')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='*batch_size* for pyfuse3.main(). Default: %(default)d')
+    parser.add_argument('--sync', action='store_true', default=False,
+                        help='Use synchronous request handlers where possible')
+    parser.add_argument('--output', metavar='<file>',
+                        help='Write JSON results to <file> instead of stdout')
+    parser.add_argument('--compare', metavar='<file>',
+                        help='Compare results with those stored in <file>')
+    parser.add_argument('--threshold', type=float, default=0.05,
+                        help='Relative slowdown that is reported as regression '
+                        'by --compare. Default: %(default)s')
+
+    options = parser.parse_args(args)
+    for name in options.cases:
+        if name not in CASES:
+            parser.error('Unknown case: %s' % name)
+    if not options.cases:
+        options.cases = list(CASES)
+    return options
+
+
+def main():
+    options = parse_args(sys.argv[1:])
+
+    results = {}
+    for name in options.cases:
+        (case, size, scale) = CASES[name]
+        count = max(1, int(options.count * scale))
+        if case == 'entry_attributes':
+            (ops, requests, duration, blocks) = run_entry_attributes(count)
+        else:
+            (ops, requests, duration, blocks) = run_case(case, size, count,
+                                                         options)
+        results[name] = {
+            'ops': ops,
+            'requests': requests,
+            'seconds': duration,
+            'ops_per_sec': ops / duration,
+            'usec_per_request': 1e6 * duration / requests,
+            'allocated_blocks': blocks,
+            'blocks_per_request': blocks / requests }
+        print('%-20s %10.0f ops/s %8.2f µs/request %8.2f blocks/request' % (
+            name, ops / duration, 1e6 * duration / requests, blocks / requests),
+              file=sys.stderr)
+
+    report = {
+        'pyfuse3': pyfuse3.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': { 'depth': options.depth, 'batch_size': options.batch_size,
+                      'sync': options.sync },
+        'results': results }
+    if options.output:
+        with open(options.output, 'w') as fh:
+            json.dump(report, fh, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if options.compare:
+        with open(options.compare) as fh:
+            baseline = json.load(fh)['results']
+        if compare(results, baseline, options.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()